@@ -1,11 +1,85 @@
 import os
+from types import MappingProxyType
 
+# Backend phân ngưỡng hợp lệ của OMR.THRESHOLD_BACKEND (kiểm tra khi nạp profile)
+THRESHOLD_BACKENDS = ("gaussian", "mean", "local")
 
-class Config:
+
+class ConfigError(ValueError):
+    """Invalid profile, override or configuration value."""
+
+
+def _frozen_value(value):
+    """Read-only copy of a container value (lists -> tuples, dicts -> MappingProxyType), recursively."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_frozen_value(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    if isinstance(value, (dict, MappingProxyType)):
+        return MappingProxyType({k: _frozen_value(v) for k, v in value.items()})
+    return value
+
+
+def _thawed(value):
+    """Inverse of _frozen_value for pickling (MappingProxyType cannot be pickled)."""
+    if isinstance(value, tuple):
+        return tuple(_thawed(v) for v in value)
+    if isinstance(value, MappingProxyType):
+        return {k: _thawed(v) for k, v in value.items()}
+    return value
+
+
+class Section:
+    """
+    Base of Config and of its sections. After Config.freeze() any assignment
+    raises and container values are read-only copies (tuples,
+    MappingProxyType), so a configuration shipped to worker processes cannot
+    drift and the mutable class defaults cannot be changed through it.
+    """
+    _frozen = False
+
+    def __setattr__(self, name, value):
+        if self._frozen:
+            raise AttributeError(f"Config is frozen, cannot set {type(self).__name__}.{name}")
+        super().__setattr__(name, value)
+
+    def _freeze(self) -> None:
+        # Giá trị mặc định của lớp cũng được chép (bản chỉ đọc) vào instance, lớp không bị động tới
+        names = [name for name in vars(type(self)) if not name.startswith("_")] + list(vars(self))
+        for name in names:
+            value = getattr(self, name)
+            if callable(value) or isinstance(value, Section):
+                continue
+            frozen = _frozen_value(value)
+            if frozen is not value:
+                object.__setattr__(self, name, frozen)
+        object.__setattr__(self, "_frozen", True)
+
+    def __getstate__(self):
+        # Chỉ gửi các giá trị khác mặc định của lớp
+        defaults = vars(type(self))
+        return {name: _thawed(value) for name, value in vars(self).items()
+                if not (name in defaults and not name.startswith("_")
+                        and _frozen_value(defaults[name]) == value)}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._frozen:
+            self._freeze()
+
+
+class Config(Section):
     """
     Centralized configuration class for the OMR/OCR grading application.
     This class holds all parameters, paths, and settings to ensure a single
     source of truth and to avoid magic numbers in the core logic.
+
+    Defaults live in the section classes below. A profile (data/profiles/*.toml
+    or *.json) and command-line overrides are applied on top of them by
+    src/utils/config_profile.py; freeze() then precomputes the derived
+    constants and makes the whole tree read-only. A frozen Config pickles
+    only the values that differ from the class defaults, so it is cheap to
+    send to worker processes.
     """
 
     def __init__(self):
@@ -18,12 +92,51 @@ class Config:
         # --- BATCH PROCESSING ---
         self.Batch = self.BatchConfig()
 
+        # --- THREADS / CPU AFFINITY ---
+        self.Runtime = self.RuntimeConfig()
+
+        # --- RESULT IMAGE WRITER ---
+        self.Output = self.OutputConfig()
+
         # --- IMAGE PROCESSING ---
         self.ImageProcessing = self.ImageProcessingConfig()
 
+        # --- QUALITY GATE ---
+        self.Quality = self.QualityConfig()
+
+        # --- MULTIPLE SHEETS PER IMAGE ---
+        self.MultiSheet = self.MultiSheetConfig()
+
+        # --- ROSTER (SBD VALIDATION) ---
+        self.Roster = self.RosterConfig()
+
+        # --- DUPLICATE SCANS ---
+        self.Dedup = self.DedupConfig()
+
+        # --- LIVE CAMERA / VIDEO MODE ---
+        self.Live = self.LiveConfig()
+
+        # --- HANDWRITTEN SBD DIGITS ---
+        self.IdDigits = self.IdDigitsConfig()
+
+        # --- IDENTITY QR CODE ---
+        self.Identity = self.IdentityConfig()
+
+        # --- TEMPLATE EXTRACTION ---
+        self.Template = self.TemplateConfig()
+
         # --- OMR LOGIC ---
         self.OMR = self.OMRConfig()
 
+        # --- OMR CALIBRATION ---
+        self.Calibration = self.CalibrationConfig()
+
+        # --- BATCH ANALYTICS ---
+        self.Analytics = self.AnalyticsConfig()
+
+        # --- PDF REPORT ---
+        self.Report = self.ReportConfig()
+
         # --- OCR LOGIC ---
         self.OCR = self.OCRConfig()
 
@@ -33,7 +146,28 @@ class Config:
         # --- JSON KEYS ---
         self.JSON = self.JSONConfig()
 
-    class PathsConfig:
+        # --- DERIVED CONSTANTS (set by freeze()) ---
+        self.Derived = None
+
+    def sections(self):
+        """(name, section) of every configurable section, in declaration order."""
+        return [(name, value) for name, value in vars(self).items()
+                if isinstance(value, Section) and name != "Derived"]
+
+    def freeze(self) -> "Config":
+        """
+        Computes the derived constants (Derived) from the final values and makes
+        the configuration read-only. Call once the profile, the command-line
+        options and the batch calibration have been applied.
+        """
+        if self._frozen:
+            return self
+        self.Derived = self.DerivedConfig(self)
+        for section in [value for _, value in self.sections()] + [self.Derived, self]:
+            section._freeze()
+        return self
+
+    class PathsConfig(Section):
         """Configuration for all file and directory paths."""
         def __init__(self, root):
             self.PDF_PATH: str = os.path.join(root, "data/raw/Mau_de_thi_co_dap_an.pdf")
@@ -42,17 +176,72 @@ class Config:
             self.COORDINATES_PATH: str = os.path.join(root, "data/template/", "coordinates.json")
             self.BATCH_INPUT_DIR: str = os.path.join(root, "data/raw/batch_input/")
             self.BATCH_OUTPUT_DIR: str = os.path.join(root, "output/batch_output/")
+            self.SHEET_STORE_DIR: str = os.path.join(root, "output/sheet_store/")
+            self.BUNDLE_DIR: str = os.path.join(root, "output/bundle/")
+            # Danh sách thí sinh (CSV: sbd,name,...) - không có file thì bỏ qua đối chiếu
+            self.ROSTER_PATH: str = os.path.join(root, "data/roster/roster.csv")
+            # Mô hình nhận dạng chữ số viết tay (tools/train_digit_classifier.py)
+            self.DIGIT_MODEL_PATH: str = os.path.join(root, "data/models/id_digits.npz")
+            # Profile cấu hình (main.py --profile NAME): data/profiles/NAME.toml hoặc .json
+            self.PROFILE_DIR: str = os.path.join(root, "data/profiles/")
+            # Kết quả chuẩn của lô ảnh mẫu (tools/regression_check.py)
+            self.GOLDEN_RESULTS_PATH: str = os.path.join(root, "data/golden/sample_batch.json")
 
             self.SCORING_RESULT_IMAGE_NAME: str = "scoring_result.png"
             self.SCORE_IMAGE_NAME: str = "score.png"
+            self.THUMBNAIL_NAME: str = "thumb.jpg"
             self.OUTSIDE_AREA_IMAGE_NAME: str = "outside_area.png"
             self.OCR_RESULT_JSON_NAME: str = "ocr_results.json"
+            self.REJECT_LIST_NAME: str = "rejected.csv"
+            self.BATCH_STATISTICS_NAME: str = "batch_statistics.json"
+            self.JOURNAL_NAME: str = "journal.jsonl"
+            self.DUPLICATE_IDS_NAME: str = "duplicate_ids.csv"
+            self.DUPLICATE_SCANS_NAME: str = "duplicate_scans.csv"
+            self.LIVE_RESULTS_NAME: str = "live_results.json"
+            self.CALIBRATION_NAME: str = "calibration.json"
+            self.SBD_CONFLICTS_NAME: str = "sbd_conflicts.csv"
+            self.REPORT_NAME: str = "batch_report.pdf"
+            # Chỉ mục các phiếu đã chấm (giữ qua các lần chạy) để phát hiện phiếu scan trùng
+            self.SCAN_INDEX_PATH: str = os.path.join(root, "output/scan_index.jsonl")
 
-    class BatchConfig:
+    class BatchConfig(Section):
         """Configuration for batch processing mode."""
         BATCH_MODE: bool = True
+        # Số tiến trình con chấm bài (0 = chạy trong tiến trình chính, không cô lập crash)
+        WORKERS: int = 0
+        # fsync journal sau mỗi ảnh: an toàn khi máy tắt đột ngột, tốn ~1ms/ảnh
+        JOURNAL_FSYNC: bool = True
+        # Lưu ảnh đã warp vào kho memmap (Paths.SHEET_STORE_DIR) để chấm lại nhanh
+        SAVE_WARPED_STORE: bool = False
+        # True: lưu ảnh nhị phân nén bit (nhỏ hơn 8 lần), False: lưu ảnh xám
+        STORE_PACKED: bool = False
+        # Gói ảnh kết quả + JSON của mọi phiếu vào vài file lớn (Paths.BUNDLE_DIR)
+        # thay vì 6+ file và một thư mục mỗi phiếu
+        BUNDLE_OUTPUT: bool = False
+        BUNDLE_SHEETS_PER_PART: int = 1000
 
-    class ImageProcessingConfig:
+    class RuntimeConfig(Section):
+        """Thread budget of OpenCV, BLAS and torch when grading in parallel."""
+        # Đặt OMP/BLAS/torch/OpenCV threads theo số worker (tránh tranh chấp core)
+        LIMIT_THREADS: bool = True
+        # Số luồng thư viện mỗi tiến trình; 0 = số core / số worker
+        THREADS_PER_WORKER: int = 0
+        # Gắn mỗi worker vào dải core riêng (sched_setaffinity, chỉ Linux)
+        PIN_WORKERS: bool = False
+
+    class OutputConfig(Section):
+        """Background writer of the result images (src/utils/output_writer.py)."""
+        # Số luồng mã hoá + ghi ảnh kết quả; 0 = ghi ngay trong luồng chấm
+        THREADS: int = 2
+        # Số ảnh chờ ghi tối đa (giới hạn bộ nhớ); hàng đợi đầy thì luồng chấm phải chờ.
+        # Chế độ chấm trong tiến trình chính: nếu crash, tối đa chừng này ảnh của các
+        # phiếu đã ghi vào journal có thể bị thiếu (worker thì ghi xong mới trả kết quả)
+        MAX_PENDING: int = 32
+        # fsync ảnh trước khi đổi tên vào chỗ (an toàn khi mất điện), gộp theo lô
+        FSYNC: bool = False
+        FSYNC_BATCH: int = 32
+
+    class ImageProcessingConfig(Section):
         """Parameters for image pre-processing and manipulation."""
         STANDARD_SIZE: tuple[int, int] = (1000, 1400)
         PROCESSING_RESIZE_HEIGHT: int = 800
@@ -60,7 +249,122 @@ class Config:
         CANNY_THRESHOLD_2: int = 100
         CONTOUR_APPROX_EPSILON: float = 0.02
 
-    class OMRConfig:
+    class QualityConfig(Section):
+        """Thresholds of the fast pre-check that runs before warping and grading."""
+        ENABLED: bool = True
+        # Ảnh thu nhỏ dùng để kiểm tra (cùng chiều cao với bước dò biên)
+        THUMB_HEIGHT: int = 800
+        # Phương sai Laplacian tối thiểu (ảnh mờ nhòe ~ 10, ảnh rõ > 1000)
+        MIN_SHARPNESS: float = 100.0
+        MIN_BRIGHTNESS: float = 40.0
+        MAX_BRIGHTNESS: float = 250.0
+        # Tỷ lệ pixel cháy sáng (>= 250) tối đa
+        MAX_CLIPPED_RATIO: float = 0.98
+        # Khung phải chiếm ít nhất 20% ảnh; chỉ xét vài tứ giác lớn nhất
+        MIN_FRAME_AREA_RATIO: float = 0.2
+        MAX_FRAME_CANDIDATES: int = 6
+        # Tỷ lệ góc vuông đen khớp với mẫu (TL & BR đen, TR & BL trắng)
+        MIN_FRAME_CONFIDENCE: float = 0.75
+        # Ảnh trang đã warp để kiểm tra hướng (width, height)
+        CHECK_SIZE: tuple[int, int] = (400, 560)
+
+    class MultiSheetConfig(Section):
+        """Grading several sheets found in one image (A5 half-sheets, sheets side by side)."""
+        # Tìm mọi phiếu trong ảnh (đọc ảnh một lần, warp từng phiếu) thay vì chỉ phiếu lớn nhất
+        ENABLED: bool = False
+        MAX_SHEETS: int = 4
+        # Diện tích tối thiểu của một phiếu so với cả ảnh (4 phiếu xếp 2x2 ~ 0.2 mỗi phiếu)
+        MIN_AREA_RATIO: float = 0.05
+        # Số tứ giác ứng viên (mỗi phiếu cho 2-3: mép giấy, khung in, ...)
+        MAX_CANDIDATES: int = 24
+
+    class RosterConfig(Section):
+        """Matching of the bubbled SBD against the student roster."""
+        ENABLED: bool = True
+        # Số SBD gợi ý tối đa khi có nhiều SBD khớp
+        MAX_CANDIDATES: int = 5
+        # SBD đọc rõ nhưng không có trong danh sách -> gợi ý SBD sai khác đúng 1 chữ số
+        # (chỉ báo lại để kiểm tra, không bao giờ thay SBD đã đọc: thí sinh có thể chưa có tên)
+        ALLOW_CORRECTION: bool = False
+        # Ô được coi là đã tô khi vượt trung vị cột >= tỷ lệ này x độ tương phản
+        # điển hình của phiếu (ô trống có số in sẵn cũng đã ~PIXEL_THRESHOLD pixel)
+        MARK_CONTRAST_RATIO: float = 0.6
+        # Độ tương phản tối thiểu (pixel); thấp hơn -> coi như khối SBD bỏ trống
+        MIN_MARK_CONTRAST: float = 30.0
+        # Số chữ số đọc chắc chắn tối thiểu để dò SBD đọc thiếu trong danh sách
+        # (chỉ tô kép / tối đa một cột trống mới được thay SBD; còn lại chỉ là gợi ý)
+        MIN_CONFIDENT_DIGITS: int = 3
+
+    class DedupConfig(Section):
+        """Detection of sheets scanned twice (same batch or an earlier session)."""
+        # Tắt mặc định: ngưỡng chưa được kiểm chứng trên các lần scan lại thật
+        ENABLED: bool = False
+        # Số bit khác nhau tối đa của perceptual hash 64 bit (các phiếu cùng mẫu
+        # khác nhau ~6-14 bit, cùng một tờ chụp lại ~2-8 bit: chỉ loại phiếu khác hẳn)
+        MAX_HASH_DISTANCE: int = 10
+        # Số ô tô khác nhau tối đa ở phần mã đề + trả lời (một câu đọc khác = 2 ô);
+        # SBD (hoặc mã QR) phải trùng khớp hoàn toàn
+        MAX_FILL_DISTANCE: int = 2
+
+    class IdDigitsConfig(Section):
+        """Handwritten SBD digits in the boxes above the digit columns, checked against the bubbles."""
+        # Tắt mặc định: chữ số tin cậy vẫn có thể sai (và khung hình video cho cảnh báo
+        # giả); khi bật chỉ gắn cờ, SBD chỉ được sửa khi danh sách thí sinh xác nhận
+        ENABLED: bool = False
+        # Xác suất tối thiểu để tin một chữ số viết tay (thấp hơn -> "?")
+        MIN_CONFIDENCE: float = 0.9
+        # Lề cắt thêm quanh ô (px) để vẫn lấy trọn ô khi phiếu warp lệch vài px
+        BOX_MARGIN: int = 6
+
+    class LiveConfig(Section):
+        """Video mode (main.py --video): sheet tracking between frames."""
+        # Chiều rộng ảnh thu nhỏ dùng để theo dõi (px)
+        TRACK_WIDTH: int = 640
+        # Khi chưa thấy phiếu, dò toàn khung hình mỗi N khung
+        DETECT_INTERVAL: int = 3
+        # Điểm đặc trưng (goodFeaturesToTrack) trong phiếu
+        MAX_FEATURES: int = 150
+        FEATURE_MIN_DISTANCE: int = 8
+        MIN_TRACKED_POINTS: int = 20
+        # Optical flow Lucas-Kanade (cửa sổ, số tầng pyramid)
+        FLOW_WINDOW: int = 21
+        FLOW_LEVELS: int = 3
+        # Homography RANSAC: sai số tối đa (px) và tỷ lệ inlier tối thiểu (thấp hơn -> mất dấu)
+        RANSAC_THRESHOLD: float = 2.0
+        MIN_INLIER_RATIO: float = 0.5
+        # Cứ N khung lại khớp tứ giác theo dõi với contour trong vùng lân cận (chống trôi)
+        REFINE_INTERVAL: int = 10
+        REFINE_MARGIN: int = 20
+        REFINE_MAX_SHIFT: float = 8.0
+        # Phiếu đứng yên (góc dịch < STABLE_MOTION px ảnh nhỏ) đủ STABLE_FRAMES khung thì chấm
+        STABLE_MOTION: float = 1.0
+        STABLE_FRAMES: int = 6
+
+    class IdentityConfig(Section):
+        """Identity QR code printed on personalized sheets (see tools/generate_sheet.py)."""
+        # Đọc mã QR trong "qr_region" của template (nếu có) thay cho SBD tô
+        ENABLED: bool = True
+        # Nới rộng vùng cắt (px) để chịu được sai lệch warp
+        REGION_PADDING: int = 12
+
+    class TemplateConfig(Section):
+        """Parameters of the automatic template extraction from a blank sheet."""
+        # Độ tròn 4*pi*A/P^2 và tỷ lệ diện tích / hình tròn ngoại tiếp tối thiểu
+        # (hình vuông: ~0.79 / 0.64 nên bị loại)
+        MIN_CIRCULARITY: float = 0.85
+        MIN_FILL_RATIO: float = 0.85
+        # Bán kính ô tròn tối thiểu (px, trên ảnh STANDARD_SIZE) - loại chữ O, số 0
+        MIN_BUBBLE_RADIUS: float = 8.0
+        # Sai lệch bán kính cho phép so với trung vị
+        RADIUS_TOLERANCE: float = 0.25
+        # Hai ô cùng khối nếu tâm cách nhau < LINK_FACTOR x khoảng cách láng giềng (trung vị)
+        LINK_FACTOR: float = 1.8
+        # Khối chữ số (SBD, mã đề) có đúng 10 hàng 0-9
+        DIGIT_ROWS: int = 10
+        # Dòng kẻ điền thông tin phải dài ít nhất tỷ lệ này của chiều rộng trang
+        MIN_FIELD_LINE_RATIO: float = 0.08
+
+    class OMRConfig(Section):
         """Parameters for the Optical Mark Recognition (OMR) logic."""
         NUM_QUESTIONS_PER_COLUMN: int = 50 # Hoặc 20 tuỳ đề của bạn
         NUM_CHOICES_PER_QUESTION: int = 4
@@ -71,21 +375,92 @@ class Config:
         # [NÂNG CẤP] Ngưỡng pixel (Adaptive Threshold tạo ra ảnh nhị phân rất rõ nét 
         # nên ta có thể tăng ngưỡng này lên để lọc nhiễu tốt hơn)
         PIXEL_THRESHOLD: int = 180 
+
+        # Backend phân ngưỡng: "gaussian" (mặc định, ảnh chụp điện thoại),
+        # "mean" (box filter, nhanh hơn), "local" (so với nền cục bộ của từng ô,
+        # chỉ tính quanh các ô tròn - nhanh nhất, hợp với máy scan ánh sáng đều)
+        THRESHOLD_BACKEND: str = "gaussian"
+        THRESHOLD_BLOCK_SIZE: int = 51
+        THRESHOLD_C: int = 10
+        # Chỉ phân ngưỡng vùng bao các ô tròn (bỏ header, lề); kết quả ô tròn không đổi
+        THRESHOLD_ROI_ONLY: bool = True
+
+        # Chấm hai mức: phân ngưỡng & chấm mọi ô trên ảnh thu nhỏ COARSE_LEVELS tầng
+        # kim tự tháp (1 = nửa cạnh), chỉ nhóm ô lưng chừng mới phân ngưỡng lại ở độ
+        # phân giải đầy đủ (không áp dụng cho backend "local")
+        COARSE_TO_FINE: bool = False
+        COARSE_LEVELS: int = 1
+        # Lưng chừng: ô cao nhất có tỷ lệ tô cách ngưỡng (PIXEL_THRESHOLD / diện tích ô)
+        # dưới COARSE_MARGIN, hoặc ô thứ hai kém ô cao nhất dưới COARSE_RIVAL_MARGIN
+        COARSE_MARGIN: float = 0.15
+        COARSE_RIVAL_MARGIN: float = 0.15
         
         ANSWER_MAP: dict[str, int] = {'A': 0, 'B': 1, 'C': 2, 'D': 3}
 
-    class OCRConfig:
+        # Mã đề dùng cho file đáp án một cột (định dạng cũ "1,A")
+        DEFAULT_VERSION: str = "*"
+
+    class CalibrationConfig(Section):
+        """Per-batch choice of OMR.SCAN_RADIUS / PIXEL_THRESHOLD (main.py --calibrate)."""
+        ENABLED: bool = False
+        # Số phiếu đầu lô dùng để đo phân bố độ tô, tối thiểu MIN_SHEETS phiếu đạt chất lượng
+        SAMPLE_SHEETS: int = 30
+        MIN_SHEETS: int = 3
+        # Các bán kính quét thử (px trên ảnh chuẩn; viền ô tròn ~13px)
+        RADIUS_CANDIDATES: tuple[int, ...] = (12, 13, 14, 15, 16)
+        # Ngưỡng = đỉnh phân bố ô trống + BLANK_SIGMAS độ lệch chuẩn
+        BLANK_SIGMAS: float = 3.0
+        # Tỷ lệ ô tô tối thiểu để bán kính được xét (lô toàn phiếu trắng -> giữ cấu hình)
+        MIN_MARKED_RATIO: float = 0.02
+
+    class AnalyticsConfig(Section):
+        """Parameters of the batch statistics / item analysis."""
+        ENABLED: bool = True
+        # Nhóm trên / dưới cho chỉ số phân biệt (27% theo quy ước)
+        UPPER_LOWER_RATIO: float = 0.27
+        # Số câu sai giống hệt nhau tối thiểu để nghi vấn chép bài
+        MIN_SHARED_WRONG: int = 5
+        # Số dòng mỗi khối khi nhân ma trận tương đồng (giới hạn bộ nhớ)
+        SIMILARITY_BLOCK_SIZE: int = 1024
+
+    class ReportConfig(Section):
+        """Class-level PDF report (summary, score histogram, one page per student)."""
+        # Tạo Paths.REPORT_NAME sau khi chấm xong (hoặc dùng main.py --report); khi bật,
+        # mỗi phiếu lưu thêm ảnh thu nhỏ Paths.THUMBNAIL_NAME để báo cáo không phải giải mã PNG
+        ENABLED: bool = False
+        # Ảnh thu nhỏ của phiếu đã chấm nhúng vào PDF (JPEG, giữ nguyên không mã hoá lại)
+        THUMB_WIDTH: int = 500
+        JPEG_QUALITY: int = 70
+        # Độ rộng mỗi cột của biểu đồ điểm (thang 10)
+        HISTOGRAM_BIN: float = 1.0
+        # Số luồng giải mã / thu nhỏ ảnh (phiếu chưa có ảnh thu nhỏ) trước khi vẽ trang
+        THREADS: int = 4
+        # Số thí sinh mỗi file part (<report>_part001.pdf...): ReportLab giữ cả file trong bộ nhớ
+        # đến khi lưu, chia part thì bộ nhớ không tăng theo sĩ số. Lô lớn hơn một part: REPORT_NAME
+        # chỉ còn trang tổng hợp, liên kết tới các part. 0 = một file duy nhất (bộ nhớ tăng theo lô)
+        PART_SHEETS: int = 200
+
+    class OCRConfig(Section):
         """Parameters for the Optical Character Recognition (OCR) logic."""
         OCR_LANGUAGES: list[str] = ['vi', 'en']
         ALLOW_LIST: str = '0123456789'
 
-    class UIConfig:
+    class UIConfig(Section):
         """Parameters for UI elements and display settings."""
         DISPLAY_WIDTH: int = 400
         DISPLAY_HEIGHT: int = 350
 
-    class JSONConfig:
+    class JSONConfig(Section):
         """Keys used for serialization and deserialization of JSON data."""
         KEY_BUBBLE_ANCHORS: str = "bubble_anchors"
         KEY_OCR_REGIONS: str = "ocr_regions"
         KEY_INFO_BLOCK: str = "info_block"
+
+    class DerivedConfig(Section):
+        """Constants computed once from the other sections by Config.freeze() (not loadable)."""
+        def __init__(self, cfg):
+            from src.core.omr_engine import disk_offsets
+
+            # Mặt nạ đĩa quét (dy, dx) của bán kính đang dùng và các bán kính hiệu chỉnh
+            radii = sorted({cfg.OMR.SCAN_RADIUS, *cfg.Calibration.RADIUS_CANDIDATES})
+            self.DISK_OFFSETS: dict[int, tuple] = {radius: disk_offsets(radius) for radius in radii}
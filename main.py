@@ -1,17 +1,76 @@
+import argparse
 import os
-import cv2
-from config import Config
-from src.utils import file_io
-from src.core.processor import Processor
-from src.view import renderer  # Bổ sung import module renderer
+import time
+from config import ConfigError
+from src.utils import config_profile, file_io
 
-# Map ngược từ số sang chữ để in log cho dễ đọc (0->A, 1->B...)
-INDEX_TO_CHAR = {0: 'A', 1: 'B', 2: 'C', 3: 'D', -1: 'N/A'}
+# Các module nặng (OpenCV, NumPy) chỉ được import trong main(), sau khi parse
+# tham số, để `--help` và các lệnh nhẹ khởi động gần như tức thì.
 
-def main():
-    # 1. Khởi tạo
-    cfg = Config()
-    processor = Processor(cfg)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Chấm thi trắc nghiệm hàng loạt (OMR).")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip images already recorded in the progress journal")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Grade in N worker processes (isolates native crashes); 0 = in-process")
+    parser.add_argument("--roster", default=None,
+                        help="Student roster CSV (sbd,name,...) used to validate SBDs")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="Fit OMR scan radius / pixel threshold on the first sheets of the batch")
+    parser.add_argument("--video", default=None,
+                        help="Grade sheets held under a camera: device index (e.g. 0) or video file")
+    parser.add_argument("--report", action="store_true",
+                        help="Write the class PDF report (summary, histogram, one page per student)")
+    parser.add_argument("--multi-sheet", action="store_true",
+                        help="Detect and grade every answer sheet in each image (several sheets per photo)")
+    parser.add_argument("--profile", default=None,
+                        help="Config profile: a name in data/profiles (e.g. flatbed-fast, phone-robust) or a file")
+    parser.add_argument("--set", action="append", default=[], metavar="SECTION.KEY=VALUE",
+                        help="Override one config value, e.g. --set OMR.SCAN_RADIUS=15 (repeatable)")
+    parser.add_argument("--show", action="store_true",
+                        help="With --video, display the frames and the tracked sheet")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # 1. Khởi tạo: mặc định -> profile -> --set, kiểm tra hợp lệ trước khi chạy
+    try:
+        cfg = config_profile.configure(args.profile, args.set)
+    except ConfigError as e:
+        raise SystemExit(f"Config error: {e}")
+    if args.profile:
+        print(f"--> Profile: {args.profile}")
+    workers = cfg.Batch.WORKERS if args.workers is None else args.workers
+    if args.report:
+        cfg.Report.ENABLED = True
+    if args.multi_sheet:
+        cfg.MultiSheet.ENABLED = True
+
+    # Giới hạn luồng OpenMP / BLAS / torch phải đặt trước khi import NumPy, OpenCV
+    from src.utils import runtime
+    thread_plan = runtime.plan_threads(workers, cfg.Runtime.THREADS_PER_WORKER, cfg.Runtime.PIN_WORKERS)
+    if cfg.Runtime.LIMIT_THREADS:
+        runtime.set_thread_env(thread_plan["threads"])
+    else:
+        thread_plan = None
+
+    from src.core.answer_keys import AnswerKeySet
+    from src.core import analytics
+    from src.core import batch
+    from src.core.calibration import OMRCalibrator, config_thresholds
+    from src.core.roster import RosterIndex, find_duplicate_ids
+    from src.core.scan_index import ScanIndex
+    from src.utils.journal import ProgressJournal
+    from src.utils.artifact_bundle import ArtifactBundle
+    from src.utils.output_writer import OutputWriter
+    from src.utils.sheet_store import WarpedSheetStore
+
+    if thread_plan is not None:
+        runtime.configure_process(thread_plan["threads"])
+        print(f"--> Threads: {runtime.describe(thread_plan)}")
 
     # 2. Load Template
     template_path = cfg.Paths.COORDINATES_PATH
@@ -21,13 +80,44 @@ def main():
     template_data = file_io.load_json(template_path)
     print("--> Template loaded successfully.")
 
-    # 3. Load Answer Key
-    correct_answers = file_io.load_answer_key_from_csv(
-        cfg.Paths.ANSWER_KEY_PATH, cfg.OMR.ANSWER_MAP
+    # 3. Load Answer Key (một hoặc nhiều mã đề)
+    keys = file_io.load_answer_keys(
+        cfg.Paths.ANSWER_KEY_PATH, cfg.OMR.ANSWER_MAP, cfg.OMR.DEFAULT_VERSION
     )
-    if correct_answers is None:
+    if not keys:
         print("Error: Could not load answers.")
         return
+    answer_keys = AnswerKeySet(keys)
+
+    # Danh sách thí sinh (tuỳ chọn): đối chiếu và sửa SBD tô mờ / tô kép
+    roster = None
+    roster_path = args.roster or cfg.Paths.ROSTER_PATH
+    if cfg.Roster.ENABLED and template_data.get("mssv_bubbles") and os.path.exists(roster_path):
+        students = file_io.load_roster(roster_path)
+        if students:
+            roster = RosterIndex(students, len(template_data["mssv_bubbles"]))
+
+    # Ảnh kết quả gói trong bundle (tuỳ chọn) thay vì file lẻ
+    bundle = None
+    if cfg.Batch.BUNDLE_OUTPUT:
+        bundle = ArtifactBundle(cfg.Paths.BUNDLE_DIR, cfg.Batch.BUNDLE_SHEETS_PER_PART)
+        print(f"--> Result images will be bundled in {cfg.Paths.BUNDLE_DIR}")
+
+    # Chế độ camera / video: chấm từng phiếu khi đứng yên trước camera
+    if args.video is not None:
+        from src.core.live_grader import LiveGrader
+
+        output_dir = cfg.Paths.BATCH_OUTPUT_DIR
+        os.makedirs(output_dir, exist_ok=True)
+        source = int(args.video) if args.video.isdigit() else args.video
+        cfg.freeze()
+        live = LiveGrader(cfg, template_data, answer_keys, output_dir, roster, bundle)
+        records = live.run(source, show=args.show)
+        file_io.save_json(records, os.path.join(output_dir, cfg.Paths.LIVE_RESULTS_NAME))
+        if bundle is not None:
+            bundle.close()
+        print("COMPLETE!")
+        return
 
     # 4. Lấy ảnh input
     input_dir = cfg.Paths.BATCH_INPUT_DIR
@@ -37,93 +127,229 @@ def main():
         return
 
     print(f"--> Found {len(image_files)} exams.")
-    print("-" * 50)
 
     # 5. Xử lý
     output_dir = cfg.Paths.BATCH_OUTPUT_DIR
     os.makedirs(output_dir, exist_ok=True)
 
-    for img_name in image_files:
-        img_path = os.path.join(input_dir, img_name)
-        print(f"\nProcessing: {img_name}...")
-        
-        try:
-            # Gọi Processor để xử lý logic chấm điểm và OCR
-            results, warped_img = processor.process_exam_paper(
-                img_path, template_data, correct_answers
-            )
+    # Journal ghi lại từng ảnh đã xong -> chạy lại với --resume sẽ bỏ qua chúng
+    journal = ProgressJournal(
+        os.path.join(output_dir, cfg.Paths.JOURNAL_NAME), resume=args.resume,
+        fsync=cfg.Batch.JOURNAL_FSYNC
+    )
+    done = journal.completed(batch.FINAL_STATUSES)
+    pending = [f for f in image_files if f not in done]
+    if args.resume:
+        print(f"--> Resume: {len(done)} image(s) already done, {len(pending)} left.")
 
-            # --- CHUẨN BỊ DỮ LIỆU ĐỂ VẼ (RENDER) ---
-            user_ans_dict = results.get('answers', {})
-            user_ans_list = []
-            results_bool_list = []
-            
-            print("\n [DETAILED REPORT]")
-            for i, correct_idx in enumerate(correct_answers):
-                user_idx = user_ans_dict.get(i, -1)
-                user_ans_list.append(user_idx)
-                
-                # Kiểm tra đúng sai
-                is_correct = (user_idx == correct_idx)
-                results_bool_list.append(is_correct)
-                
-                user_char = INDEX_TO_CHAR.get(user_idx, '?')
-                correct_char = INDEX_TO_CHAR.get(correct_idx, '?')
-                status = "✅" if is_correct else f"❌ (Expected: {correct_char})"
-                if user_idx == -1: status = "⚪ BLANK"
-                print(f" Q{i+1:02}: You: {user_char} | Key: {correct_char} -> {status}")
-
-            sbd = results.get("sbd", "Unknown")
-            raw_score = results.get('score_raw', 0)
-            final_score = (raw_score / len(correct_answers)) * 10 # Tính thang điểm 10
-
-            print(f"\n + SBD: {sbd}")
-            print(f" + Raw Score: {raw_score} / {len(correct_answers)}")
-            print(f" + Final Score: {final_score:.2f} / 10")
-
-            # --- BƯỚC VẼ KẾT QUẢ (RENDER VIEW) ---
-            # 1. Vẽ vòng tròn xanh/đỏ lên ảnh phiếu thi
-            marked_img = renderer.draw_results_on_image(
-                warped_img,
-                user_ans_list,
-                correct_answers,
-                results_bool_list,
-                template_data.get('answer_bubbles', []),
-                cfg.OMR
-            )
+    # Hiệu chỉnh ngưỡng OMR theo lô; lưu lại để --resume chấm tiếp với đúng giá trị cũ
+    calibration = None
+    calibration_path = os.path.join(output_dir, cfg.Paths.CALIBRATION_NAME)
+    if args.calibrate or cfg.Calibration.ENABLED:
+        if args.resume and os.path.exists(calibration_path):
+            calibration = file_io.load_json(calibration_path)
+        else:
+            calibrator = OMRCalibrator(cfg)
+            sample = [os.path.join(input_dir, f) for f in image_files[:cfg.Calibration.SAMPLE_SHEETS]]
+            calibration = calibrator.fit(calibrator.binarize_images(sample, template_data), template_data)
+            if calibration is None:
+                print("Warning: not enough usable sheets to calibrate, keeping the configured OMR thresholds.")
+            else:
+                file_io.save_json(calibration, calibration_path)
+    if calibration is not None:
+        OMRCalibrator.apply(cfg, calibration)
+    omr_thresholds = calibration or config_thresholds(cfg)
+    # Cấu hình cuối cùng: tính sẵn các hằng số dẫn xuất, không đổi nữa khi gửi sang worker
+    cfg.freeze()
+    print(f"--> OMR: scan radius {omr_thresholds['scan_radius']} px, "
+          f"pixel threshold {omr_thresholds['pixel_threshold']} ({omr_thresholds['source']})")
+    print("-" * 50)
+
+    store = None
+    if cfg.Batch.SAVE_WARPED_STORE:
+        store = WarpedSheetStore(
+            cfg.Paths.SHEET_STORE_DIR, cfg.ImageProcessing.STANDARD_SIZE, cfg.Batch.STORE_PACKED
+        )
+        print(f"--> Warped sheets will be stored in {cfg.Paths.SHEET_STORE_DIR}")
+
+    # Chỉ mục phiếu đã chấm (cả các lần chạy trước) -> bỏ qua phiếu scan hai lần
+    scan_index = None
+    if cfg.Dedup.ENABLED:
+        scan_index = ScanIndex(
+            cfg.Paths.SCAN_INDEX_PATH, cfg.Dedup.MAX_HASH_DISTANCE, cfg.Dedup.MAX_FILL_DISTANCE,
+            fsync=cfg.Batch.JOURNAL_FSYNC
+        )
+        if len(scan_index):
+            print(f"--> Scan index: {len(scan_index)} sheet(s) graded before.")
 
-            # 2. Tạo ảnh bảng điểm (score.png)
-            score_card = renderer.create_score_display(
-                final_score, raw_score, len(correct_answers)
+    # Báo cáo PDF: trang của từng thí sinh được thêm ngay khi phiếu chấm xong,
+    # trang tổng hợp viết sau cùng (ReportLab giữ cả tài liệu trong bộ nhớ đến khi lưu)
+    report = None
+    if cfg.Report.ENABLED:
+        from src.view.pdf_report import BatchReport, add_stored_sheets, stored_image_loader
+
+        report_path = os.path.join(output_dir, cfg.Paths.REPORT_NAME)
+        report = BatchReport(cfg, report_path)
+        # Phiếu đã chấm ở lần chạy trước (--resume): lấy lại ảnh đã lưu
+        earlier = [r for f in image_files if f in done for r in journal.records.get(f, [])
+                   if r["status"] == batch.STATUS_OK]
+        if earlier:
+            add_stored_sheets(
+                report, earlier,
+                stored_image_loader(
+                    output_dir, [cfg.Paths.THUMBNAIL_NAME, cfg.Paths.SCORING_RESULT_IMAGE_NAME], bundle
+                ),
+                cfg.Report.THREADS
             )
 
-            # --- LƯU KẾT QUẢ THEO ĐÚNG CẤU HÌNH BÁO CÁO ---
-            base_name = os.path.splitext(img_name)[0]
-            
-            # Lưu ảnh phiếu thi đã chấm (scoring_result.png)
-            res_name = f"{base_name}_{cfg.Paths.SCORING_RESULT_IMAGE_NAME}"
-            cv2.imwrite(os.path.join(output_dir, res_name), marked_img)
-            
-            # Lưu bảng điểm (score.png)
-            score_name = f"{base_name}_{cfg.Paths.SCORE_IMAGE_NAME}"
-            cv2.imwrite(os.path.join(output_dir, score_name), score_card)
-
-            # Lưu các ảnh ROI thông tin (Name, Class...)
-            info_dir = os.path.join(output_dir, base_name + "_info")
-            os.makedirs(info_dir, exist_ok=True)
-            if "info_images" in results:
-                for key, roi_img in results["info_images"].items():
-                    cv2.imwrite(os.path.join(info_dir, f"{key}.jpg"), roi_img)
-
-            print(f" --> Saved results to {output_dir}")
-
-        except Exception as e:
-            print(f" !!! Error: {str(e)}")
-            import traceback
-            traceback.print_exc()
+    meter = runtime.ParallelismMeter()
+
+    def on_record(record):
+        meter.add(record.pop("_timing", None))
+        if scan_index is not None and record["status"] in (batch.STATUS_OK, batch.STATUS_NO_KEY):
+            # Hai worker có thể chấm cùng lúc hai bản scan của một phiếu: kiểm tra lại ở đây
+            original = batch.find_duplicate_scan(scan_index, record)
+            if original is not None:
+                print(f" !!! {record['image']} is a duplicate scan of {original['image']}, record dropped.")
+                # Worker đã ghi ảnh kết quả trước khi biết là trùng: xoá đi
+                batch.remove_outputs(record)
+                keep = ("image", "sheet_id", "sheet", "sheets", "ident", "phash", "fill")
+                record = {k: record[k] for k in keep if k in record}
+                record.update(status=batch.STATUS_DUPLICATE, duplicate_of=original["image"])
+            else:
+                scan_index.add(record)
+
+        record.pop("_outputs", None)
+        artifacts = record.pop("_artifacts", None)
+        if bundle is not None and artifacts and record["status"] == batch.STATUS_OK:
+            batch.pack_record(bundle, record, artifacts)
+
+        thumb = record.pop("_thumb", None) or (artifacts or {}).get(cfg.Paths.THUMBNAIL_NAME)
+        if report is not None and record["status"] == batch.STATUS_OK:
+            report.add_sheet(record, report.thumbnail(thumb, record["sheet_id"]))
+
+        # Lưu trang đã warp để lần phân tích sau không phải đọc/warp lại
+        page = record.pop("_page", None)
+        if store is not None and page is not None:
+            store.append(record["sheet_id"], page)
+        journal.append(record)
+
+    pending_paths = [os.path.join(input_dir, f) for f in pending]
+    if workers > 0:
+        print(f"--> Grading in {workers} worker process(es).")
+        writes = batch.run_in_workers(
+            pending_paths, workers,
+            (cfg, template_data, answer_keys, output_dir, store is not None, roster, scan_index, thread_plan),
+            on_record
+        )
+    else:
+        grader = batch.SheetGrader(cfg, template_data, answer_keys, output_dir, roster, scan_index)
+        for img_path in pending_paths:
+            for record in grader.grade_image(img_path, keep_page=store is not None):
+                on_record(record)
+        # Chờ các ảnh kết quả còn trong hàng đợi ghi
+        grader.writer.close()
+        writes = OutputWriter.merge_stats([grader.writer.stats()])
+    if writes["files"]:
+        # Nhiều worker: p95 là giá trị lớn nhất trong các worker
+        print(f"--> Output: {writes['files']} file(s) from {writes['writers']} writer(s), "
+              f"{writes['bytes'] / 1e6:.1f} MB | "
+              f"write {writes['latency_mean_ms']:.1f} ms mean, {writes['latency_p95_ms']:.1f} ms p95 | "
+              f"queue max {writes['queue_max']}/{writes['queue_limit']} | "
+              f"grading blocked {writes['waits']}x, {writes['wait_s']:.2f} s")
+
+    if store is not None:
+        store.close()
+    if scan_index is not None:
+        scan_index.close()
+    if bundle is not None:
+        bundle.close()
+    journal.close()
+
+    perf = meter.report()
+    if perf["sheets"]:
+        print(f"--> {perf['sheets']} image(s) in {perf['elapsed_s']:.1f} s ({perf['sheets_per_s']:.2f}/s) | "
+              f"effective parallelism {perf['parallelism']:.2f} of {max(workers, 1)} | "
+              f"CPU {perf['cpu_cores_used']:.2f} core(s)")
+
+    # Kết quả của cả lô = journal (gồm cả các ảnh đã chấm ở lần chạy trước)
+    records = [r for f in image_files for r in journal.records.get(f, [])]
+    graded = [r for r in records if r["status"] == batch.STATUS_OK]
+    rejected = [[r["image"], r["reason"], r["error"]] for r in records if r["status"] == batch.STATUS_REJECTED]
+    failed = [r for r in records if r["status"] in (batch.STATUS_ERROR, batch.STATUS_CRASHED)]
+    duplicate_scans = [[r["image"], r["duplicate_of"]] for r in records if r["status"] == batch.STATUS_DUPLICATE]
+
+    # 6. Thống kê cả lô (độ khó, độ phân biệt, phương án nhiễu, nghi vấn chép bài)
+    if cfg.Analytics.ENABLED and graded:
+        width = max(r["num_questions"] for r in graded)
+        stats = analytics.batch_statistics(
+            [r["sheet_id"] for r in graded],
+            analytics.build_answer_matrix([r["answers"] for r in graded], width),
+            analytics.build_answer_matrix([r["answer_key"] for r in graded], width),
+            [r["version"] for r in graded],
+            cfg.OMR.NUM_CHOICES_PER_QUESTION,
+            cfg.Analytics.UPPER_LOWER_RATIO,
+            cfg.Analytics.MIN_SHARED_WRONG,
+            cfg.Analytics.SIMILARITY_BLOCK_SIZE,
+        )
+        stats["omr_thresholds"] = {k: v for k, v in omr_thresholds.items() if k != "candidates"}
+        dist = stats["scores"]
+        print(f"--> Batch: {dist['count']} sheets | mean {dist['mean']:.2f} | "
+              f"median {dist['median']:.1f} | min {dist['min']} | max {dist['max']}")
+        for version, group in stats["versions"].items():
+            for pair in group["similar_pairs"]:
+                print(f" ! Similar answers ({version}): {pair['a']} <-> {pair['b']} "
+                      f"({pair['shared_wrong']} identical wrong answers)")
+        file_io.save_json(stats, os.path.join(output_dir, cfg.Paths.BATCH_STATISTICS_NAME))
 
     print("-" * 50)
+    # Nhiều bài cùng một SBD (tô nhầm SBD của bạn khác, nộp trùng...)
+    duplicates = find_duplicate_ids(graded)
+    if duplicates:
+        print(f"--> {len(duplicates)} SBD(s) appear on more than one sheet:")
+        for sbd, images in duplicates.items():
+            print(f" ! {sbd}: {', '.join(images)}")
+        file_io.save_csv(
+            [[sbd, len(images), ";".join(images)] for sbd, images in duplicates.items()],
+            os.path.join(output_dir, cfg.Paths.DUPLICATE_IDS_NAME),
+            header=["sbd", "count", "images"]
+        )
+    # SBD viết tay khác SBD tô: cần kiểm tra lại bằng mắt
+    sbd_conflicts = [[r["image"], r["sbd"], r["sbd_written"], ";".join(map(str, r["sbd_conflicts"]))]
+                     for r in graded if r.get("sbd_conflicts")]
+    if sbd_conflicts:
+        print(f"--> {len(sbd_conflicts)} sheet(s) with a handwritten SBD that differs from the bubbles.")
+        file_io.save_csv(
+            sbd_conflicts, os.path.join(output_dir, cfg.Paths.SBD_CONFLICTS_NAME),
+            header=["image", "sbd", "written", "positions"]
+        )
+    if duplicate_scans:
+        print(f"--> {len(duplicate_scans)} duplicate scan(s) skipped.")
+        file_io.save_csv(
+            duplicate_scans, os.path.join(output_dir, cfg.Paths.DUPLICATE_SCANS_NAME),
+            header=["image", "duplicate_of"]
+        )
+    if rejected:
+        print(f"--> {len(rejected)} image(s) rejected by the quality gate.")
+        file_io.save_csv(
+            rejected, os.path.join(output_dir, cfg.Paths.REJECT_LIST_NAME),
+            header=["image", "reason", "detail"]
+        )
+    if failed:
+        print(f"--> {len(failed)} image(s) failed; rerun with --resume to retry them.")
+
+    # Báo cáo PDF của cả lớp: các trang thí sinh đã có, thêm trang tổng hợp rồi lưu file
+    if report is not None:
+        start = time.perf_counter()
+        notes = [f"{label}: {count}" for label, count in (
+            ("Rejected by the quality gate", len(rejected)), ("Duplicate scans", len(duplicate_scans)),
+            ("Failed", len(failed))) if count]
+        report.add_summary(notes)
+        report.close()
+        parts = f", student pages in {len(report.parts)} part file(s)" if report.parts else ""
+        print(f"--> PDF report: {report_path} ({report.pages} pages{parts}, summary + save "
+              f"{time.perf_counter() - start:.1f} s)")
     print("COMPLETE!")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
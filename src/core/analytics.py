@@ -0,0 +1,196 @@
+import numpy as np
+from typing import Any, Dict, List, Sequence
+
+
+def build_answer_matrix(rows: Sequence[Sequence[int]], num_questions: int | None = None) -> np.ndarray:
+    """
+    Stacks per-sheet answer (or key) lists into one matrix.
+
+    Args:
+        rows: One list of choice indices per sheet (-1 = blank).
+        num_questions (int, optional): Width of the matrix; defaults to the longest row.
+
+    Returns:
+        np.ndarray: int16 matrix (num_sheets, num_questions), padded with -1.
+    """
+    width = num_questions if num_questions is not None else max((len(r) for r in rows), default=0)
+    matrix = np.full((len(rows), width), -1, dtype=np.int16)
+    for i, row in enumerate(rows):
+        n = min(len(row), width)
+        matrix[i, :n] = row[:n]
+    return matrix
+
+
+def correctness_matrix(answers: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    """Boolean (num_sheets, num_questions): answer matches a valid key entry."""
+    return (answers == keys) & (keys >= 0)
+
+
+def item_difficulty(correct: np.ndarray) -> np.ndarray:
+    """Proportion of students answering each question correctly (p-value)."""
+    if correct.shape[0] == 0:
+        return np.zeros(correct.shape[1])
+    return correct.mean(axis=0)
+
+
+def discrimination_index(correct: np.ndarray, group_ratio: float = 0.27) -> np.ndarray:
+    """
+    Upper-lower discrimination index per question: p(upper group) - p(lower group),
+    where the groups are the top / bottom `group_ratio` of students by total score.
+    """
+    n = correct.shape[0]
+    group = max(int(round(n * group_ratio)), 1)
+    if n < 2:
+        return np.zeros(correct.shape[1])
+    order = np.argsort(correct.sum(axis=1), kind="stable")
+    lower = correct[order[:group]].mean(axis=0)
+    upper = correct[order[-group:]].mean(axis=0)
+    return upper - lower
+
+
+def distractor_frequencies(answers: np.ndarray, num_choices: int) -> np.ndarray:
+    """
+    Counts how often each choice was picked per question with a single bincount.
+
+    Returns:
+        np.ndarray: (num_questions, num_choices + 1); the last column counts blanks.
+    """
+    num_questions = answers.shape[1]
+    # Ô trống (-1) và lựa chọn ngoài phạm vi dồn vào cột cuối
+    choice = np.where((answers >= 0) & (answers < num_choices), answers, num_choices)
+    flat = (np.arange(num_questions) * (num_choices + 1))[None, :] + choice
+    counts = np.bincount(flat.ravel(), minlength=num_questions * (num_choices + 1))
+    return counts.reshape(num_questions, num_choices + 1)
+
+
+def score_distribution(scores: np.ndarray, max_score: int) -> Dict[str, Any]:
+    """Summary statistics and a per-raw-score histogram."""
+    if scores.size == 0:
+        return {"count": 0}
+    return {
+        "count": int(scores.size),
+        "mean": float(scores.mean()),
+        "std": float(scores.std()),
+        "min": int(scores.min()),
+        "max": int(scores.max()),
+        "median": float(np.median(scores)),
+        "quartiles": [float(q) for q in np.percentile(scores, [25, 50, 75])],
+        "histogram": np.bincount(scores, minlength=max_score + 1).tolist(),
+    }
+
+
+def similar_answer_pairs(answers: np.ndarray, keys: np.ndarray, num_choices: int,
+                         min_shared_wrong: int, block_size: int = 1024) -> List[Dict[str, int]]:
+    """
+    Finds pairs of students sharing many identical wrong answers (copying signal).
+
+    Wrong answers are one-hot encoded into a (num_students, Q * C) matrix X, and
+    X @ X.T counts the identical wrong answers of every pair. The product is
+    computed one row block at a time against the rows after it, so memory stays
+    at block_size x num_students and no Python loop runs over pairs.
+
+    Returns:
+        list: {"a", "b", "shared_wrong", "shared_answers"} with row indices,
+        sorted by shared_wrong descending.
+    """
+    n, num_questions = answers.shape
+    if n < 2:
+        return []
+
+    wrong = (answers >= 0) & (answers < num_choices) & (answers != keys)
+    cols = np.arange(num_questions)[None, :] * num_choices + np.clip(answers, 0, num_choices - 1)
+    onehot_wrong = np.zeros((n, num_questions * num_choices), dtype=np.float32)
+    rows_idx, q_idx = np.nonzero(wrong)
+    onehot_wrong[rows_idx, cols[rows_idx, q_idx]] = 1
+
+    answered = (answers >= 0) & (answers < num_choices)
+    onehot_all = np.zeros_like(onehot_wrong)
+    rows_idx, q_idx = np.nonzero(answered)
+    onehot_all[rows_idx, cols[rows_idx, q_idx]] = 1
+
+    pairs = []
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        # Chỉ so với các dòng phía sau -> mỗi cặp tính đúng một lần
+        shared_wrong = onehot_wrong[start:stop] @ onehot_wrong[start:].T
+        local_a, local_b = np.nonzero(np.triu(shared_wrong >= min_shared_wrong, k=1))
+        if local_a.size == 0:
+            continue
+        shared_all = np.einsum(
+            "ij,ij->i", onehot_all[start + local_a], onehot_all[start + local_b]
+        )
+        for a, b, sw, sa in zip(local_a, local_b, shared_wrong[local_a, local_b], shared_all):
+            pairs.append({
+                "a": int(start + a),
+                "b": int(start + b),
+                "shared_wrong": int(sw),
+                "shared_answers": int(sa),
+            })
+
+    pairs.sort(key=lambda p: p["shared_wrong"], reverse=True)
+    return pairs
+
+
+def item_analysis(answers: np.ndarray, keys: np.ndarray, num_choices: int,
+                  group_ratio: float = 0.27) -> List[Dict[str, Any]]:
+    """Per-question difficulty, discrimination and choice frequencies."""
+    correct = correctness_matrix(answers, keys)
+    difficulty = item_difficulty(correct)
+    discrimination = discrimination_index(correct, group_ratio)
+    frequencies = distractor_frequencies(answers, num_choices)
+
+    items = []
+    for q in range(answers.shape[1]):
+        items.append({
+            "question": q + 1,
+            "difficulty": float(difficulty[q]),
+            "discrimination": float(discrimination[q]),
+            "choice_counts": frequencies[q, :num_choices].tolist(),
+            "blank_count": int(frequencies[q, num_choices]),
+        })
+    return items
+
+
+def batch_statistics(sheet_ids: List[str], answers: np.ndarray, keys: np.ndarray,
+                     versions: List[str | None], num_choices: int, group_ratio: float = 0.27,
+                     min_shared_wrong: int = 5, block_size: int = 1024) -> Dict[str, Any]:
+    """
+    Computes the whole batch report from the answer matrix.
+
+    Item analysis and copy detection run per exam version, because shuffled
+    versions do not share question order. The score distribution covers the
+    whole batch.
+
+    Args:
+        sheet_ids: One id per row (e.g. the image base name).
+        answers: (num_sheets, num_questions) chosen indices, -1 = blank.
+        keys: Same shape, the key each sheet was graded against.
+        versions: Version code per sheet (None when the sheet has no version block).
+
+    Returns:
+        dict: JSON-serializable statistics.
+    """
+    correct = correctness_matrix(answers, keys)
+    scores = correct.sum(axis=1)
+    max_score = int((keys >= 0).sum(axis=1).max()) if len(keys) else 0
+
+    report: Dict[str, Any] = {
+        "num_sheets": len(sheet_ids),
+        "scores": score_distribution(scores, max_score),
+        "versions": {},
+    }
+
+    version_codes = np.array(["" if v is None else str(v) for v in versions])
+    for code in sorted(set(version_codes.tolist())):
+        rows = np.nonzero(version_codes == code)[0]
+        group_answers, group_keys = answers[rows], keys[rows]
+        pairs = similar_answer_pairs(group_answers, group_keys, num_choices, min_shared_wrong, block_size)
+        for pair in pairs:
+            pair["a"] = sheet_ids[rows[pair["a"]]]
+            pair["b"] = sheet_ids[rows[pair["b"]]]
+        report["versions"][code or "default"] = {
+            "num_sheets": int(rows.size),
+            "items": item_analysis(group_answers, group_keys, num_choices, group_ratio),
+            "similar_pairs": pairs,
+        }
+    return report
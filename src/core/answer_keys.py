@@ -0,0 +1,44 @@
+import numpy as np
+from typing import Dict, List
+
+
+class AnswerKeySet:
+    """
+    Holds the answer keys of every exam version as one padded index matrix,
+    so picking the key of a sheet is a dictionary lookup plus a row view and
+    mixing versions in a batch costs nothing extra.
+    """
+
+    def __init__(self, keys: Dict[str, List[int]]):
+        """
+        Args:
+            keys: Map from version code (e.g. "101") to answers as choice indices.
+        """
+        self.codes: List[str] = list(keys)
+        self.lengths = np.array([len(keys[c]) for c in self.codes], dtype=np.intp)
+
+        width = int(self.lengths.max()) if self.codes else 0
+        # Ô đệm = -1 (không có đáp án), không bao giờ được tính là đúng
+        self.matrix = np.full((len(self.codes), width), -1, dtype=np.intp)
+        for row, code in enumerate(self.codes):
+            self.matrix[row, :self.lengths[row]] = keys[code]
+
+        self._rows = {code: row for row, code in enumerate(self.codes)}
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def select(self, version: str | None) -> int:
+        """
+        Returns the matrix row for a bubbled version code, or -1 if unknown.
+        A set with a single key matches every sheet, like the old single CSV.
+        """
+        if len(self.codes) == 1:
+            return 0
+        if version is None:
+            return -1
+        return self._rows.get(version, -1)
+
+    def key(self, row: int) -> np.ndarray:
+        """Returns the (unpadded) key of a matrix row as a view."""
+        return self.matrix[row, :self.lengths[row]]
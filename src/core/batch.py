@@ -0,0 +1,544 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List
+
+import cv2
+
+from src.core.processor import Processor
+from src.core.quality_gate import ImageRejectedError
+from src.core.roster import ROSTER_CORRECTED, ROSTER_NOT_FOUND, ROSTER_SUGGESTED
+from src.core.scan_index import fill_fingerprint, identity_key, perceptual_hash
+from src.utils import runtime
+from src.utils.output_writer import OutputWriter
+from src.view import renderer
+
+# Map ngược từ số sang chữ để in log cho dễ đọc (0->A, 1->B...)
+INDEX_TO_CHAR = {0: 'A', 1: 'B', 2: 'C', 3: 'D', -1: 'N/A'}
+
+# Trạng thái của một ảnh trong journal
+STATUS_OK = "ok"
+STATUS_REJECTED = "rejected"
+STATUS_NO_KEY = "no_key"
+STATUS_ERROR = "error"
+STATUS_CRASHED = "crashed"
+STATUS_DUPLICATE = "duplicate"
+# Các trạng thái không cần chạy lại khi --resume (lỗi Python / crash thì thử lại)
+FINAL_STATUSES = (STATUS_OK, STATUS_REJECTED, STATUS_NO_KEY, STATUS_DUPLICATE)
+
+
+class SheetGrader:
+    """
+    Grades one image end to end (quality gate, OMR, render, save) and returns a
+    JSON-serializable record. Used in-process and inside worker processes.
+    """
+
+    def __init__(self, cfg, template_data, answer_keys, output_dir, roster=None, scan_index=None):
+        self.cfg = cfg
+        self.processor = Processor(cfg)
+        self.processor.roster = roster
+        self.template_data = template_data
+        self.answer_keys = answer_keys
+        self.output_dir = output_dir
+        # ScanIndex của các phiếu đã chấm; None = không kiểm tra scan trùng
+        self.scan_index = scan_index
+        # Ảnh kết quả được mã hoá + ghi ở luồng nền, luồng chấm không chờ đĩa
+        self.writer = OutputWriter.from_config(cfg)
+
+    def grade(self, img_path: str, keep_page: bool = False) -> Dict[str, Any]:
+        """
+        Args:
+            img_path (str): Path of the input image.
+            keep_page (bool): Attach the page for the warped-sheet store under
+                "_page" (binary if the store is packed); not journaled.
+
+        Returns:
+            dict: Record with "image", "sheet_id", "status" and the results.
+        """
+        start, cpu_start = time.perf_counter(), time.process_time()
+        record = self._grade(img_path, keep_page)
+        # Thời gian của riêng ảnh này (đo độ song song thực tế), không ghi vào journal
+        record["_timing"] = {"wall": time.perf_counter() - start, "cpu": time.process_time() - cpu_start}
+        return record
+
+    def grade_image(self, img_path: str, keep_page: bool = False) -> List[Dict[str, Any]]:
+        """
+        Grades every sheet of one image: one record per sheet with MultiSheet
+        on (or a single rejected / error record), otherwise [grade()].
+        The image timing is attached to the first record.
+        """
+        if not self.cfg.MultiSheet.ENABLED:
+            return [self.grade(img_path, keep_page)]
+        start, cpu_start = time.perf_counter(), time.process_time()
+        records = self._grade_sheets(img_path, keep_page)
+        records[0]["_timing"] = {"wall": time.perf_counter() - start, "cpu": time.process_time() - cpu_start}
+        return records
+
+    def _grade_sheets(self, img_path: str, keep_page: bool) -> List[Dict[str, Any]]:
+        img_name = os.path.basename(img_path)
+        base_name = os.path.splitext(img_name)[0]
+        print(f"\nProcessing: {img_name}...")
+
+        try:
+            sheets = self.processor.process_exam_sheets(img_path, self.template_data, self.answer_keys)
+        except ImageRejectedError as e:
+            print(f" !!! Rejected: {str(e)}")
+            return [{"image": img_name, "sheet_id": base_name, "status": STATUS_REJECTED,
+                     "reason": e.reason, "error": str(e)}]
+        except Exception as e:
+            print(f" !!! Error: {str(e)}")
+            traceback.print_exc()
+            return [{"image": img_name, "sheet_id": base_name, "status": STATUS_ERROR, "error": str(e)}]
+
+        print(f" --> {len(sheets)} sheet(s) found")
+        records = []
+        for results, warped_img in sheets:
+            region = results["region"]
+            # Một phiếu: giữ tên kết quả như chế độ thường; nhiều phiếu: <ảnh>_<số thứ tự>
+            sheet_id = base_name if region["sheets"] == 1 else f"{base_name}_{region['sheet']}"
+            record = {"image": img_name, "sheet_id": sheet_id, "sheet": region["sheet"],
+                      "sheets": region["sheets"], "region": region["quad"]}
+            print(f"\n [SHEET {region['sheet']}/{region['sheets']}]")
+            # Lỗi của một phiếu chỉ ghi vào record của phiếu đó, các phiếu khác vẫn được chấm
+            try:
+                if "error" in results:
+                    raise results["error"]
+                record = self.finish(results, warped_img, record, keep_page)
+            except ImageRejectedError as e:
+                print(f" !!! Rejected: {str(e)}")
+                record.update(status=STATUS_REJECTED, reason=e.reason, error=str(e))
+            except Exception as e:
+                print(f" !!! Error: {str(e)}")
+                traceback.print_exc()
+                record.update(status=STATUS_ERROR, error=str(e))
+            records.append(record)
+        return records
+
+    def _grade(self, img_path: str, keep_page: bool) -> Dict[str, Any]:
+        img_name = os.path.basename(img_path)
+        base_name = os.path.splitext(img_name)[0]
+        record: Dict[str, Any] = {"image": img_name, "sheet_id": base_name}
+        print(f"\nProcessing: {img_name}...")
+
+        try:
+            # Gọi Processor để xử lý logic chấm điểm và OCR
+            results, warped_img = self.processor.process_exam_paper(
+                img_path, self.template_data, self.answer_keys
+            )
+        except ImageRejectedError as e:
+            print(f" !!! Rejected: {str(e)}")
+            record.update(status=STATUS_REJECTED, reason=e.reason, error=str(e))
+            return record
+        except Exception as e:
+            print(f" !!! Error: {str(e)}")
+            traceback.print_exc()
+            record.update(status=STATUS_ERROR, error=str(e))
+            return record
+
+        return self.finish(results, warped_img, record, keep_page)
+
+    def finish(self, results: Dict[str, Any], warped_img, record: Dict[str, Any],
+               keep_page: bool = False) -> Dict[str, Any]:
+        """
+        Everything after the OMR of one sheet (duplicate check, roster report,
+        render and save). Also used by the live video mode on tracked frames.
+        """
+        base_name = record["sheet_id"]
+        # Phiếu đã chấm rồi (scan hai lần) -> dừng trước bước vẽ / lưu kết quả
+        if self.scan_index is not None:
+            omr, binary_img = self.processor.omr, results["binary_img"]
+            record["ident"] = identity_key(omr, binary_img, self.template_data, results.get("identity"))
+            record["phash"] = f"{perceptual_hash(warped_img):016x}"
+            record["fill"] = fill_fingerprint(omr, binary_img, self.template_data).hex()
+            original = find_duplicate_scan(self.scan_index, record)
+            if original is not None:
+                print(f" !!! Duplicate scan of {original['image']}, skipped.")
+                record.update(status=STATUS_DUPLICATE, duplicate_of=original["image"])
+                return record
+
+        if keep_page:
+            packed = self.cfg.Batch.STORE_PACKED
+            record["_page"] = results["binary_img"] if packed else warped_img
+
+        record["sbd"] = results.get("sbd", "Unknown")
+        record["sbd_source"] = results.get("sbd_source")
+        record["version"] = results.get("version")
+        if "identity" in results:
+            record["exam"] = results["identity"]["exam"]
+            if results["sbd_bubbled"] != record["sbd"]:
+                print(f" ! Bubbled SBD {results['sbd_bubbled']} differs from the QR code, using {record['sbd']}.")
+        if "sbd_written" in results:
+            record["sbd_written"] = results["sbd_written"]
+            record["sbd_conflicts"] = results["sbd_conflicts"]
+            if "sbd_completed" in results:
+                if results["sbd_completed"] == record["sbd"]:
+                    print(f" ! Bubbled SBD {results['sbd_read']} completed from the handwritten "
+                          f"{results['sbd_written']}: {record['sbd']} (confirmed by the roster).")
+                else:
+                    # Chưa được danh sách xác nhận: chỉ ghi lại để kiểm tra bằng mắt
+                    record["sbd_suggested"] = results["sbd_completed"]
+                    print(f" ! Handwritten SBD {results['sbd_written']} suggests {results['sbd_completed']} "
+                          f"for the bubbled {record['sbd']}, not applied.")
+            if results["sbd_conflicts"]:
+                positions = ", ".join(map(str, results["sbd_conflicts"]))
+                print(f" ! Handwritten SBD {results['sbd_written']} differs from the bubbles at digit(s) {positions}.")
+        if "roster" in results:
+            match = results["roster"]
+            record["roster_status"] = match["status"]
+            record["name"] = match["name"]
+            if "sbd_read" in results:
+                print(f" ! SBD {results['sbd_read']} {match['status']} to {record['sbd']} from the roster.")
+            if match["candidates"] and match["sbd"] is None:
+                record["sbd_candidates"] = match["candidates"]
+                # Một SBD gợi ý (sai 1 chữ số / nhiều cột trống): chỉ ghi lại, SBD đã đọc giữ nguyên
+                if match["status"] in (ROSTER_CORRECTED, ROSTER_SUGGESTED):
+                    record.setdefault("sbd_suggested", match["candidates"][0])
+                print(f" ! SBD {record['sbd']} {match['status']}, roster candidates: {', '.join(match['candidates'])}"
+                      f" (not applied)")
+            elif match["status"] == ROSTER_NOT_FOUND:
+                print(f" ! SBD {record['sbd']} is not in the roster.")
+
+        correct_answers = results.get("answer_key")
+        if correct_answers is None:
+            print(f" !!! No answer key for version '{results.get('version')}', skipped.")
+            record["status"] = STATUS_NO_KEY
+            return record
+        correct_answers = correct_answers.tolist()
+
+        try:
+            self._report_and_save(results, warped_img, correct_answers, base_name, record)
+        except Exception as e:
+            print(f" !!! Error: {str(e)}")
+            traceback.print_exc()
+            record.update(status=STATUS_ERROR, error=str(e))
+            return record
+
+        record["status"] = STATUS_OK
+        return record
+
+    def _report_and_save(self, results, warped_img, correct_answers, base_name, record):
+        cfg = self.cfg
+        output_dir = self.output_dir
+
+        # --- CHUẨN BỊ DỮ LIỆU ĐỂ VẼ (RENDER) ---
+        user_ans_dict = results.get('answers', {})
+        user_ans_list = []
+        results_bool_list = []
+
+        print("\n [DETAILED REPORT]")
+        for i, correct_idx in enumerate(correct_answers):
+            user_idx = user_ans_dict.get(i, -1)
+            user_ans_list.append(user_idx)
+
+            # Kiểm tra đúng sai
+            is_correct = (user_idx == correct_idx)
+            results_bool_list.append(is_correct)
+
+            user_char = INDEX_TO_CHAR.get(user_idx, '?')
+            correct_char = INDEX_TO_CHAR.get(correct_idx, '?')
+            status = "✅" if is_correct else f"❌ (Expected: {correct_char})"
+            if user_idx == -1: status = "⚪ BLANK"
+            print(f" Q{i+1:02}: You: {user_char} | Key: {correct_char} -> {status}")
+
+        sbd = results.get("sbd", "Unknown")
+        raw_score = results.get('score_raw', 0)
+        final_score = (raw_score / len(correct_answers)) * 10 # Tính thang điểm 10
+
+        print(f"\n + SBD: {sbd}" + (" (QR)" if results.get("sbd_source") == "qr" else ""))
+        if results.get("version") is not None:
+            print(f" + Version: {results['version']}")
+        print(f" + Raw Score: {raw_score} / {len(correct_answers)}")
+        print(f" + Final Score: {final_score:.2f} / 10")
+
+        record["answers"] = user_ans_list
+        record["answer_key"] = correct_answers
+        record["score_raw"] = raw_score
+        record["num_questions"] = len(correct_answers)
+        record["score"] = final_score
+
+        # --- BƯỚC VẼ KẾT QUẢ (RENDER VIEW) ---
+        # 1. Vẽ vòng tròn xanh/đỏ lên ảnh phiếu thi
+        marked_img = renderer.draw_results_on_image(
+            warped_img,
+            user_ans_list,
+            correct_answers,
+            results_bool_list,
+            self.template_data.get('answer_bubbles', []),
+            cfg.OMR
+        )
+
+        # 2. Tạo ảnh bảng điểm (score.png)
+        score_card = renderer.create_score_display(
+            final_score, raw_score, len(correct_answers)
+        )
+
+        # --- LƯU KẾT QUẢ THEO ĐÚNG CẤU HÌNH BÁO CÁO ---
+        if cfg.Batch.BUNDLE_OUTPUT:
+            # Gói vào bundle của cả lô (tiến trình chính ghi), không tạo file lẻ / thư mục
+            images = {cfg.Paths.SCORING_RESULT_IMAGE_NAME: marked_img, cfg.Paths.SCORE_IMAGE_NAME: score_card}
+            for key, roi_img in results.get("info_images", {}).items():
+                images[f"info/{key}.jpg"] = roi_img
+            record["_artifacts"] = {
+                name: cv2.imencode(os.path.splitext(name)[1], img)[1].tobytes()
+                for name, img in images.items()
+            }
+            if cfg.Report.ENABLED:
+                record["_artifacts"][cfg.Paths.THUMBNAIL_NAME] = renderer.encode_thumbnail(
+                    marked_img, cfg.Report.THUMB_WIDTH, cfg.Report.JPEG_QUALITY
+                )
+            print(" --> Results packed for the bundle")
+            return
+
+        # Các file đã ghi (tiến trình chính xoá đi nếu phiếu hoá ra là scan trùng)
+        outputs = record["_outputs"] = []
+
+        # Lưu ảnh phiếu thi đã chấm (scoring_result.png)
+        res_path = os.path.join(output_dir, f"{base_name}_{cfg.Paths.SCORING_RESULT_IMAGE_NAME}")
+        self.writer.write_image(res_path, marked_img)
+        outputs.append(res_path)
+
+        # Ảnh thu nhỏ cho báo cáo PDF (nhúng thẳng, không phải giải mã lại ảnh PNG lớn)
+        if cfg.Report.ENABLED:
+            thumb = renderer.encode_thumbnail(marked_img, cfg.Report.THUMB_WIDTH, cfg.Report.JPEG_QUALITY)
+            thumb_path = os.path.join(output_dir, f"{base_name}_{cfg.Paths.THUMBNAIL_NAME}")
+            self.writer.write_bytes(thumb_path, thumb)
+            outputs.append(thumb_path)
+            # Tiến trình chính thêm trang báo cáo từ chính các byte này (file có thể chưa ghi xong)
+            record["_thumb"] = thumb
+
+        # Lưu bảng điểm (score.png)
+        score_path = os.path.join(output_dir, f"{base_name}_{cfg.Paths.SCORE_IMAGE_NAME}")
+        self.writer.write_image(score_path, score_card)
+        outputs.append(score_path)
+
+        # Lưu các ảnh ROI thông tin (Name, Class...); thư mục do writer tạo
+        info_dir = os.path.join(output_dir, base_name + "_info")
+        if "info_images" in results:
+            for key, roi_img in results["info_images"].items():
+                roi_path = os.path.join(info_dir, f"{key}.jpg")
+                self.writer.write_image(roi_path, roi_img)
+                outputs.append(roi_path)
+            outputs.append(info_dir)
+
+        print(f" --> Results queued for {output_dir}")
+
+
+def pack_record(bundle, record: Dict[str, Any], artifacts: Dict[str, bytes]) -> None:
+    """Adds the encoded images of a graded record and the record itself ("result.json") to a bundle."""
+    result = {k: v for k, v in record.items() if not k.startswith("_")}
+    items = dict(artifacts)
+    items["result.json"] = json.dumps(result, ensure_ascii=False).encode('utf-8')
+    bundle.add(record["sheet_id"], items)
+
+
+def find_duplicate_scan(scan_index, record: Dict[str, Any]) -> Dict[str, Any] | None:
+    """The index entry a record (with "ident" and the "phash" / "fill" hex fingerprints) duplicates, or None."""
+    return scan_index.find(record["image"], record["ident"], int(record["phash"], 16), bytes.fromhex(record["fill"]))
+
+
+def remove_outputs(record: Dict[str, Any]) -> None:
+    """
+    Deletes the result files a worker already wrote for a record the parent
+    drops (a duplicate of a sheet another worker graded at the same time).
+    "_outputs" lists the files, then the directory they were written in.
+    """
+    for path in record.get("_outputs", ()):
+        try:
+            if os.path.isdir(path):
+                os.rmdir(path)
+            else:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+# ======================================================
+# CHẠY TRONG TIẾN TRÌNH CON (cô lập crash native của OpenCV)
+# ======================================================
+_worker_grader = None
+_worker_keep_page = False
+_worker_barrier = None
+# (ảnh, records, số job ghi cuối cùng của ảnh) chờ ảnh kết quả ghi xong mới gửi về
+_worker_held: List[tuple] = []
+
+# Thời gian tối đa chờ các worker khác ở bước xả cuối (rồi xả luôn)
+DRAIN_TIMEOUT = 300
+
+
+def _init_worker(cfg, template_data, answer_keys, output_dir, keep_page, roster=None, scan_index=None,
+                 thread_plan=None, slot=None, barrier=None):
+    global _worker_grader, _worker_keep_page, _worker_barrier, _worker_held
+    # Giới hạn luồng OpenCV / torch của worker và gắn vào các core riêng (nếu có)
+    if thread_plan is not None:
+        cores = None
+        if thread_plan["cores"] and slot is not None:
+            with slot.get_lock():
+                index = slot.value
+                slot.value += 1
+            cores = thread_plan["cores"][index % len(thread_plan["cores"])]
+        runtime.configure_process(thread_plan["threads"], cores)
+    _worker_grader = SheetGrader(cfg, template_data, answer_keys, output_dir, roster, scan_index)
+    _worker_keep_page = keep_page
+    _worker_barrier = barrier
+    _worker_held = []
+
+
+def _release(done_through: int) -> List[tuple]:
+    """(image path, records) of the held images whose result files are all written."""
+    global _worker_held
+    ready = [(path, records) for path, records, last_job in _worker_held if last_job <= done_through]
+    _worker_held = [held for held in _worker_held if held[2] > done_through]
+    return ready
+
+
+def _grade_in_worker(img_path):
+    """
+    Grades one image and returns the (image path, records) of every image of
+    this worker whose result files are written by now, this one or earlier
+    ones. The others stay in the worker (their records are not sent to the
+    journal before their images exist) until a later call or _drain_worker;
+    grading the next image overlaps with writing this one.
+    """
+    records = _worker_grader.grade_image(img_path, _worker_keep_page)
+    writer = _worker_grader.writer
+    _worker_held.append((img_path, records, writer.submitted()))
+    return _release(writer.done_through())
+
+
+def _drain_worker():
+    """
+    Last call of a worker: waits for its pending writes and returns the held
+    (image path, records) with (pid, writer stats). The barrier (one party per
+    worker) keeps a worker from taking two drain calls while another gets none.
+    """
+    if _worker_barrier is not None:
+        try:
+            _worker_barrier.wait(DRAIN_TIMEOUT)
+        except threading.BrokenBarrierError:
+            pass
+    writer = _worker_grader.writer
+    writer.flush()
+    return _release(writer.submitted()), (os.getpid(), writer.stats())
+
+
+def _crash_record(img_path: str) -> Dict[str, Any]:
+    img_name = os.path.basename(img_path)
+    return {
+        "image": img_name,
+        "sheet_id": os.path.splitext(img_name)[0],
+        "status": STATUS_CRASHED,
+        "error": "worker process died while grading this image",
+    }
+
+
+def run_in_workers(image_paths: List[str], workers: int, init_args: tuple,
+                   on_record: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+    """
+    Grades images in a process pool so a native crash only loses one worker.
+
+    At most 2 x workers images are in flight. When the pool breaks, only those
+    in-flight images are suspects: each is re-run alone in a fresh process to
+    find the culprit (recorded as "crashed"), then the rest continues in a new
+    pool. Images already graded whose records had not come back yet (result
+    files still being written by the dead pool) are graded again.
+
+    Records come back from a worker only once their result files are
+    written, so the journal never lists a sheet whose images are missing.
+    At the end every worker is drained once: pending writes finished, last
+    records and its OutputWriter stats sent back.
+
+    Args:
+        image_paths: Images to grade.
+        workers (int): Number of worker processes.
+        init_args (tuple): (cfg, template_data, answer_keys, output_dir, keep_page,
+            roster, scan_index, thread_plan). Workers get a snapshot of the scan
+            index, so duplicates graded by two workers at once are caught by the
+            caller. thread_plan comes from runtime.plan_threads.
+        on_record: Called in the parent process with every finished record
+            (every sheet of an image in MultiSheet mode).
+
+    Returns:
+        dict: OutputWriter.merge_stats of the workers' writers (workers of a
+        pool that broke are not included).
+    """
+    queue = deque(image_paths)
+    max_inflight = 2 * workers
+    # Số thứ tự worker (chọn dải core khi gắn CPU affinity), cả worker thay thế sau crash
+    slot = multiprocessing.Value("i", 0)
+    writes = {}
+    generation = 0
+
+    def deliver(ready, unacked):
+        for path, records in ready:
+            unacked.remove(path)
+            for record in records:
+                on_record(record)
+
+    while queue:
+        suspects = []
+        # Ảnh đã chấm xong, record chưa về (ảnh kết quả còn đang ghi trong worker)
+        unacked = []
+        generation += 1
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=tuple(init_args) + (slot, multiprocessing.Barrier(workers)))
+        inflight = {}
+        broken = False
+        try:
+            while queue or inflight:
+                while queue and len(inflight) < max_inflight:
+                    path = queue.popleft()
+                    inflight[pool.submit(_grade_in_worker, path)] = path
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                results = []
+                for future in done:
+                    path = inflight.pop(future)
+                    try:
+                        results.append(future.result())
+                        unacked.append(path)
+                    except BrokenProcessPool:
+                        suspects.append(path)
+                        broken = True
+                # Một kết quả có thể mang record của ảnh khác trong cùng lượt: đánh dấu trước rồi mới giao
+                for ready in results:
+                    deliver(ready, unacked)
+                if broken:
+                    suspects.extend(inflight.values())
+                    break
+
+            if not broken:
+                for future in [pool.submit(_drain_worker) for _ in range(workers)]:
+                    try:
+                        ready, (pid, stats) = future.result()
+                    except BrokenProcessPool:
+                        break
+                    writes[(generation, pid)] = stats
+                    deliver(ready, unacked)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+        # Record chưa về được (pool hỏng, worker không được xả): chấm lại các ảnh đó
+        queue.extendleft(reversed(unacked))
+
+        # Chạy riêng từng ảnh nghi vấn trong một tiến trình mới để tìm ảnh gây crash
+        for path in suspects:
+            generation += 1
+            with ProcessPoolExecutor(max_workers=1, initializer=_init_worker,
+                                     initargs=tuple(init_args) + (slot, None)) as single:
+                try:
+                    ready = single.submit(_grade_in_worker, path).result()
+                    drained, (pid, stats) = single.submit(_drain_worker).result()
+                except BrokenProcessPool:
+                    print(f" !!! Worker crashed on {os.path.basename(path)}")
+                    on_record(_crash_record(path))
+                    continue
+            writes[(generation, pid)] = stats
+            for _, records in ready + drained:
+                for record in records:
+                    on_record(record)
+
+    return OutputWriter.merge_stats(list(writes.values()))
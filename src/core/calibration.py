@@ -0,0 +1,151 @@
+import cv2
+import numpy as np
+from typing import Any, Dict, Iterable, List
+
+from config import Config
+
+# Nguồn của ngưỡng OMR ghi vào kết quả
+SOURCE_CONFIG = "config"
+SOURCE_CALIBRATED = "calibrated"
+
+
+def fit_blank_class(ratios: np.ndarray, bin_width: float = 0.005) -> tuple[float, float]:
+    """
+    Mode and spread of the unmarked bubbles among all fill ratios.
+
+    Unmarked bubbles are the large majority, so their class is the histogram
+    peak. Light marks (ticks, crosses, erasures) only pile up on its right,
+    so the spread is measured on the left side of the peak, which stays clean.
+
+    Returns:
+        tuple: (mode, sigma) as fill ratios.
+    """
+    bins = int(round(1 / bin_width))
+    hist, edges = np.histogram(ratios, bins=bins, range=(0, 1))
+    # Làm mượt nhẹ để đỉnh không phụ thuộc vào nhiễu của từng bin
+    hist = np.convolve(hist, np.ones(5) / 5, mode="same")
+    mode = float((edges[:-1] + edges[1:])[np.argmax(hist)] / 2)
+    left = ratios[ratios <= mode]
+    sigma = float(np.sqrt(np.mean((left - mode) ** 2))) if len(left) else 0.0
+    return mode, max(sigma, bin_width)
+
+
+class OMRCalibrator:
+    """
+    Picks OMR.SCAN_RADIUS and OMR.PIXEL_THRESHOLD for a batch from the fill
+    distribution of its first sheets, instead of hand-tuned constants.
+
+    For every candidate radius, the fill ratio (marked pixels / disk area) of
+    every bubble is collected. The unmarked class is fitted from the
+    histogram peak (fit_blank_class) and the threshold is placed
+    Calibration.BLANK_SIGMAS standard deviations above it: as low as possible,
+    so light ticks still count as marks, while an empty bubble stays below it.
+
+    Every radius thus gets a threshold with the same false-mark rate, and the
+    one that reads the most question rows / digit columns as marked wins
+    (ticks and off-centre marks are lost by too small a radius, diluted by
+    too large a one). Ties go to the largest separation (median of the
+    marked bubbles - threshold) / sigma.
+    """
+
+    def __init__(self, config: Config, processor=None):
+        self.cfg = config
+        if processor is None:
+            from src.core.processor import Processor
+            processor = Processor(config)
+        self.processor = processor
+        self.omr = processor.omr
+
+    def binarize_images(self, image_paths: Iterable[str], template_data: Dict[str, Any]) -> List[np.ndarray]:
+        """Warps and thresholds images like the grader does; rejected images are skipped."""
+        points = self.processor._bubble_points(template_data)
+        pages = []
+        for path in image_paths:
+            image = cv2.imread(path)
+            if image is None:
+                continue
+            report = self.processor.quality.assess(image, template_data)
+            if not report["ok"]:
+                continue
+            warped = self.processor.img_utils.warp_quad(image, report["quad"])
+            pages.append(self.omr.binarize(warped, points))
+        return pages
+
+    def fill_ratios(self, binary_pages: List[np.ndarray], template_data: Dict[str, Any], radius: int):
+        """
+        Fill ratios at the given scan radius.
+
+        Returns:
+            tuple: (ratio of every bubble, highest ratio of every group), each
+            flattened over all pages.
+        """
+        area = len(self.omr._disk_offsets(radius)[0])
+        ratios, group_max = [], []
+        for page in binary_pages:
+            for key in ("mssv_bubbles", "version_bubbles", "answer_bubbles"):
+                groups = template_data.get(key)
+                if groups:
+                    coords = np.asarray(groups, dtype=np.intp)
+                    counts = self.omr._bubble_fill_counts(page, coords, radius) / area
+                    ratios.append(counts.ravel())
+                    group_max.append(counts.max(axis=1))
+        if not ratios:
+            return np.zeros(0), np.zeros(0)
+        return np.concatenate(ratios), np.concatenate(group_max)
+
+    def fit(self, binary_pages: List[np.ndarray], template_data: Dict[str, Any]) -> Dict[str, Any] | None:
+        """
+        Args:
+            binary_pages: Thresholded warped pages (binarize_images, or the
+                binary pages of a packed WarpedSheetStore).
+            template_data (dict): The template.
+
+        Returns:
+            dict: {"source", "scan_radius", "pixel_threshold", "sheets",
+            "blank_mode", "blank_sigma", "marked_median", "separation",
+            "answered_groups", "candidates"}, or None when there is not
+            enough data.
+        """
+        ccfg = self.cfg.Calibration
+        if len(binary_pages) < ccfg.MIN_SHEETS:
+            return None
+
+        candidates = []
+        for radius in ccfg.RADIUS_CANDIDATES:
+            ratios, group_max = self.fill_ratios(binary_pages, template_data, radius)
+            mode, sigma = fit_blank_class(ratios)
+            threshold = mode + ccfg.BLANK_SIGMAS * sigma
+            marked = ratios[ratios >= threshold]
+            if len(marked) < ccfg.MIN_MARKED_RATIO * len(ratios):
+                continue
+            marked_median = float(np.median(marked))
+            area = len(self.omr._disk_offsets(radius)[0])
+            candidates.append({
+                "scan_radius": int(radius),
+                "pixel_threshold": int(np.ceil(threshold * area)),
+                "blank_mode": round(mode, 4),
+                "blank_sigma": round(sigma, 4),
+                "marked_median": round(marked_median, 4),
+                "separation": round((marked_median - threshold) / sigma, 2),
+                "answered_groups": int(np.count_nonzero(group_max >= threshold)),
+            })
+        if not candidates:
+            return None
+
+        best = max(candidates, key=lambda c: (c["answered_groups"], c["separation"]))
+        return {"source": SOURCE_CALIBRATED, "sheets": len(binary_pages), **best, "candidates": candidates}
+
+    @staticmethod
+    def apply(config: Config, calibration: Dict[str, Any]) -> None:
+        """Writes the chosen values into config.OMR (picked up by new Processors / workers)."""
+        config.OMR.SCAN_RADIUS = calibration["scan_radius"]
+        config.OMR.PIXEL_THRESHOLD = calibration["pixel_threshold"]
+
+
+def config_thresholds(config: Config) -> Dict[str, Any]:
+    """The OMR values in use when calibration is off, in the same format."""
+    return {
+        "source": SOURCE_CONFIG,
+        "scan_radius": config.OMR.SCAN_RADIUS,
+        "pixel_threshold": config.OMR.PIXEL_THRESHOLD,
+    }
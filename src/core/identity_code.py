@@ -0,0 +1,90 @@
+import cv2
+import numpy as np
+from typing import Any, Dict, List
+
+from config import Config
+
+# Nội dung mã QR in trên phiếu: "OMR1|<sbd>|<mã kỳ thi>|<mã đề>"
+PAYLOAD_PREFIX = "OMR1"
+PAYLOAD_SEPARATOR = "|"
+
+
+def encode_identity(sbd: str, exam_id: str = "", version: str = "") -> str:
+    """Builds the QR payload of one sheet. The separator is removed from the fields."""
+    fields = [str(v or "").replace(PAYLOAD_SEPARATOR, "") for v in (sbd, exam_id, version)]
+    return PAYLOAD_SEPARATOR.join([PAYLOAD_PREFIX] + fields)
+
+
+def decode_identity(text: str) -> Dict[str, str] | None:
+    """
+    Parses a QR payload made by encode_identity.
+
+    Returns:
+        dict: {"sbd", "exam", "version"} (empty strings for absent fields),
+        or None if the text is not a sheet identity code.
+    """
+    parts = (text or "").split(PAYLOAD_SEPARATOR)
+    if len(parts) != 4 or parts[0] != PAYLOAD_PREFIX or not parts[1]:
+        return None
+    return {"sbd": parts[1], "exam": parts[2], "version": parts[3]}
+
+
+class IdentityReader:
+    """
+    Decodes the identity QR code printed in the template's "qr_region" of a
+    warped sheet with OpenCV's QRCodeDetector.
+
+    Only the small template region is searched, so a read costs a few ms. When
+    the code is not there, the region mirrored through the page centre is
+    tried: finding it there means the page was warped upside down.
+    """
+
+    def __init__(self, config: Config):
+        self.cfg = config
+        # Bộ dò dựa trên ArUco (OpenCV >= 4.8) nhanh hơn ~2.5 lần trên vùng nhỏ
+        detector_cls = getattr(cv2, "QRCodeDetectorAruco", cv2.QRCodeDetector)
+        self._detector = detector_cls()
+
+    def _crop(self, image: np.ndarray, region: List[int]):
+        pad = self.cfg.Identity.REGION_PADDING
+        x, y, w, h = region
+        x0, y0 = max(x - pad, 0), max(y - pad, 0)
+        x1, y1 = min(x + w + pad, image.shape[1]), min(y + h + pad, image.shape[0])
+        return image[y0:y1, x0:x1]
+
+    def _decode(self, crop: np.ndarray):
+        if crop.size == 0:
+            return None, None
+        text, points, _ = self._detector.detectAndDecode(crop)
+        if not text or points is None:
+            return None, None
+        return decode_identity(text), points.reshape(-1, 2)
+
+    @staticmethod
+    def _rotation(points: np.ndarray) -> int:
+        """Quarter turns of the code in the image, from its top edge (corner 0 -> 1)."""
+        dx, dy = points[1] - points[0]
+        return int(round(np.degrees(np.arctan2(dy, dx)) / 90)) % 4
+
+    def read(self, warped_img: np.ndarray, region: List[int]) -> Dict[str, Any] | None:
+        """
+        Args:
+            warped_img (np.ndarray): The warped sheet (BGR, gray or binary).
+            region (list): [x, y, w, h] of the code in template coordinates.
+
+        Returns:
+            dict: {"sbd", "exam", "version", "rotation"} where rotation is the
+            number of quarter turns the page is off by (0 or 2), or None.
+        """
+        identity, points = self._decode(self._crop(warped_img, region))
+        if identity is not None:
+            identity["rotation"] = self._rotation(points)
+            return identity
+
+        # Trang bị lật ngược -> mã nằm ở vị trí đối xứng qua tâm trang
+        h, w = warped_img.shape[:2]
+        x, y, rw, rh = region
+        identity, points = self._decode(self._crop(warped_img, [w - x - rw, h - y - rh, rw, rh]))
+        if identity is not None:
+            identity["rotation"] = self._rotation(points)
+        return identity
@@ -0,0 +1,223 @@
+import time
+from typing import Any, Dict, List
+
+import cv2
+import numpy as np
+
+from config import Config
+from src.core.batch import STATUS_OK, SheetGrader, pack_record
+from src.core.quality_gate import QualityGate
+from src.core.scan_index import ScanIndex
+from src.utils.image_utils import ImageUtils
+
+
+class SheetTracker:
+    """
+    Follows the sheet frame across video frames on a small grayscale copy.
+
+    The frame is found once with the quality gate (Canny contour search +
+    orientation check). After that, corners found inside the sheet are followed
+    with pyramidal Lucas-Kanade optical flow and the quad is moved by the
+    RANSAC homography between frames. Every few frames the quad is snapped to a
+    contour found in a small window around it, so tracking does not drift.
+    """
+
+    def __init__(self, config: Config, img_utils: ImageUtils, template_data: Dict[str, Any] | None = None):
+        self.cfg = config
+        self.img_utils = img_utils
+        self.quality = QualityGate(config, img_utils)
+        self.template_data = template_data
+        self.reset()
+
+    def reset(self) -> None:
+        self.quad = None        # góc phiếu [TL, TR, BR, BL] trên ảnh thu nhỏ
+        self.points = None      # điểm đặc trưng đang theo dõi
+        self.prev_gray = None
+        self.motion = np.inf    # dịch chuyển lớn nhất của góc phiếu ở khung vừa rồi (px ảnh nhỏ)
+        self.frames_tracked = 0
+
+    def _features(self, gray: np.ndarray) -> np.ndarray | None:
+        lcfg = self.cfg.Live
+        mask = np.zeros(gray.shape, dtype=np.uint8)
+        cv2.fillConvexPoly(mask, self.quad.astype(np.int32), 255)
+        return cv2.goodFeaturesToTrack(gray, lcfg.MAX_FEATURES, 0.01, lcfg.FEATURE_MIN_DISTANCE, mask=mask)
+
+    def detect(self, frame: np.ndarray, gray: np.ndarray, scale: float) -> bool:
+        """Full frame search (quality gate). Starts tracking when the sheet is found."""
+        report = self.quality.assess(frame, self.template_data)
+        if not report["ok"]:
+            return False
+        self.quad = report["quad"].astype(np.float32) * scale
+        self.points = self._features(gray)
+        if self.points is None or len(self.points) < self.cfg.Live.MIN_TRACKED_POINTS:
+            self.reset()
+            return False
+        self.prev_gray = gray
+        self.motion = np.inf
+        self.frames_tracked = 0
+        return True
+
+    def track(self, gray: np.ndarray) -> bool:
+        """Moves the quad to the new frame. Returns False (and resets) when the sheet is lost."""
+        lcfg = self.cfg.Live
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.prev_gray, gray, self.points, None,
+            winSize=(lcfg.FLOW_WINDOW, lcfg.FLOW_WINDOW), maxLevel=lcfg.FLOW_LEVELS
+        )
+        found = status.ravel() == 1
+        if found.sum() < lcfg.MIN_TRACKED_POINTS:
+            self.reset()
+            return False
+        src, dst = self.points[found], moved[found]
+        homography, inliers = cv2.findHomography(src, dst, cv2.RANSAC, lcfg.RANSAC_THRESHOLD)
+        if homography is None or inliers.sum() < lcfg.MIN_INLIER_RATIO * len(src):
+            self.reset()
+            return False
+
+        quad = cv2.perspectiveTransform(self.quad[None], homography)[0]
+        self.frames_tracked += 1
+        if self.frames_tracked % lcfg.REFINE_INTERVAL == 0:
+            quad = self._refine(gray, quad)
+        self.motion = float(np.abs(quad - self.quad).max())
+        self.quad = quad
+        self.prev_gray = gray
+
+        # Bổ sung điểm khi mất dần (bị tay che, ra khỏi khung hình...)
+        self.points = dst[inliers.ravel() == 1].reshape(-1, 1, 2)
+        if len(self.points) < lcfg.MAX_FEATURES // 2:
+            fresh = self._features(gray)
+            if fresh is not None:
+                self.points = fresh
+        return True
+
+    def _refine(self, gray: np.ndarray, quad: np.ndarray) -> np.ndarray:
+        """Snaps the tracked quad to the closest contour quad in a window around it."""
+        lcfg = self.cfg.Live
+        margin = lcfg.REFINE_MARGIN
+        x0, y0 = np.maximum(quad.min(axis=0) - margin, 0).astype(int)
+        x1, y1 = np.minimum(quad.max(axis=0) + margin, gray.shape[::-1]).astype(int)
+        roi = gray[y0:y1, x0:x1]
+        if roi.size == 0:
+            return quad
+
+        best, best_dist = quad, lcfg.REFINE_MAX_SHIFT
+        for candidate in self.img_utils.find_quad_candidates(roi, self.cfg.Quality.MAX_FRAME_CANDIDATES, 0.2):
+            candidate = self.img_utils.order_points(candidate) + [x0, y0]
+            # Giữ thứ tự góc của phiếu (có thể đang xoay): thử 4 cách xoay vòng
+            for shift in range(4):
+                rolled = np.roll(candidate, shift, axis=0)
+                dist = float(np.linalg.norm(rolled - quad, axis=1).mean())
+                if dist < best_dist:
+                    best, best_dist = rolled.astype(np.float32), dist
+        return best
+
+
+class LiveGrader:
+    """
+    Grades sheets held under a document camera (or played from a video file).
+
+    Each sheet is graded once, when its tracked quad has stayed still for
+    Live.STABLE_FRAMES frames. It is not graded again while it stays in view,
+    and a session-wide scan index skips a sheet that is shown a second time.
+    """
+
+    def __init__(self, cfg: Config, template_data, answer_keys, output_dir, roster=None, bundle=None):
+        self.cfg = cfg
+        # ArtifactBundle khi Batch.BUNDLE_OUTPUT bật
+        self.bundle = bundle
+        # Chỉ mục trong bộ nhớ cho phiên quay: phiếu đưa lại lần hai không bị chấm lại
+        self.scan_index = ScanIndex(None, cfg.Dedup.MAX_HASH_DISTANCE, cfg.Dedup.MAX_FILL_DISTANCE)
+        self.grader = SheetGrader(cfg, template_data, answer_keys, output_dir, roster, self.scan_index)
+        self.tracker = SheetTracker(cfg, self.grader.processor.img_utils, template_data)
+
+    def _grade(self, frame: np.ndarray, quad: np.ndarray, frame_no: int) -> Dict[str, Any]:
+        sheet_id = f"live_{frame_no:06d}"
+        record: Dict[str, Any] = {"image": sheet_id, "sheet_id": sheet_id, "frame": frame_no}
+        print(f"\nGrading frame {frame_no}...")
+        warped = self.grader.processor.img_utils.warp_quad(frame, quad)
+        results, warped = self.grader.processor.grade_warped(
+            warped, self.grader.template_data, self.grader.answer_keys
+        )
+        record = self.grader.finish(results, warped, record)
+        record.pop("_outputs", None)
+        record.pop("_thumb", None)
+        artifacts = record.pop("_artifacts", None)
+        if record.get("status") == STATUS_OK:
+            self.scan_index.add(record)
+            if self.bundle is not None and artifacts:
+                pack_record(self.bundle, record, artifacts)
+        return record
+
+    def run(self, source, show: bool = False, max_frames: int | None = None) -> List[Dict[str, Any]]:
+        """
+        Args:
+            source: Capture device index (int) or video file path.
+            show (bool): Display the frames with the tracked quad (press q to stop).
+            max_frames (int, optional): Stop after this many frames.
+
+        Returns:
+            list: One record per graded sheet.
+        """
+        lcfg = self.cfg.Live
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise ValueError(f"Cannot open video source: {source}")
+
+        records = []
+        frame_no = 0
+        still_frames = 0
+        graded = False
+        tracking_time = 0.0
+        start = time.perf_counter()
+        try:
+            while max_frames is None or frame_no < max_frames:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                frame_no += 1
+
+                t0 = time.perf_counter()
+                scale = lcfg.TRACK_WIDTH / frame.shape[1]
+                small = cv2.resize(frame, (lcfg.TRACK_WIDTH, int(round(frame.shape[0] * scale))),
+                                   interpolation=cv2.INTER_AREA)
+                gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+                if self.tracker.quad is not None:
+                    tracked = self.tracker.track(gray)
+                else:
+                    # Chưa thấy phiếu: dò toàn khung hình, thưa hơn để giữ tốc độ
+                    tracked = frame_no % lcfg.DETECT_INTERVAL == 0 and self.tracker.detect(frame, gray, scale)
+                    graded = False
+                    still_frames = 0
+                tracking_time += time.perf_counter() - t0
+
+                if tracked:
+                    still_frames = still_frames + 1 if self.tracker.motion < lcfg.STABLE_MOTION else 0
+                    if still_frames >= lcfg.STABLE_FRAMES and not graded:
+                        try:
+                            records.append(self._grade(frame, self.tracker.quad / scale, frame_no))
+                        except Exception as e:
+                            print(f" !!! Error: {str(e)}")
+                        graded = True
+
+                if show:
+                    view = small.copy()
+                    if self.tracker.quad is not None:
+                        color = (0, 200, 0) if graded else (0, 200, 255)
+                        cv2.polylines(view, [self.tracker.quad.astype(np.int32)], True, color, 2)
+                    cv2.imshow("OMR live", view)
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
+        finally:
+            capture.release()
+            self.grader.writer.flush()
+            if show:
+                cv2.destroyAllWindows()
+
+        elapsed = time.perf_counter() - start
+        if frame_no:
+            graded_ok = sum(r.get("status") == STATUS_OK for r in records)
+            print(f"--> {frame_no} frame(s) in {elapsed:.1f} s ({frame_no / elapsed:.1f} fps overall, "
+                  f"tracking {1000 * tracking_time / frame_no:.1f} ms/frame), {graded_ok} sheet(s) graded, "
+                  f"{len(records) - graded_ok} skipped.")
+        return records
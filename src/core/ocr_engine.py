@@ -1,5 +1,4 @@
 import cv2
-import easyocr
 import re
 import numpy as np
 from typing import Dict, List
@@ -14,13 +13,24 @@ class OCREngine:
 
     def __init__(self, ocr_config: Config.OCRConfig):
         """
-        Initializes the OCR engine and EasyOCR model.
+        Initializes the OCR engine. The EasyOCR model (and torch behind it) is
+        only loaded on first use, see `reader`.
         """
-        print("Initializing EasyOCR reader... (This may take a moment)")
-        # GPU=False để chạy ổn định trên mọi máy, nếu có GPU mạnh thì set True
-        self.reader = easyocr.Reader(ocr_config.OCR_LANGUAGES, gpu=False)
         self.cfg = ocr_config
-        print("EasyOCR reader initialized.")
+        self._reader = None
+
+    @property
+    def reader(self):
+        """The EasyOCR reader, created on first access."""
+        if self._reader is None:
+            # Import ở đây: easyocr kéo theo torch (vài giây), chỉ trả giá khi thật sự OCR
+            import easyocr
+
+            print("Initializing EasyOCR reader... (This may take a moment)")
+            # GPU=False để chạy ổn định trên mọi máy, nếu có GPU mạnh thì set True
+            self._reader = easyocr.Reader(list(self.cfg.OCR_LANGUAGES), gpu=False)
+            print("EasyOCR reader initialized.")
+        return self._reader
 
     def _preprocess_for_ocr(self, image: np.ndarray) -> np.ndarray:
         """
@@ -1,6 +1,24 @@
 import cv2
 import numpy as np
-from config import Config
+from config import THRESHOLD_BACKENDS, Config
+
+
+def disk_offsets(radius):
+    """
+    (dy, dx) offsets of the pixels covered by a filled cv2.circle of the
+    given radius, so sampling matches the old per-bubble mask exactly.
+    The arrays are read-only (shared through the frozen Config).
+    """
+    size = 2 * radius + 1
+    stencil = np.zeros((size, size), dtype=np.uint8)
+    cv2.circle(stencil, (radius, radius), radius, 255, -1)
+    dy, dx = np.nonzero(stencil)
+    # int16: nhỏ khi gửi kèm Config sang worker; cộng với toạ độ intp vẫn ra intp
+    offsets = ((dy - radius).astype(np.int16), (dx - radius).astype(np.int16))
+    for array in offsets:
+        array.setflags(write=False)
+    return offsets
+
 
 class OMREngine:
     """
@@ -13,87 +31,340 @@ class OMREngine:
             self.cfg = config
         else:
             self.cfg = Config()
+        if self.cfg.OMR.THRESHOLD_BACKEND not in THRESHOLD_BACKENDS:
+            raise ValueError(
+                f"Unknown THRESHOLD_BACKEND '{self.cfg.OMR.THRESHOLD_BACKEND}', "
+                f"expected one of {THRESHOLD_BACKENDS}"
+            )
+        # Mặt nạ đĩa tính sẵn trong Config.freeze() (nếu có), bán kính khác tính khi cần
+        self._disk_cache = dict(self.cfg.Derived.DISK_OFFSETS) if self.cfg.Derived is not None else {}
+        # Số nhóm ô phải phân ngưỡng lại ở độ phân giải đầy đủ (COARSE_TO_FINE) ở trang vừa chấm
+        self.last_refined_groups = 0
 
-    def _apply_adaptive_threshold(self, img):
+    def _apply_adaptive_threshold(self, img, roi=None):
         """
         Hàm xử lý ảnh nhị phân thông minh: Chống bóng đổ và ánh sáng không đều.
+
+        roi: (x0, y0, x1, y1) giới hạn vùng tính ngưỡng; ngoài vùng là 0 (nền).
         """
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
+        # Ảnh từ kho trang đã warp (sheet store) có thể đã là ảnh xám
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+
         # ADAPTIVE_THRESH_GAUSSIAN_C: Tính ngưỡng dựa trên vùng lân cận
         # Block Size = 51: Xem xét vùng 51x51 pixel
         # C = 10: Hằng số trừ đi để lọc nhiễu nền
-        thresh = cv2.adaptiveThreshold(
-            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY_INV, 51, 10
+        # Backend "mean": ADAPTIVE_THRESH_MEAN_C (box filter, O(1) mỗi pixel), nhanh hơn
+        method = cv2.ADAPTIVE_THRESH_MEAN_C if self.cfg.OMR.THRESHOLD_BACKEND == "mean" \
+            else cv2.ADAPTIVE_THRESH_GAUSSIAN_C
+        block, c = self.cfg.OMR.THRESHOLD_BLOCK_SIZE, self.cfg.OMR.THRESHOLD_C
+
+        if roi is None:
+            return cv2.adaptiveThreshold(gray, 255, method, cv2.THRESH_BINARY_INV, block, c)
+
+        x0, y0, x1, y1 = roi
+        thresh = np.zeros(gray.shape[:2], dtype=np.uint8)
+        thresh[y0:y1, x0:x1] = self._threshold_window(gray, roi)
+        return thresh
+
+    def _threshold_window(self, gray, box, block=None):
+        """Adaptive threshold of gray[y0:y1, x0:x1] only (same method and C as the page)."""
+        method = cv2.ADAPTIVE_THRESH_MEAN_C if self.cfg.OMR.THRESHOLD_BACKEND == "mean" \
+            else cv2.ADAPTIVE_THRESH_GAUSSIAN_C
+        x0, y0, x1, y1 = box
+        return cv2.adaptiveThreshold(
+            np.ascontiguousarray(gray[y0:y1, x0:x1]), 255, method, cv2.THRESH_BINARY_INV,
+            block or self.cfg.OMR.THRESHOLD_BLOCK_SIZE, self.cfg.OMR.THRESHOLD_C
         )
+
+    def _bubble_roi(self, coords, shape):
+        """
+        Bounding box of all bubbles padded by the scan radius plus half a
+        threshold block. Every pixel a bubble samples then sees its full
+        neighbourhood, so the ROI result equals the full-image result there.
+        """
+        pad = self.cfg.OMR.SCAN_RADIUS + self.cfg.OMR.THRESHOLD_BLOCK_SIZE // 2 + 1
+        h, w = shape[:2]
+        x0 = max(int(coords[:, 0].min()) - pad, 0)
+        y0 = max(int(coords[:, 1].min()) - pad, 0)
+        x1 = min(int(coords[:, 0].max()) + pad + 1, w)
+        y1 = min(int(coords[:, 1].max()) + pad + 1, h)
+        return x0, y0, x1, y1
+
+    def _local_background_threshold(self, img, coords):
+        """
+        Backend "local": compares each bubble's pixels with the mean of its own
+        THRESHOLD_BLOCK_SIZE window (one integral image over the bubble ROI)
+        and only writes the bubble disks. Nothing else of the page is computed.
+        """
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+        x0, y0, x1, y1 = self._bubble_roi(coords, gray.shape)
+        roi = gray[y0:y1, x0:x1]
+        integral = cv2.integral(roi)
+
+        # Cửa sổ block x block quanh tâm mỗi ô, cắt theo biên ROI
+        half = self.cfg.OMR.THRESHOLD_BLOCK_SIZE // 2
+        cx = coords[:, 0] - x0
+        cy = coords[:, 1] - y0
+        wx0 = np.clip(cx - half, 0, roi.shape[1])
+        wx1 = np.clip(cx + half + 1, 0, roi.shape[1])
+        wy0 = np.clip(cy - half, 0, roi.shape[0])
+        wy1 = np.clip(cy + half + 1, 0, roi.shape[0])
+        sums = integral[wy1, wx1] - integral[wy0, wx1] - integral[wy1, wx0] + integral[wy0, wx0]
+        area = np.maximum((wx1 - wx0) * (wy1 - wy0), 1)
+        level = sums / area - self.cfg.OMR.THRESHOLD_C
+
+        radius = self.cfg.OMR.SCAN_RADIUS
+        dy, dx = self._disk_offsets(radius)
+        h, w = gray.shape[:2]
+        ys = np.clip(coords[:, 1, None] + dy, 0, h - 1)
+        xs = np.clip(coords[:, 0, None] + dx, 0, w - 1)
+        marked = gray[ys, xs] <= level[:, None]
+
+        thresh = np.zeros(gray.shape[:2], dtype=np.uint8)
+        thresh[ys[marked], xs[marked]] = 255
+        return thresh
+
+    def _coarse_to_fine_threshold(self, img, coords, groups):
+        """
+        OMR.COARSE_TO_FINE: thresholds the bubble area COARSE_LEVELS Gaussian
+        pyramid levels down (1/2 or 1/4 of the side) and scores every bubble
+        there. A group (question row / digit column) is thresholded again at
+        full resolution, in a window around it only, when its best bubble is
+        within COARSE_MARGIN (fill ratio) of PIXEL_THRESHOLD or its second
+        best within COARSE_RIVAL_MARGIN of the best. The window is padded like
+        _bubble_roi, so those bubbles read exactly as on the full page.
+
+        The returned image is the coarse level scaled back up (nearest), with
+        the bubble disks of the refined groups taken from the full-resolution
+        windows.
+        """
+        ocfg = self.cfg.OMR
+        h, w = img.shape[:2]
+        radius = ocfg.SCAN_RADIUS
+        x0, y0, x1, y1 = self._bubble_roi(coords, img.shape) if ocfg.THRESHOLD_ROI_ONLY else (0, 0, w, h)
+        roi = img[y0:y1, x0:x1]
+        gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY) if roi.ndim == 3 else np.ascontiguousarray(roi)
+
+        # 1. Mức thô: thu nhỏ bằng pyrDown, khối ngưỡng thu nhỏ theo (giữ số lẻ)
+        small = gray
+        for _ in range(ocfg.COARSE_LEVELS):
+            small = cv2.pyrDown(small)
+        scale = 2 ** ocfg.COARSE_LEVELS
+        coarse_block = max(ocfg.THRESHOLD_BLOCK_SIZE // scale, 1) | 1
+        coarse = self._threshold_window(small, (0, 0, small.shape[1], small.shape[0]), coarse_block)
+
+        # Phóng ngược về kích thước ROI (lân cận gần nhất) để đọc ô như ảnh đầy đủ
+        thresh = np.zeros((h, w), dtype=np.uint8)
+        thresh[y0:y1, x0:x1] = cv2.resize(coarse, gray.shape[::-1], interpolation=cv2.INTER_NEAREST)
+
+        dy, dx = self._disk_offsets(radius)
+        threshold = ocfg.PIXEL_THRESHOLD / dy.size
+        pad = radius + ocfg.THRESHOLD_BLOCK_SIZE // 2 + 1
+        pending = []
+        for group in groups:
+            centers = np.asarray(group, dtype=np.intp)
+            if centers.size == 0:
+                continue
+            ratios = self._bubble_fill_counts(thresh, centers) / dy.size
+
+            # 2. Nhóm lưng chừng: ô cao nhất gần ngưỡng (tô nhạt / bỏ trống),
+            #    hoặc ô thứ hai sát ô cao nhất (tô kép / tẩy)
+            best = ratios.max(axis=1)
+            near = np.abs(best - threshold) < ocfg.COARSE_MARGIN
+            if ratios.shape[1] > 1:
+                second = np.partition(ratios, -2, axis=1)[:, -2]
+                near |= (best >= threshold - ocfg.COARSE_MARGIN) & (best - second < ocfg.COARSE_RIVAL_MARGIN)
+
+            for g in np.flatnonzero(near):
+                cx, cy = centers[g, :, 0], centers[g, :, 1]
+                inside = (cx >= radius) & (cx < w - radius) & (cy >= radius) & (cy < h - radius)
+                box = (max(int(cx.min()) - x0 - pad, 0), max(int(cy.min()) - y0 - pad, 0),
+                       min(int(cx.max()) - x0 + pad + 1, gray.shape[1]),
+                       min(int(cy.max()) - y0 + pad + 1, gray.shape[0]))
+                # Chỉ ghi các đĩa quét của nhóm: mép cửa sổ thiếu lân cận nên không chính xác
+                ys = (cy[inside, None] + dy - y0).ravel()
+                xs = (cx[inside, None] + dx - x0).ravel()
+                pending.append((box, ys, xs))
+
+        # 3. Mức mịn: phân ngưỡng lại ở độ phân giải đầy đủ quanh từng nhóm lưng chừng.
+        #    Khi các cửa sổ cộng lại không nhỏ hơn ROI (phiếu tô mờ cả trang) thì
+        #    phân ngưỡng cả ROI một lần
+        refined = len(pending)
+        if sum((bx1 - bx0) * (by1 - by0) for (bx0, by0, bx1, by1), _, _ in pending) >= gray.size:
+            full = self._threshold_window(gray, (0, 0, gray.shape[1], gray.shape[0]))
+            pending = [((0, 0) + full.shape[::-1], ys, xs) for _, ys, xs in pending]
+        else:
+            full = None
+        for box, ys, xs in pending:
+            window = full if full is not None else self._threshold_window(gray, box)
+            thresh[ys + y0, xs + x0] = window[ys - box[1], xs - box[0]]
+
+        self.last_refined_groups = refined
         return thresh
 
-    def grade_exam(self, warped_img, answers_bubbles, correct_answers=None):
+    def binarize(self, warped_img, bubble_coords=None, groups=None):
+        """
+        Public entry point for the binary image shared by every bubble section,
+        so a sheet is thresholded once instead of once per section.
+
+        Args:
+            warped_img (np.ndarray): Warped sheet (BGR or grayscale).
+            bubble_coords: Every bubble center of the template, shape (N, 2).
+                Needed by the "local" backend and by THRESHOLD_ROI_ONLY;
+                without it the whole page is thresholded.
+            groups: The bubble sections, each shaped (num_groups, num_choices, 2).
+                Needed by OMR.COARSE_TO_FINE (ignored by the "local" backend).
+
+        Returns:
+            np.ndarray: Binary image (255 = ink).
+        """
+        coords = None
+        if bubble_coords is not None and len(bubble_coords) > 0:
+            coords = np.asarray(bubble_coords, dtype=np.intp).reshape(-1, 2)
+
+        if coords is not None and self.cfg.OMR.THRESHOLD_BACKEND == "local":
+            return self._local_background_threshold(warped_img, coords)
+        if coords is not None and groups and self.cfg.OMR.COARSE_TO_FINE:
+            return self._coarse_to_fine_threshold(warped_img, coords, groups)
+        if coords is not None and self.cfg.OMR.THRESHOLD_ROI_ONLY:
+            return self._apply_adaptive_threshold(warped_img, self._bubble_roi(coords, warped_img.shape))
+        return self._apply_adaptive_threshold(warped_img)
+
+    def grade_exam(self, warped_img, answers_bubbles, correct_answers=None, thresh=None):
         """
         Chấm điểm phần trắc nghiệm (Answer Section)
         """
         # Sử dụng Adaptive Threshold thay vì Global Threshold
-        thresh = self._apply_adaptive_threshold(warped_img)
-
-        user_answers = {}
-        score = 0
-        
-        for i, question_bubbles in enumerate(answers_bubbles):
-            chosen_idx = self._get_marked_bubble(thresh, question_bubbles)
-            user_answers[i] = chosen_idx
+        if thresh is None:
+            thresh = self._apply_adaptive_threshold(warped_img)
 
-            if correct_answers and i < len(correct_answers):
-                if chosen_idx == correct_answers[i]:
-                    score += 1
+        chosen = self.read_bubble_groups(thresh, answers_bubbles)
+        user_answers = {i: int(idx) for i, idx in enumerate(chosen)}
+        score = self.score_answers(chosen, correct_answers)
 
         return user_answers, score
 
-    def process_sbd(self, warped_img, sbd_bubbles):
+    def score_answers(self, chosen, correct_answers):
+        """
+        Counts matching answers with one vectorized comparison.
+
+        Args:
+            chosen: Chosen choice index per question (-1 = blank).
+            correct_answers: Key as choice indices (-1 = no valid answer), or None.
+
+        Returns:
+            int: Number of correct answers.
+        """
+        if correct_answers is None or len(correct_answers) == 0:
+            return 0
+        chosen = np.asarray(chosen, dtype=np.intp)
+        key = np.asarray(correct_answers, dtype=np.intp)
+        n = min(len(chosen), len(key))
+        chosen, key = chosen[:n], key[:n]
+        return int(np.count_nonzero((chosen == key) & (key >= 0)))
+
+    def process_sbd(self, warped_img, sbd_bubbles, thresh=None):
         """
         Đọc Mã Số Sinh Viên (SBD Section)
         """
         # Cũng dùng Adaptive Threshold cho SBD để đọc chính xác hơn
-        thresh = self._apply_adaptive_threshold(warped_img)
+        if thresh is None:
+            thresh = self._apply_adaptive_threshold(warped_img)
 
-        sbd_str = ""
-        for col_bubbles in sbd_bubbles:
-            chosen_idx = self._get_marked_bubble(thresh, col_bubbles)
-            if chosen_idx != -1:
-                sbd_str += str(chosen_idx)
-            else:
-                sbd_str += "?" 
+        return self._digits_to_str(self.read_bubble_groups(thresh, sbd_bubbles))
 
-        return sbd_str
+    def process_version(self, warped_img, version_bubbles, thresh=None):
+        """
+        Đọc mã đề (Version Section). Same column-per-digit layout as the SBD block.
+        """
+        if thresh is None:
+            thresh = self._apply_adaptive_threshold(warped_img)
 
-    def _get_marked_bubble(self, binary_img, bubbles_coords):
+        return self._digits_to_str(self.read_bubble_groups(thresh, version_bubbles))
+
+    def _digits_to_str(self, chosen):
+        return "".join(str(idx) if idx != -1 else "?" for idx in chosen)
+
+    def read_bubble_groups(self, binary_img, groups):
         """
-        Tìm ô được tô đậm nhất.
+        Reads every bubble group (a question row or a digit column) in one pass.
+
+        Args:
+            binary_img (np.ndarray): Output of the adaptive threshold.
+            groups: Nested list shaped (num_groups, num_choices, 2) of (x, y) centers.
+
+        Returns:
+            np.ndarray: Chosen index per group, -1 where nothing is marked.
         """
-        max_pixels = 0
-        chosen_idx = -1
-        
-        # Lấy tham số từ Config (đã cập nhật)
-        min_pixels = self.cfg.OMR.PIXEL_THRESHOLD
-        radius = self.cfg.OMR.SCAN_RADIUS
+        coords = np.asarray(groups, dtype=np.intp)
+        if coords.size == 0:
+            return np.zeros(0, dtype=np.intp)
+        counts = self._bubble_fill_counts(binary_img, coords)
+        return self._select_marked(counts)
 
+    def bubble_fill_counts(self, binary_img, groups):
+        """
+        Marked pixels of every bubble, e.g. per-digit candidate scores of the
+        SBD block for roster matching.
+
+        Returns:
+            np.ndarray: Counts shaped (num_groups, num_choices).
+        """
+        coords = np.asarray(groups, dtype=np.intp)
+        if coords.size == 0:
+            return np.zeros((0, 0), dtype=np.intp)
+        return self._bubble_fill_counts(binary_img, coords)
+
+    def _disk_offsets(self, radius):
+        """Cached disk_offsets(radius)."""
+        offsets = self._disk_cache.get(radius)
+        if offsets is None:
+            offsets = self._disk_cache[radius] = disk_offsets(radius)
+        return offsets
+
+    def _bubble_fill_counts(self, binary_img, coords, radius=None):
+        """
+        Counts the marked pixels inside every bubble with a single gather.
+
+        Args:
+            binary_img (np.ndarray): Binary image (non-zero = ink).
+            coords (np.ndarray): Integer centers shaped (..., 2) as (x, y).
+            radius (int, optional): Scan radius; defaults to OMR.SCAN_RADIUS.
+
+        Returns:
+            np.ndarray: Pixel counts shaped like coords[..., 0]. Bubbles too
+            close to the image border count as 0, as before.
+        """
+        if radius is None:
+            radius = self.cfg.OMR.SCAN_RADIUS
+        dy, dx = self._disk_offsets(radius)
         h, w = binary_img.shape[:2]
 
-        for idx, (cx, cy) in enumerate(bubbles_coords):
-            # Kiểm tra biên an toàn (tránh lỗi crash nếu toạ độ sát mép)
-            if cx < radius or cx >= w - radius or cy < radius or cy >= h - radius:
-                continue
+        cx = coords[..., 0]
+        cy = coords[..., 1]
+        inside = (cx >= radius) & (cx < w - radius) & (cy >= radius) & (cy < h - radius)
+
+        # Đưa các ô sát mép về (radius, radius) để gather an toàn, rồi bỏ qua kết quả
+        cx = np.where(inside, cx, radius)
+        cy = np.where(inside, cy, radius)
+        samples = binary_img[cy[..., None] + dy, cx[..., None] + dx]
+        counts = np.count_nonzero(samples, axis=-1)
+        return np.where(inside, counts, 0)
+
+    def _select_marked(self, counts):
+        """
+        Picks the most filled bubble along the last axis, -1 when it stays
+        below PIXEL_THRESHOLD. Ties go to the first bubble, as before.
+        """
+        chosen = np.argmax(counts, axis=-1)
+        best = np.take_along_axis(counts, chosen[..., None], axis=-1)[..., 0]
+        return np.where(best < self.cfg.OMR.PIXEL_THRESHOLD, -1, chosen)
 
-            mask = np.zeros(binary_img.shape, dtype=np.uint8)
-            cv2.circle(mask, (cx, cy), radius, 255, -1)
-            
-            pixel_count = cv2.countNonZero(cv2.bitwise_and(binary_img, binary_img, mask=mask))
-            
-            if pixel_count > max_pixels:
-                max_pixels = pixel_count
-                chosen_idx = idx
-        
-        if max_pixels < min_pixels:
-            return -1 
-            
-        return chosen_idx
\ No newline at end of file
+    def _get_marked_bubble(self, binary_img, bubbles_coords):
+        """
+        Tìm ô được tô đậm nhất.
+        """
+        coords = np.asarray(bubbles_coords, dtype=np.intp)
+        if coords.size == 0:
+            return -1
+        return int(self._select_marked(self._bubble_fill_counts(binary_img, coords)))
@@ -1,30 +1,216 @@
 import cv2
 import os
+import time
+import numpy as np
 from src.utils.image_utils import ImageUtils
 from src.core.omr_engine import OMREngine
+from src.core.answer_keys import AnswerKeySet
+from src.core.quality_gate import QualityGate, ImageRejectedError, REASON_LOW_FRAME_CONFIDENCE
+from src.core.identity_code import IdentityReader
+from src.core.digit_reader import IdDigitReader, cross_check, id_box_rects
 
 class Processor:
     def __init__(self, config):
         self.cfg = config
         self.img_utils = ImageUtils(config)
         self.omr = OMREngine(config)
+        self.quality = QualityGate(config, self.img_utils)
+        self.identity = IdentityReader(config)
+        # Chữ số SBD viết tay trong các ô phía trên cột tô (None khi tắt / chưa có mô hình)
+        self.id_digits = IdDigitReader.from_config(config)
+        # RosterIndex (tuỳ chọn) để đối chiếu / sửa SBD theo danh sách thí sinh
+        self.roster = None
+        # Hook đo thời gian từng bước: on_stage(tên bước, giây); None = không đo
+        # Các bước: decode, quality, warp, identity, threshold, read
+        self.on_stage = None
+
+    def _stage(self, name, start):
+        """Reports a stage's time to the on_stage hook; returns the time the next stage starts."""
+        now = time.perf_counter()
+        if self.on_stage is not None:
+            self.on_stage(name, now - start)
+        return now
 
     def process_exam_paper(self, image_path, template_data, correct_answers=None):
         """
         Quy trình xử lý một bài thi
+
+        correct_answers: a single key (list of indices) or an AnswerKeySet,
+        in which case the key is picked from the bubbled version code.
         """
         # 1. Đọc ảnh
+        start = time.perf_counter()
         original_img = cv2.imread(image_path)
         if original_img is None:
             raise ValueError(f"Không thể đọc ảnh: {image_path}")
+        start = self._stage("decode", start)
+
+        results = {}
+
+        # 2. Kiểm tra chất lượng trên ảnh thu nhỏ (mờ, sáng, khung, hướng giấy)
+        #    -> loại sớm ảnh hỏng trước các bước tốn kém
+        if self.cfg.Quality.ENABLED:
+            report = self.quality.assess(original_img, template_data)
+            start = self._stage("quality", start)
+            results["quality"] = {k: v for k, v in report.items() if k != "quad"}
+            if not report["ok"]:
+                raise ImageRejectedError(
+                    report["reason"], f"Ảnh bị loại ({report['reason']}): {image_path}"
+                )
+            # Dùng luôn tứ giác (đã xoay đúng chiều) của bước kiểm tra, không dò biên lại
+            warped_img = self.img_utils.warp_quad(original_img, report["quad"])
+        else:
+            # Tiền xử lý & Căn chỉnh (Warping) khi tắt bước kiểm tra
+            # Lưu ý: Hàm warp_document cần trả về ảnh đã resize về chuẩn (1000x1400)
+            warped_img = self.img_utils.warp_document(original_img)
+        self._stage("warp", start)
 
-        # 2. Tiền xử lý & Căn chỉnh (Warping)
-        # Lưu ý: Hàm warp_document cần trả về ảnh đã resize về chuẩn (1000x1400)
-        warped_img = self.img_utils.warp_document(original_img)
-        
         # Debug: Lưu ảnh đã warp để kiểm tra
         # cv2.imwrite("debug_warped.jpg", warped_img)
 
+        page_results, warped_img = self.grade_warped(warped_img, template_data, correct_answers)
+        results.update(page_results)
+        return results, warped_img
+
+    def process_exam_sheets(self, image_path, template_data, correct_answers=None):
+        """
+        Chấm mọi phiếu trong một ảnh (MultiSheet): đọc ảnh một lần, dò tất cả
+        các khung phiếu, warp và chấm từng phiếu riêng.
+
+        Lỗi của một phiếu không làm mất các phiếu khác: phiếu đó trả về
+        results["error"] (exception) và warped_img None. Khung phiếu có độ tin
+        cậy thấp (góc bị che, rách...) cũng được trả về, với results["error"]
+        là ImageRejectedError, sau các phiếu chấm được.
+
+        Returns:
+            list: (results, warped_img) của từng phiếu theo thứ tự đọc;
+            results["region"] = {"sheet" (1-based), "sheets", "quad" (4 góc
+            trên ảnh gốc)} liên kết kết quả với vùng của ảnh nguồn.
+
+        Raises:
+            ImageRejectedError: Ảnh hỏng (mờ, phơi sáng) hoặc không có phiếu nào.
+        """
+        original_img = cv2.imread(image_path)
+        if original_img is None:
+            raise ValueError(f"Không thể đọc ảnh: {image_path}")
+
+        report = self.quality.assess_sheets(original_img, template_data, self.cfg.MultiSheet.MAX_SHEETS)
+        quality = {k: v for k, v in report.items() if k not in ("quad", "sheets", "rejected_sheets")}
+        if not report["ok"]:
+            raise ImageRejectedError(report["reason"], f"Ảnh bị loại ({report['reason']}): {image_path}")
+
+        pages = []
+        for sheet in report["sheets"]:
+            try:
+                pages.append(self._orient(self.img_utils.warp_quad(original_img, sheet["quad"]), template_data))
+            except Exception as e:
+                pages.append(e)
+        # Chữ số viết tay của mọi phiếu trong ảnh được phân loại cùng một lần;
+        # lỗi ở bước này -> mỗi phiếu tự đọc lại khi chấm, lỗi chỉ rơi vào phiếu hỏng
+        try:
+            written = self.read_written(
+                [page[0] for page in pages if isinstance(page, tuple) and page[1] is None], template_data
+            )
+        except Exception:
+            written = []
+
+        count = len(report["sheets"]) + len(report["rejected_sheets"])
+        sheets = []
+        for index, (sheet, page) in enumerate(zip(report["sheets"], pages), start=1):
+            results, warped_img = {}, None
+            try:
+                if isinstance(page, Exception):
+                    raise page
+                warped_img, identity = page
+                results = self.process_warped(
+                    warped_img, template_data, correct_answers, identity=identity,
+                    written=written.pop(0) if identity is None and written else None
+                )
+            except Exception as e:
+                results, warped_img = {"error": e}, None
+            results["quality"] = dict(quality, frame_confidence=sheet["frame_confidence"], rotation=sheet["rotation"])
+            results["region"] = self._region(sheet, index, count)
+            sheets.append((results, warped_img))
+
+        for index, sheet in enumerate(report["rejected_sheets"], start=len(report["sheets"]) + 1):
+            error = ImageRejectedError(
+                REASON_LOW_FRAME_CONFIDENCE,
+                f"Phiếu {index}/{count} bị loại ({REASON_LOW_FRAME_CONFIDENCE} "
+                f"{sheet['frame_confidence']:.2f}): {image_path}"
+            )
+            results = {"error": error, "quality": dict(quality, frame_confidence=sheet["frame_confidence"]),
+                       "region": self._region(sheet, index, count)}
+            sheets.append((results, None))
+        return sheets
+
+    @staticmethod
+    def _region(sheet, index, count):
+        return {"sheet": index, "sheets": count, "quad": np.rint(sheet["quad"]).astype(int).tolist()}
+
+    def grade_warped(self, warped_img, template_data, correct_answers=None):
+        """
+        Grades a sheet that is already warped (e.g. from a tracked video frame).
+        Returns (results, warped_img); the page is turned upright when the
+        identity QR code shows it was warped upside down.
+        """
+        start = time.perf_counter()
+        warped_img, identity = self._orient(warped_img, template_data)
+        self._stage("identity", start)
+        return self.process_warped(warped_img, template_data, correct_answers, identity=identity), warped_img
+
+    def _orient(self, warped_img, template_data):
+        """(page, identity): the identity QR code and the page turned upright when it was upside down."""
+        # 3. Mã QR định danh (nếu phiếu có): đọc trong vùng template, đồng thời
+        #    cho biết trang có bị warp lộn ngược hay không
+        identity = self.read_identity(warped_img, template_data)
+        if identity is not None and identity["rotation"] == 2:
+            warped_img = cv2.rotate(warped_img, cv2.ROTATE_180)
+        return warped_img, identity
+
+    def read_identity(self, warped_img, template_data):
+        """Decodes the identity QR code of the template's "qr_region", or returns None."""
+        if not self.cfg.Identity.ENABLED or not template_data.get("qr_region"):
+            return None
+        return self.identity.read(warped_img, template_data["qr_region"])
+
+    def read_written(self, warped_imgs, template_data):
+        """
+        Handwritten SBD digits of several pages in one classifier call, or []
+        when the reader is off or the template has no "id_boxes".
+        """
+        if self.id_digits is None or not warped_imgs or not id_box_rects(template_data) \
+                or "mssv_bubbles" not in template_data:
+            return []
+        return self.id_digits.read_many(warped_imgs, template_data)
+
+    def _bubble_points(self, template_data):
+        """Every bubble center of the template as an (N, 2) array."""
+        groups = [
+            np.asarray(template_data[key], dtype=np.intp).reshape(-1, 2)
+            for key in ("mssv_bubbles", "version_bubbles", "answer_bubbles")
+            if template_data.get(key)
+        ]
+        return np.concatenate(groups) if groups else None
+
+    def _bubble_sections(self, template_data):
+        """The bubble sections of the template (SBD, version, answers) as group lists."""
+        return [
+            template_data[key] for key in ("mssv_bubbles", "version_bubbles", "answer_bubbles")
+            if template_data.get(key)
+        ]
+
+    def process_warped(self, warped_img, template_data, correct_answers=None, thresh=None, identity=None,
+                       written=None):
+        """
+        Phần chấm điểm trên ảnh đã warp (chuẩn 1000x1400, màu hoặc xám).
+        Dùng lại được cho trang lấy từ WarpedSheetStore mà không cần đọc/warp lại.
+
+        thresh: ảnh nhị phân có sẵn (vd. trang nhị phân từ store packed);
+        None thì tự phân ngưỡng.
+        identity: kết quả read_identity (mã QR); khi có thì SBD / mã đề lấy
+        từ mã QR thay vì ô tô.
+        written: chữ số viết tay đã đọc sẵn (read_written); None thì tự đọc.
+        """
         results = {}
 
         # 3. TRÍCH XUẤT THÔNG TIN (Info Fields) - MỚI
@@ -39,19 +225,86 @@ class Processor:
                     roi = warped_img[y:y+h, x:x+w]
                     results["info_images"][field_name] = roi
         
+        # Phân ngưỡng một lần, dùng chung cho SBD, mã đề và phần trả lời
+        start = time.perf_counter()
+        if thresh is None:
+            thresh = self.omr.binarize(
+                warped_img, self._bubble_points(template_data), self._bubble_sections(template_data)
+            )
+            start = self._stage("threshold", start)
+        results["binary_img"] = thresh
+
         # 4. ĐỌC SỐ BÁO DANH (SBD) - MỚI
         if "mssv_bubbles" in template_data:
-            sbd = self.omr.process_sbd(warped_img, template_data["mssv_bubbles"])
+            sbd = self.omr.process_sbd(warped_img, template_data["mssv_bubbles"], thresh)
             results["sbd"] = sbd
         else:
             results["sbd"] = "N/A"
 
-        # 5. CHẤM ĐIỂM TRẮC NGHIỆM
+        # SBD in sẵn trong mã QR chính xác hơn ô tô (giữ lại SBD tô để đối chiếu)
+        results["sbd_source"] = "bubbles"
+        if identity is not None:
+            results["identity"] = {k: identity[k] for k in ("sbd", "exam", "version")}
+            results["sbd_bubbled"] = results["sbd"]
+            results["sbd"] = identity["sbd"]
+            results["sbd_source"] = "qr"
+
+        # Không có mã QR: đối chiếu SBD tô với SBD viết tay. Chỉ gắn cờ: SBD gợi ý từ
+        # chữ viết (chữ số tô mờ "?" lấy từ chữ viết) chỉ được dùng khi danh sách xác nhận
+        if identity is None and written is None:
+            written = next(iter(self.read_written([warped_img], template_data)), None)
+        if written is not None:
+            check = cross_check(results["sbd"], written["digits"])
+            results["sbd_written"] = written["digits"]
+            results["sbd_conflicts"] = check["conflicts"]
+            if check["filled"]:
+                results["sbd_filled"] = check["filled"]
+                results["sbd_completed"] = check["sbd"]
+
+        # Đối chiếu danh sách thí sinh: chữ số mờ / tô kép được giải theo các SBD có thật
+        if self.roster is not None and "mssv_bubbles" in template_data:
+            if identity is not None:
+                match = self.roster.match(results["sbd"])
+            else:
+                match = None
+                # SBD đủ chữ số nhờ chữ viết tay: chỉ dùng khi có đúng trong danh sách
+                if "sbd_completed" in results and "?" not in results["sbd_completed"]:
+                    match = self.roster.match(results["sbd_completed"])
+                if match is None or match["sbd"] is None:
+                    counts = self.omr.bubble_fill_counts(thresh, template_data["mssv_bubbles"])
+                    match = self.roster.resolve(
+                        counts, self.cfg.OMR.PIXEL_THRESHOLD,
+                        self.cfg.Roster.MAX_CANDIDATES, self.cfg.Roster.ALLOW_CORRECTION,
+                        self.cfg.Roster.MARK_CONTRAST_RATIO, self.cfg.Roster.MIN_MARK_CONTRAST,
+                        self.cfg.Roster.MIN_CONFIDENT_DIGITS
+                    )
+            results["roster"] = match
+            if match["sbd"] is not None and match["sbd"] != results["sbd"]:
+                results["sbd_read"] = results["sbd"]
+                results["sbd"] = match["sbd"]
+
+        # 5. ĐỌC MÃ ĐỀ & CHỌN ĐÁP ÁN TƯƠNG ỨNG
+        version = None
+        if identity is not None and identity["version"]:
+            version = identity["version"]
+        elif "version_bubbles" in template_data:
+            version = self.omr.process_version(warped_img, template_data["version_bubbles"], thresh)
+        results["version"] = version
+
+        if isinstance(correct_answers, AnswerKeySet):
+            row = correct_answers.select(version)
+            correct_answers = correct_answers.key(row) if row != -1 else None
+        results["answer_key"] = correct_answers
+
+        # 6. CHẤM ĐIỂM TRẮC NGHIỆM
         if "answer_bubbles" in template_data:
 
-            user_answers, score = self.omr.grade_exam(warped_img, template_data["answer_bubbles"], correct_answers)
+            user_answers, score = self.omr.grade_exam(
+                warped_img, template_data["answer_bubbles"], correct_answers, thresh
+            )
             
             results["answers"] = user_answers
             results["score_raw"] = score # Điểm thô (số câu đúng)
-        
-        return results, warped_img
\ No newline at end of file
+
+        self._stage("read", start)
+        return results
\ No newline at end of file
@@ -0,0 +1,288 @@
+import cv2
+import numpy as np
+from typing import Any, Dict, List
+
+from config import Config
+from src.utils.image_utils import ImageUtils
+
+# Reason codes written to the reject list
+REASON_BLURRY = "blurry"
+REASON_UNDEREXPOSED = "underexposed"
+REASON_OVEREXPOSED = "overexposed"
+REASON_NO_FRAME = "no_frame"
+REASON_LOW_FRAME_CONFIDENCE = "low_frame_confidence"
+
+# Góc vuông đen in sẵn (xem tools/generate_sheet.py), toạ độ chuẩn hoá theo khung.
+# Lấy vùng nhỏ ở giữa ô vuông để chịu được lệch do nét khung dày 5pt.
+_CORNER_PATCH_X = (0.012, 0.020)
+_CORNER_PATCH_Y = (0.008, 0.014)
+# Thứ tự góc: TL, TR, BR, BL. Mẫu chuẩn: TL và BR đen.
+_EXPECTED_CORNERS = np.array([True, False, True, False])
+# Bán kính viền ô tròn trên ảnh chuẩn (bubble_r = 7pt ~ 13px)
+_BUBBLE_RING_RADIUS = 13.0
+_RING_ANGLES = np.linspace(0, 2 * np.pi, 16, endpoint=False)
+
+
+def _inside(contour: np.ndarray, point: np.ndarray) -> bool:
+    return cv2.pointPolygonTest(contour.astype(np.float32), (float(point[0]), float(point[1])), False) >= 0
+
+
+def _reading_order(sheets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Sheets sorted by rows (centers less than half a sheet height apart), left to right in a row."""
+    if not sheets:
+        return []
+    row_height = 0.5 * float(np.median([np.ptp(t["_contour"][:, 0, 1]) for t in sheets]))
+    sheets = sorted(sheets, key=lambda t: (round(float(t["_center"][1]) / max(row_height, 1.0)),
+                                           float(t["_center"][0])))
+    return [{k: v for k, v in t.items() if not k.startswith("_")} for t in sheets]
+
+
+class ImageRejectedError(ValueError):
+    """Raised when an image fails the quality gate. `reason` is a reason code."""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class QualityGate:
+    """
+    Cheap pre-check on a thumbnail that runs before warping, OMR and rendering.
+    Measures blur and exposure, finds the printed frame among the candidate
+    quads, and detects the sheet orientation from the asymmetric corner squares.
+    """
+
+    def __init__(self, config: Config, img_utils: ImageUtils | None = None):
+        self.cfg = config
+        self.img_utils = img_utils if img_utils is not None else ImageUtils(config)
+        # (template, điểm trên viền ô tròn): template không đổi trong cả lô nên chỉ tính một lần
+        self._ring_cache = (None, None)
+
+    def assess(self, image: np.ndarray, template_data: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        """
+        Runs every check on a thumbnail of the decoded image.
+
+        Args:
+            image (np.ndarray): The full-resolution BGR image.
+            template_data (dict, optional): Template used to tell 0 from 180 degrees.
+
+        Returns:
+            dict: "ok", "reason" (None or a reason code), the measured metrics,
+            "rotation" (quarter turns applied) and "quad" (document corners
+            [TL, TR, BR, BL] in full-resolution coordinates, or None).
+        """
+        qcfg = self.cfg.Quality
+        report, gray, ratio = self._measure(image)
+        if report["reason"] is not None:
+            return report
+
+        # 2. Dò khung: thử từng tứ giác và từng hướng, giữ cái khớp mẫu nhất
+        quads = self.img_utils.find_quad_candidates(
+            gray, qcfg.MAX_FRAME_CANDIDATES, qcfg.MIN_FRAME_AREA_RATIO
+        )
+        if not quads:
+            report["reason"] = REASON_NO_FRAME
+            return report
+
+        scored = self._orientations(gray, quads)
+        # Chỉ các ứng viên tốt nhất mới cần so viền ô tròn (phân biệt 0 / 180 độ)
+        top_confidence = max(item[0] for item in scored)
+        ring_points = self._template_ring_points(template_data)
+        best_key, best_quad, best_rotation = None, None, 0
+        for confidence, rotation, oriented, _ in scored:
+            if confidence < top_confidence:
+                continue
+            ring = self._ring_score(self._warp_check(gray, oriented), ring_points) if ring_points is not None else 0.0
+            if best_key is None or (confidence, ring) > best_key:
+                best_key, best_quad, best_rotation = (confidence, ring), oriented, rotation
+
+        report["frame_confidence"] = best_key[0]
+        report["rotation"] = best_rotation
+        report["quad"] = best_quad * ratio
+        if best_key[0] < qcfg.MIN_FRAME_CONFIDENCE:
+            report["reason"] = REASON_LOW_FRAME_CONFIDENCE
+            return report
+
+        report["ok"] = True
+        return report
+
+    def assess_sheets(self, image: np.ndarray, template_data: Dict[str, Any] | None = None,
+                      max_sheets: int = 4) -> Dict[str, Any]:
+        """
+        Like assess, for an image holding several sheets (two A5 half-sheets
+        on one scan, sheets laid side by side in a photo).
+
+        Every candidate quad gets its best orientation; quads are then taken
+        by decreasing (confidence, ring score), skipping any quad nested in /
+        around a quad already taken (paper edge vs printed frame of the same
+        sheet), until max_sheets. A quad taken below MIN_FRAME_CONFIDENCE is
+        a sheet that could not be graded (corner squares hidden, torn...):
+        it is reported rather than silently left out.
+
+        Returns:
+            dict: The image-level report of assess (blur, exposure...) with
+            "sheets": [{"quad", "rotation", "frame_confidence"}] in reading
+            order (top to bottom, left to right), full-resolution coordinates,
+            and "rejected_sheets": the low-confidence quads, same fields.
+            "ok" is True when at least one sheet passed MIN_FRAME_CONFIDENCE.
+        """
+        qcfg, mcfg = self.cfg.Quality, self.cfg.MultiSheet
+        report, gray, ratio = self._measure(image)
+        report["sheets"] = []
+        report["rejected_sheets"] = []
+        if report["reason"] is not None:
+            return report
+
+        quads = self.img_utils.find_quad_candidates(gray, mcfg.MAX_CANDIDATES, mcfg.MIN_AREA_RATIO)
+        if not quads:
+            report["reason"] = REASON_NO_FRAME
+            return report
+
+        # Hướng tốt nhất của từng tứ giác (viền ô tròn chỉ so giữa các hướng cùng độ tin cậy)
+        ring_points = self._template_ring_points(template_data)
+        best: Dict[int, tuple] = {}
+        top = {}
+        scored = self._orientations(gray, quads)
+        for confidence, _, _, index in scored:
+            top[index] = max(top.get(index, 0.0), confidence)
+        for confidence, rotation, oriented, index in scored:
+            if confidence < top[index]:
+                continue
+            ring = self._ring_score(self._warp_check(gray, oriented), ring_points) if ring_points is not None else 0.0
+            if index not in best or (confidence, ring) > best[index][:2]:
+                best[index] = (confidence, ring, rotation, oriented)
+
+        report["frame_confidence"] = max(top.values())
+        taken, low = [], []
+        for confidence, ring, rotation, oriented in sorted(best.values(), key=lambda b: b[:2], reverse=True):
+            if len(taken) + len(low) >= max_sheets:
+                break
+            contour = oriented.reshape(-1, 1, 2)
+            if any(_inside(contour, other["_center"]) or _inside(other["_contour"], oriented.mean(axis=0))
+                   for other in taken + low):
+                continue
+            # Tứ giác độ tin cậy thấp không chồng lên phiếu nào: phiếu không chấm được, vẫn báo lại
+            (taken if confidence >= qcfg.MIN_FRAME_CONFIDENCE else low).append(
+                {"quad": oriented * ratio, "rotation": rotation, "frame_confidence": confidence,
+                 "_center": oriented.mean(axis=0), "_contour": contour}
+            )
+        report["rejected_sheets"] = _reading_order(low)
+        if not taken:
+            report["reason"] = REASON_LOW_FRAME_CONFIDENCE
+            return report
+
+        report["sheets"] = _reading_order(taken)
+        report["ok"] = True
+        return report
+
+    def _measure(self, image: np.ndarray):
+        """
+        Thumbnail and the frame-independent checks (blur, exposure).
+
+        Returns:
+            tuple: (report with "reason" set when a check failed, grayscale
+            thumbnail, full-resolution / thumbnail scale).
+        """
+        qcfg = self.cfg.Quality
+        height, width = image.shape[:2]
+        ratio = height / qcfg.THUMB_HEIGHT
+        # Nội suy tuyến tính như warp_document: nhanh hơn INTER_AREA ~10 lần trên ảnh 5MP
+        thumb = cv2.resize(image, (int(width / ratio), qcfg.THUMB_HEIGHT))
+        gray = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+
+        report = {
+            "ok": False,
+            "reason": None,
+            "sharpness": float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+            "brightness": float(gray.mean()),
+            "clipped_ratio": float(np.count_nonzero(gray >= 250) / gray.size),
+            "frame_confidence": 0.0,
+            "rotation": 0,
+            "quad": None,
+        }
+
+        # 1. Độ nét & phơi sáng: loại ngay, không cần dò khung
+        if report["sharpness"] < qcfg.MIN_SHARPNESS:
+            report["reason"] = REASON_BLURRY
+        elif report["brightness"] < qcfg.MIN_BRIGHTNESS:
+            report["reason"] = REASON_UNDEREXPOSED
+        elif report["brightness"] > qcfg.MAX_BRIGHTNESS or report["clipped_ratio"] > qcfg.MAX_CLIPPED_RATIO:
+            report["reason"] = REASON_OVEREXPOSED
+        return report, gray, ratio
+
+    def _orientations(self, gray: np.ndarray, quads: List[np.ndarray]) -> List[tuple]:
+        """(corner confidence, rotation, oriented quad, quad index) of every quad in its 4 orientations."""
+        # Góc vuông chỉ cần một lần warp cho mỗi tứ giác: xoay 90 độ = hoán vị 4 góc
+        scored = []
+        for index, quad in enumerate(quads):
+            ordered = self.img_utils.order_points(quad)
+            # Tờ giấy nằm ngang trong ảnh -> warp ngang để ô vuông không bị méo
+            landscape = np.linalg.norm(ordered[1] - ordered[0]) > np.linalg.norm(ordered[3] - ordered[0])
+            dark = self._corner_darkness(self._warp_check(gray, ordered, landscape), landscape)
+            for rotation in range(4):
+                confidence = float(np.count_nonzero(np.roll(dark, -rotation) == _EXPECTED_CORNERS)) / 4
+                scored.append((confidence, rotation, np.roll(ordered, -rotation, axis=0), index))
+        return scored
+
+    def _warp_check(self, gray: np.ndarray, quad: np.ndarray, landscape: bool = False) -> np.ndarray:
+        """Warps a quad straight to the small CHECK_SIZE page (one interpolation)."""
+        w, h = self.cfg.Quality.CHECK_SIZE
+        if landscape:
+            w, h = h, w
+        destination = np.array([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]], dtype=np.float32)
+        matrix = cv2.getPerspectiveTransform(quad.astype(np.float32), destination)
+        return cv2.warpPerspective(gray, matrix, (w, h))
+
+    def _corner_darkness(self, page: np.ndarray, landscape: bool = False) -> np.ndarray:
+        """Whether each corner [TL, TR, BR, BL] of the warped quad holds a dark printed square."""
+        h, w = page.shape[:2]
+        patch_x, patch_y = (_CORNER_PATCH_Y, _CORNER_PATCH_X) if landscape else (_CORNER_PATCH_X, _CORNER_PATCH_Y)
+        x0, x1 = int(patch_x[0] * w), max(int(patch_x[1] * w), int(patch_x[0] * w) + 1)
+        y0, y1 = int(patch_y[0] * h), max(int(patch_y[1] * h), int(patch_y[0] * h) + 1)
+        patches = [
+            page[y0:y1, x0:x1],                   # TL
+            page[y0:y1, w - x1:w - x0],           # TR
+            page[h - y1:h - y0, w - x1:w - x0],   # BR
+            page[h - y1:h - y0, x0:x1],           # BL
+        ]
+        paper = float(page.mean())
+        return np.array([p.mean() < 0.6 * paper for p in patches])
+
+    def _template_ring_points(self, template_data: Dict[str, Any] | None) -> np.ndarray | None:
+        """Points on the printed outline of every template bubble, in CHECK_SIZE coordinates."""
+        if not template_data:
+            return None
+        if self._ring_cache[0] is template_data:
+            return self._ring_cache[1]
+        points = self._ring_points(template_data)
+        self._ring_cache = (template_data, points)
+        return points
+
+    def _ring_points(self, template_data: Dict[str, Any]) -> np.ndarray | None:
+        centers: List[np.ndarray] = []
+        for key in ("answer_bubbles", "mssv_bubbles", "version_bubbles"):
+            if template_data.get(key):
+                centers.append(np.asarray(template_data[key], dtype=np.float32).reshape(-1, 2))
+        if not centers:
+            return None
+
+        std_w, std_h = self.cfg.ImageProcessing.STANDARD_SIZE
+        chk_w, chk_h = self.cfg.Quality.CHECK_SIZE
+        scale = np.array([chk_w / std_w, chk_h / std_h], dtype=np.float32)
+        centers = np.concatenate(centers) * scale
+        ring = np.stack([np.cos(_RING_ANGLES), np.sin(_RING_ANGLES)], axis=1) * _BUBBLE_RING_RADIUS * scale
+        points = (centers[:, None, :] + ring[None, :, :]).reshape(-1, 2)
+        points = np.rint(points).astype(np.intp)
+        points[:, 0] = np.clip(points[:, 0], 0, chk_w - 1)
+        points[:, 1] = np.clip(points[:, 1], 0, chk_h - 1)
+        return points
+
+    def _ring_score(self, page: np.ndarray, ring_points: np.ndarray) -> float:
+        """
+        Share of ink on the expected bubble outlines. The corner squares are
+        point-symmetric, so this is what separates upright from upside-down.
+        """
+        ink = cv2.adaptiveThreshold(page, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 15, 10)
+        # Nới 1px để chịu sai số warp trên ảnh nhỏ
+        ink = cv2.dilate(ink, np.ones((3, 3), np.uint8))
+        return float(np.count_nonzero(ink[ring_points[:, 1], ring_points[:, 0]])) / len(ring_points)
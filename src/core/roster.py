@@ -0,0 +1,216 @@
+import numpy as np
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List
+
+# Kết quả đối chiếu SBD với danh sách thí sinh
+ROSTER_EXACT = "exact"            # đọc rõ mọi chữ số và có trong danh sách
+ROSTER_RESOLVED = "resolved"      # cột tô kép / tối đa một cột trống, chỉ một SBD khớp các chữ số chắc chắn
+ROSTER_CORRECTED = "corrected"    # đọc rõ nhưng không có trong danh sách, đúng một SBD sai 1 chữ số (chỉ gợi ý)
+ROSTER_SUGGESTED = "suggested"    # nhiều cột trống, chỉ một SBD khớp các cột đã tô (chỉ gợi ý)
+ROSTER_AMBIGUOUS = "ambiguous"    # nhiều SBD khớp
+ROSTER_NOT_FOUND = "not_found"    # không SBD nào khớp
+
+
+class RosterIndex:
+    """
+    Index of the student IDs of a roster for validating bubbled SBDs.
+
+    Besides a dict for exact lookup, it keeps one bitset per (digit position,
+    digit value) over the roster rows. The rows consistent with a partial read
+    are the AND of the bitsets of the confident digits (OR-ed over the marked
+    values where a column is double-marked), so a search over 100k students
+    is a handful of 12.5 KB bitwise operations.
+    """
+
+    def __init__(self, students: Iterable[Dict[str, str]], id_digits: int):
+        """
+        Args:
+            students: Dicts with an "sbd" key and optional "name" (see file_io.load_roster).
+            id_digits (int): Number of digit columns of the sheet's SBD block;
+                shorter IDs are zero-padded.
+        """
+        self.id_digits = id_digits
+        self.ids: List[str] = []
+        self.names: List[str] = []
+        self.lookup: Dict[str, int] = {}
+        self.roster_duplicates: List[str] = []
+
+        skipped = 0
+        for student in students:
+            sbd = str(student.get("sbd", "")).strip()
+            if not sbd.isdigit() or len(sbd) > id_digits:
+                skipped += 1
+                continue
+            sbd = sbd.zfill(id_digits)
+            if sbd in self.lookup:
+                self.roster_duplicates.append(sbd)
+                continue
+            self.lookup[sbd] = len(self.ids)
+            self.ids.append(sbd)
+            self.names.append(student.get("name", ""))
+        if skipped:
+            print(f"Warning: {skipped} roster entr(ies) with an invalid SBD skipped.")
+        if self.roster_duplicates:
+            print(f"Warning: {len(self.roster_duplicates)} duplicate SBD(s) in the roster.")
+
+        # Ma trận chữ số (N, D) và bitset cho từng (vị trí, chữ số)
+        n = len(self.ids)
+        self.digits = (np.frombuffer("".join(self.ids).encode("ascii"), dtype=np.uint8) - ord("0")).reshape(n, id_digits)
+        self._bits = np.stack([
+            np.stack([np.packbits(self.digits[:, p] == v) for v in range(10)])
+            for p in range(id_digits)
+        ]) if n else np.zeros((id_digits, 10, 0), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _rows(self, bits: np.ndarray) -> np.ndarray:
+        # Chỉ giải nén các byte khác 0 (thường rất ít) thay vì cả bitset
+        nonzero = np.flatnonzero(bits)
+        set_bits = np.unpackbits(bits[nonzero]).reshape(-1, 8).astype(bool)
+        rows = (nonzero[:, None] * 8 + np.arange(8))[set_bits]
+        return rows[rows < len(self.ids)]
+
+    def _candidates(self, allowed: List[np.ndarray]) -> np.ndarray:
+        """
+        Rows whose digit at each position is in allowed[p] (None = any digit).
+        With no constrained position at all nothing is returned: the caller
+        must not rank the whole roster.
+        """
+        acc = None
+        for p, values in enumerate(allowed):
+            if values is None:
+                continue
+            bits = np.bitwise_or.reduce(self._bits[p, values], axis=0)
+            acc = bits if acc is None else acc & bits
+        if acc is None:
+            return np.zeros(0, dtype=np.intp)
+        return self._rows(acc)
+
+    def _result(self, status, row=None, candidates=()):
+        return {
+            "status": status,
+            "sbd": self.ids[row] if row is not None else None,
+            "name": self.names[row] if row is not None else None,
+            "candidates": [self.ids[r] for r in candidates],
+        }
+
+    def match(self, sbd: str) -> Dict[str, Any]:
+        """Exact lookup of an ID read without uncertainty (e.g. from the QR code)."""
+        row = self.lookup.get(str(sbd).zfill(self.id_digits))
+        return self._result(ROSTER_EXACT, row) if row is not None else self._result(ROSTER_NOT_FOUND)
+
+    @staticmethod
+    def marked_bubbles(counts: np.ndarray, threshold: int, contrast_ratio: float = 0.6,
+                       min_contrast: float = 30) -> np.ndarray:
+        """
+        Marked bubbles of a digit block, judged against the sheet itself.
+
+        An empty bubble with its printed digit already covers ~PIXEL_THRESHOLD
+        pixels, so a bubble counts as marked only when it also stands out from
+        its column's median by contrast_ratio x the sheet's typical mark
+        contrast (median over columns of max - median).
+        """
+        excess = counts - np.median(counts, axis=1, keepdims=True)
+        contrast = float(np.median(excess.max(axis=1)))
+        if contrast < min_contrast:
+            return np.zeros(counts.shape, dtype=bool)
+        return (counts >= threshold) & (excess >= contrast_ratio * contrast)
+
+    def resolve(self, counts: np.ndarray, threshold: int, max_candidates: int = 5,
+                allow_correction: bool = False, contrast_ratio: float = 0.6,
+                min_contrast: float = 30, min_confident: int = 3) -> Dict[str, Any]:
+        """
+        Matches the fill counts of the SBD block against the roster.
+
+        Args:
+            counts (np.ndarray): Filled pixels per bubble, shape (id_digits, 10)
+                (OMREngine.bubble_fill_counts of the "mssv_bubbles").
+            threshold (int): Pixel count of a marked bubble (OMR.PIXEL_THRESHOLD).
+            max_candidates (int): Candidates listed when the match is ambiguous.
+            allow_correction (bool): Look for IDs differing in one digit when a
+                fully confident read is not in the roster. They are only
+                reported as candidates (ROSTER_CORRECTED): a confident read is
+                never replaced, the student may simply not be enrolled.
+            contrast_ratio, min_contrast: See marked_bubbles.
+            min_confident (int): Confident digits needed to search the roster
+                for a partial read; with fewer the sheet is ROSTER_NOT_FOUND
+                (too many IDs would match and ranking them scans the roster).
+
+        A partial read is adopted (ROSTER_RESOLVED) only when its uncertain
+        columns are double-marked, plus at most one blank column; with more
+        blank columns a single matching ID is a suggestion (ROSTER_SUGGESTED),
+        as a short class roster nearly always has one ID for a few digits.
+
+        Returns:
+            dict: "status" (ROSTER_*), "sbd" and "name" of the adopted match
+            (None unless exact / resolved) and "candidates" (best first).
+        """
+        marked = self.marked_bubbles(counts, threshold, contrast_ratio, min_contrast)
+        num_marked = marked.sum(axis=1)
+        confident = num_marked == 1
+
+        if confident.all():
+            read = "".join(str(int(d)) for d in np.argmax(marked, axis=1))
+            row = self.lookup.get(read)
+            if row is not None:
+                return self._result(ROSTER_EXACT, row)
+            if not allow_correction or not len(self.ids):
+                return self._result(ROSTER_NOT_FOUND)
+            # Một chữ số bị đọc sai (vd. tô lệch sang ô bên cạnh): SBD khác đúng 1 vị trí
+            # = hợp theo q của (AND các vị trí p != q), tính bằng AND tiền tố / hậu tố
+            digit_bits = self._bits[np.arange(self.id_digits), [int(d) for d in read]]
+            ones = np.full(digit_bits.shape[1], 0xFF, dtype=np.uint8)
+            prefix = [ones]
+            for bits in digit_bits[:-1]:
+                prefix.append(prefix[-1] & bits)
+            suffix = ones
+            acc = np.zeros_like(ones)
+            for q in range(self.id_digits - 1, -1, -1):
+                acc |= prefix[q] & suffix
+                suffix = suffix & digit_bits[q]
+            rows = self._rows(acc)
+            if len(rows) == 1:
+                return self._result(ROSTER_CORRECTED, candidates=rows)
+            return self._result(ROSTER_AMBIGUOUS if len(rows) else ROSTER_NOT_FOUND,
+                                candidates=rows[:max_candidates])
+
+        # Quá ít chữ số chắc chắn (vd. khối SBD bỏ trống): không quét cả danh sách
+        if confident.sum() < min_confident:
+            return self._result(ROSTER_NOT_FOUND)
+
+        # Cột tô kép -> chỉ các chữ số đã tô; cột trống -> chữ số bất kỳ
+        allowed = [
+            np.flatnonzero(marked[p]) if num_marked[p] > 0 else None
+            for p in range(self.id_digits)
+        ]
+        rows = self._candidates(allowed)
+        if len(rows) == 1:
+            # Cột trống là ký tự đại diện: quá một cột trống thì chỉ gợi ý, không thay SBD
+            if np.count_nonzero(num_marked == 0) > 1:
+                return self._result(ROSTER_SUGGESTED, candidates=rows)
+            return self._result(ROSTER_RESOLVED, rows[0], rows)
+        if not len(rows):
+            return self._result(ROSTER_NOT_FOUND)
+
+        # Nhiều SBD khớp: xếp theo tổng số pixel tô ở các cột không chắc chắn
+        uncertain = np.flatnonzero(~confident)
+        scores = counts[uncertain[None, :], self.digits[rows][:, uncertain]].sum(axis=1)
+        order = rows[np.argsort(-scores, kind="stable")]
+        return self._result(ROSTER_AMBIGUOUS, candidates=order[:max_candidates])
+
+
+def find_duplicate_ids(records: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+    """
+    Groups graded records by SBD.
+
+    Returns:
+        dict: {sbd: [image, ...]} for every SBD read on more than one sheet
+        (unreadable SBDs containing "?" are ignored).
+    """
+    by_sbd = defaultdict(list)
+    for record in records:
+        sbd = record.get("sbd")
+        if sbd and "?" not in sbd and sbd not in ("N/A", "Unknown"):
+            by_sbd[sbd].append(record["image"])
+    return {sbd: images for sbd, images in by_sbd.items() if len(images) > 1}
@@ -0,0 +1,244 @@
+import json
+import os
+from typing import Any, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+# Số bit 1 của mỗi giá trị byte, khi NumPy < 2.0 chưa có np.bitwise_count
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _hamming(words: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Differing bits between every row of (N, W) uint64 words and the query row."""
+    diff = words ^ query
+    if hasattr(np, "bitwise_count"):
+        counts = np.bitwise_count(diff)
+    else:
+        counts = _POPCOUNT[diff.view(np.uint8)]
+    # Cộng từng cột nhanh hơn sum(axis=1) với số cột nhỏ
+    total = counts[:, 0].astype(np.intp)
+    for j in range(1, counts.shape[1]):
+        total += counts[:, j]
+    return total
+
+
+def _words(fill: bytes) -> np.ndarray:
+    """Fill fingerprint padded to whole uint64 words."""
+    return np.frombuffer(fill + bytes(-len(fill) % 8), dtype=np.uint64)
+
+
+def perceptual_hash(page: np.ndarray, work_size: Tuple[int, int] = (250, 350)) -> int:
+    """
+    64-bit DCT hash of a warped sheet, robust to the lighting of the scan.
+
+    The page is divided by its blurred paper background (removes shadows and
+    uneven exposure), shrunk to 32x32 and the lowest 8x8 DCT coefficients are
+    compared to their median.
+    """
+    gray = cv2.cvtColor(page, cv2.COLOR_BGR2GRAY) if page.ndim == 3 else page
+    small = cv2.resize(gray, work_size, interpolation=cv2.INTER_AREA).astype(np.float32)
+    background = cv2.GaussianBlur(cv2.dilate(small, np.ones((9, 9), np.uint8)), (0, 0), 5)
+    flat = np.clip(small / np.maximum(background, 1), 0, 1)
+
+    dct = cv2.dct(cv2.resize(flat, (32, 32), interpolation=cv2.INTER_AREA))
+    low = dct[:8, :8].ravel()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _marked_bits(omr, binary_img: np.ndarray, groups) -> np.ndarray:
+    """One bit per bubble of the groups, set where the bubble is read as the marked choice."""
+    chosen = omr.read_bubble_groups(binary_img, groups)
+    onehot = np.zeros((len(chosen), len(groups[0])), dtype=bool)
+    marked = np.flatnonzero(chosen >= 0)
+    onehot[marked, chosen[marked]] = True
+    return onehot.ravel()
+
+
+def identity_key(omr, binary_img: np.ndarray, template_data: Dict[str, Any],
+                 qr_identity: Dict[str, Any] | None = None) -> str:
+    """
+    Who the sheet belongs to, compared exactly by the scan index: the QR
+    identity ("qr:<exam>/<sbd>") when the sheet has one, otherwise the bit
+    matrix of the bubbled SBD ("sbd:<hex>"). "" when the SBD block is blank:
+    such a sheet cannot be told apart from another student's and is never
+    reported as a duplicate.
+    """
+    if qr_identity is not None:
+        return f"qr:{qr_identity.get('exam') or ''}/{qr_identity['sbd']}"
+    groups = template_data.get("mssv_bubbles")
+    if not groups:
+        return ""
+    bits = _marked_bits(omr, binary_img, groups)
+    return f"sbd:{np.packbits(bits).tobytes().hex()}" if bits.any() else ""
+
+
+def fill_fingerprint(omr, binary_img: np.ndarray, template_data: Dict[str, Any]) -> bytes:
+    """
+    Bit matrix of the version code and answer bubbles read as marked, one bit
+    per bubble of the template. Two scans of the same sheet give the same
+    matrix up to a borderline mark. The SBD is left out: it is matched
+    exactly through identity_key, never with a tolerance.
+    """
+    bits = [
+        _marked_bits(omr, binary_img, template_data[key])
+        for key in ("version_bubbles", "answer_bubbles") if template_data.get(key)
+    ]
+    if not bits:
+        return b""
+    return np.packbits(np.concatenate(bits)).tobytes()
+
+
+# Các trường của một entry trong file chỉ mục
+ENTRY_KEYS = ("image", "sheet_id", "ident", "phash", "fill")
+
+
+def _key(entry: Dict[str, Any]) -> Tuple[str, str, str, str]:
+    return entry["image"], entry["ident"], entry["phash"], entry["fill"]
+
+
+class ScanIndex:
+    """
+    Near-duplicate index of graded scans, persisted across sessions.
+
+    Every entry keeps the identity key, perceptual hash and fill fingerprint
+    of one sheet. A scan is a duplicate of an entry only when the identity
+    keys are equal (same bubbled SBD bits or same QR code) and both the hash
+    and the answer fingerprint are within the Hamming limits. The hash alone
+    cannot tell sheets of one template apart, and a tolerance on the SBD
+    would merge two students whose IDs differ by one digit.
+
+    Fingerprints live in growable numpy buffers of uint64 words, one per
+    fingerprint length (a template change never matches old entries), with
+    the identity key as an integer code per row, so a lookup is one
+    vectorized compare over the index plus XOR + popcount over the few rows
+    of the same student.
+
+    The file is append-only JSON lines like ProgressJournal. Pickling (worker
+    processes) drops the file: a worker gets a read-only snapshot.
+    """
+
+    def __init__(self, file_path: str | None = None, max_hash_distance: int = 10,
+                 max_fill_distance: int = 2, fsync: bool = False):
+        """
+        Args:
+            file_path (str, optional): Index file; loaded if it exists. None
+                keeps the index in memory (current batch only).
+            max_hash_distance (int): Max differing bits of the perceptual hashes.
+            max_fill_distance (int): Max differing bubbles of the fill
+                fingerprints (one answer read differently = 2).
+            fsync (bool): fsync after every entry.
+        """
+        self.file_path = file_path
+        self.max_hash_distance = max_hash_distance
+        self.max_fill_distance = max_fill_distance
+        self.fsync = fsync
+        self.entries: List[Dict[str, Any]] = []
+        # Độ dài fingerprint -> (hash (N,), fingerprint (N, B), chỉ số entry (N,), mã định danh (N,), số dòng đã dùng)
+        self._buffers: Dict[int, list] = {}
+        # identity key -> số nguyên, so sánh định danh trong buffer bằng numpy
+        self._idents: Dict[str, int] = {}
+        self._keys = set()
+
+        self._file = None
+        if file_path:
+            if os.path.exists(file_path):
+                self._load()
+            self._file = open(file_path, 'a', encoding='utf-8')
+
+    def _load(self) -> None:
+        with open(self.file_path, 'rb') as f:
+            data = f.read()
+        # Dòng cuối ghi dở (crash) bị cắt bỏ như ProgressJournal
+        valid_size = data.rfind(b"\n") + 1
+        if valid_size < len(data):
+            os.truncate(self.file_path, valid_size)
+        for line in data[:valid_size].decode('utf-8').splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # Entry của định dạng cũ (không có "ident") không được dùng để so trùng
+            if isinstance(entry, dict) and all(k in entry for k in ENTRY_KEYS):
+                self._insert(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_file"] = None
+        return state
+
+    def _insert(self, entry: Dict[str, Any]) -> None:
+        fill = bytes.fromhex(entry["fill"])
+        words = _words(fill)
+        buf = self._buffers.get(len(fill))
+        if buf is None:
+            buf = [np.zeros(64, np.uint64), np.zeros((64, len(words)), np.uint64),
+                   np.zeros(64, np.intp), np.zeros(64, np.intp), 0]
+            self._buffers[len(fill)] = buf
+        n = buf[4]
+        if n == len(buf[0]):
+            buf[0] = np.resize(buf[0], 2 * n)
+            buf[1] = np.resize(buf[1], (2 * n, len(words)))
+            buf[2] = np.resize(buf[2], 2 * n)
+            buf[3] = np.resize(buf[3], 2 * n)
+        buf[0][n] = int(entry["phash"], 16)
+        buf[1][n] = words
+        buf[2][n] = len(self.entries)
+        buf[3][n] = self._idents.setdefault(entry["ident"], len(self._idents))
+        buf[4] = n + 1
+        self.entries.append(entry)
+        self._keys.add(_key(entry))
+
+    def find(self, image: str, ident: str, phash: int, fill: bytes) -> Dict[str, Any] | None:
+        """
+        Returns the closest earlier entry the scan duplicates, or None.
+        A scan without an identity key (blank SBD) never matches. An entry of
+        the same image name with the very same fingerprints is the same file
+        graded again (a rerun), not a duplicate scan, and is skipped.
+        """
+        code = self._idents.get(ident) if ident else None
+        buf = self._buffers.get(len(fill))
+        if code is None or buf is None or not buf[4]:
+            return None
+        n = buf[4]
+        same_ident = np.flatnonzero(buf[3][:n] == code)
+        if not len(same_ident):
+            return None
+        fill_dist = _hamming(buf[1][same_ident], _words(fill))
+        rows = same_ident[fill_dist <= self.max_fill_distance]
+        if not len(rows):
+            return None
+        fill_dist = fill_dist[fill_dist <= self.max_fill_distance]
+        hash_dist = _hamming(buf[0][rows, None], np.uint64(phash))
+        query = (image, ident, f"{phash:016x}", fill.hex())
+        for i in np.lexsort((hash_dist, fill_dist)):
+            if hash_dist[i] > self.max_hash_distance:
+                continue
+            entry = self.entries[buf[2][rows[i]]]
+            if _key(entry) != query:
+                return entry
+        return None
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        """
+        Adds one graded sheet: {"image", "sheet_id", "ident", "phash" (hex),
+        "fill" (hex)} and appends it to the index file.
+        """
+        entry = {k: entry[k] for k in ENTRY_KEYS}
+        if _key(entry) in self._keys:
+            return
+        self._insert(entry)
+        if self._file is not None:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
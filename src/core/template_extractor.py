@@ -0,0 +1,279 @@
+import cv2
+import numpy as np
+from typing import Any, Dict, List
+
+from config import Config
+from src.core.quality_gate import QualityGate
+from src.utils.image_utils import ImageUtils
+
+
+class TemplateExtractor:
+    """
+    Builds a coordinates.json template from a blank answer sheet, without a GUI.
+
+    The sheet is warped like a graded photo (same frame detection), bubbles are
+    found by contour circularity, grouped into blocks of neighbouring bubbles and
+    each block is snapped to a row / column grid. Blocks of exactly 10 rows above
+    the answer area are digit blocks (student ID, version code); the others are
+    answer blocks, read column by column like generate_sheet lays them out.
+    """
+
+    def __init__(self, config: Config | None = None, img_utils: ImageUtils | None = None):
+        self.cfg = config if config is not None else Config()
+        self.img_utils = img_utils if img_utils is not None else ImageUtils(self.cfg)
+        self.quality = QualityGate(self.cfg, self.img_utils)
+
+    def warp_page(self, image: np.ndarray) -> np.ndarray:
+        """
+        Warps the sheet frame to STANDARD_SIZE. Falls back to the largest quad
+        (kept upright) when the sheet has no corner squares, and to the whole
+        page when no frame is found at all.
+        """
+        report = self.quality.assess(image)
+        if report["quad"] is not None and report["frame_confidence"] >= self.cfg.Quality.MIN_FRAME_CONFIDENCE:
+            return self.img_utils.warp_quad(image, report["quad"])
+
+        # Mẫu không có ô vuông định vị: lấy tứ giác lớn nhất, giữ nguyên hướng
+        qcfg = self.cfg.Quality
+        ratio = image.shape[0] / qcfg.THUMB_HEIGHT
+        thumb = cv2.resize(image, (int(image.shape[1] / ratio), qcfg.THUMB_HEIGHT))
+        quads = self.img_utils.find_quad_candidates(
+            cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY), 1, qcfg.MIN_FRAME_AREA_RATIO
+        )
+        if quads:
+            print("Warning: frame orientation not confirmed, keeping the page upright.")
+            return self.img_utils.warp_quad(image, self.img_utils.order_points(quads[0]) * ratio)
+
+        print("Warning: no frame found, using the whole page.")
+        return cv2.resize(image, self.cfg.ImageProcessing.STANDARD_SIZE)
+
+    def detect_bubbles(self, page: np.ndarray) -> np.ndarray:
+        """
+        Finds the bubble outlines of a warped page.
+
+        Returns:
+            np.ndarray: (N, 3) float array of (x, y, radius), one row per bubble.
+        """
+        tcfg = self.cfg.Template
+        gray = cv2.cvtColor(page, cv2.COLOR_BGR2GRAY) if page.ndim == 3 else page
+        binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+        contours, _ = cv2.findContours(binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+
+        circles = []
+        for c in contours:
+            perimeter = cv2.arcLength(c, True)
+            if perimeter == 0:
+                continue
+            area = cv2.contourArea(c)
+            (x, y), radius = cv2.minEnclosingCircle(c)
+            if radius < tcfg.MIN_BUBBLE_RADIUS:
+                continue
+            if 4 * np.pi * area / perimeter ** 2 < tcfg.MIN_CIRCULARITY:
+                continue
+            if area / (np.pi * radius ** 2) < tcfg.MIN_FILL_RATIO:
+                continue
+            circles.append((x, y, radius))
+        if not circles:
+            return np.zeros((0, 3))
+
+        # Viền ô tròn cho 2 contour (ngoài + trong): giữ contour ngoài (lớn nhất)
+        circles = np.array(sorted(circles, key=lambda c: -c[2]))
+        kept = []
+        for circle in circles:
+            if all(np.hypot(*(circle[:2] - k[:2])) > k[2] / 2 for k in kept):
+                kept.append(circle)
+        kept = np.array(kept)
+
+        median_r = np.median(kept[:, 2])
+        kept = kept[np.abs(kept[:, 2] - median_r) <= tcfg.RADIUS_TOLERANCE * median_r]
+        return kept
+
+    def _group_blocks(self, bubbles: np.ndarray, shape) -> List[np.ndarray]:
+        """Splits bubbles into blocks of neighbours (connected components of a link mask)."""
+        centers = bubbles[:, :2]
+        dist = np.linalg.norm(centers[:, None] - centers[None], axis=2)
+        np.fill_diagonal(dist, np.inf)
+        link = self.cfg.Template.LINK_FACTOR * np.median(dist.min(axis=1))
+
+        # Vẽ mỗi ô thành đĩa bán kính link/2: hai ô gần hơn link thì dính vào nhau
+        mask = np.zeros(shape[:2], dtype=np.uint8)
+        for x, y in centers:
+            cv2.circle(mask, (int(round(x)), int(round(y))), int(np.ceil(link / 2)), 255, -1)
+        _, labels = cv2.connectedComponents(mask)
+        ix = np.clip(np.round(centers).astype(int), 0, [shape[1] - 1, shape[0] - 1])
+        block_ids = labels[ix[:, 1], ix[:, 0]]
+        return [bubbles[block_ids == b] for b in np.unique(block_ids)]
+
+    @staticmethod
+    def _cluster_1d(values: np.ndarray, gap: float):
+        """Groups sorted 1-D positions split at jumps > gap. Returns (centers, index per value)."""
+        order = np.argsort(values)
+        breaks = np.diff(values[order]) > gap
+        group_sorted = np.concatenate([[0], np.cumsum(breaks)])
+        groups = np.empty(len(values), dtype=int)
+        groups[order] = group_sorted
+        centers = np.array([values[groups == g].mean() for g in range(group_sorted[-1] + 1)])
+        return centers, groups
+
+    def _make_grid(self, block: np.ndarray) -> Dict[str, Any]:
+        radius = np.median(block[:, 2])
+        xs, col = self._cluster_1d(block[:, 0], radius)
+        ys, row = self._cluster_1d(block[:, 1], radius)
+        occupied = np.zeros((len(ys), len(xs)), dtype=bool)
+        occupied[row, col] = True
+        return {"xs": xs, "ys": ys, "occupied": occupied, "radius": radius,
+                "left": xs[0], "top": ys[0]}
+
+    def _is_digit_block(self, grid: Dict[str, Any]) -> bool:
+        return len(grid["ys"]) == self.cfg.Template.DIGIT_ROWS and bool(grid["occupied"].all())
+
+    @staticmethod
+    def _point(x, y) -> List[int]:
+        return [int(round(x)), int(round(y))]
+
+    def _digit_columns(self, grid: Dict[str, Any]) -> List[List[List[int]]]:
+        return [[self._point(x, y) for y in grid["ys"]] for x in grid["xs"]]
+
+    def _answer_rows(self, grid: Dict[str, Any]) -> List[List[List[int]]]:
+        rows = []
+        for r, y in enumerate(grid["ys"]):
+            filled = grid["occupied"][r]
+            if not filled.any():
+                continue
+            if not filled.all():
+                # Thiếu ô giữa hàng -> nhiều khả năng do dò sót, lấy theo lưới
+                print(f"Warning: row at y={y:.0f} has {filled.sum()}/{filled.size} bubbles, filled from the grid.")
+            rows.append([self._point(x, y) for x in grid["xs"]])
+        return rows
+
+    def _info_fields(self, page: np.ndarray, radius: float, top_limit: float) -> Dict[str, List[int]]:
+        """
+        Finds the write-in underlines above the bubble blocks. Lines whose ends
+        meet a vertical stroke belong to boxes or the frame and are skipped.
+        """
+        gray = cv2.cvtColor(page, cv2.COLOR_BGR2GRAY) if page.ndim == 3 else page
+        binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+        h, w = binary.shape
+        min_len = int(self.cfg.Template.MIN_FIELD_LINE_RATIO * w)
+
+        horizontal = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (min_len, 1)))
+        vertical = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, int(radius))))
+        vertical = cv2.dilate(vertical, np.ones((5, 5), np.uint8))
+
+        n, _, stats, _ = cv2.connectedComponentsWithStats(horizontal)
+        margin = int(0.02 * min(w, h))
+        lines = []
+        for x, y, lw, lh, _ in stats[1:n]:
+            if y + lh > top_limit or y < margin or x < margin or x + lw > w - margin:
+                continue
+            ends = vertical[y:y + lh, [x, x + lw - 1]]
+            if ends.any():
+                continue
+            lines.append((x, y + lh // 2, lw))
+
+        # Vùng chữ viết ngay trên dòng kẻ, cao ~2.6 bán kính ô (một dòng chữ tay)
+        fields = {}
+        band = 2 * radius
+        for i, (x, y, lw) in enumerate(sorted(lines, key=lambda l: (round(l[1] / band), l[0]))):
+            fields[f"field_{i + 1}"] = [int(x), int(round(y - 2.2 * radius)), int(lw), int(round(2.6 * radius))]
+        return fields
+
+    def _id_boxes(self, page: np.ndarray, columns: List[List[List[int]]], radius: float) -> List[List[int]]:
+        """
+        Finds the write-in box printed above each SBD digit column: the largest
+        square outline centred on the column, between the "0" bubble and 8
+        bubble radii above it. Returns [] unless every column has one.
+        """
+        gray = cv2.cvtColor(page, cv2.COLOR_BGR2GRAY) if page.ndim == 3 else page
+        binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+        h, w = binary.shape
+        boxes = []
+        for column in columns:
+            cx, cy = column[0]
+            x0, x1 = max(int(cx - 4 * radius), 0), min(int(cx + 4 * radius), w)
+            y0, y1 = max(int(cy - 8 * radius), 0), max(int(cy - radius), 0)
+            if x1 <= x0 or y1 <= y0:
+                return []
+            contours, _ = cv2.findContours(binary[y0:y1, x0:x1], cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+            best = None
+            for c in contours:
+                x, y, bw, bh = cv2.boundingRect(c)
+                side = max(bw, bh)
+                if not 1.5 * radius <= side <= 5 * radius or min(bw, bh) < 0.8 * side:
+                    continue
+                if abs(x0 + x + bw / 2 - cx) > radius:
+                    continue
+                if best is None or bw * bh > best[2] * best[3]:
+                    best = [x0 + x, y0 + y, bw, bh]
+            if best is None:
+                return []
+            boxes.append([int(v) for v in best])
+        return boxes
+
+    def extract(self, image: np.ndarray, num_choices: int | None = None) -> Dict[str, Any]:
+        """
+        Args:
+            image (np.ndarray): BGR image of a blank sheet (e.g. a rasterized PDF).
+            num_choices (int, optional): Choices per question; answer blocks with
+                another column count are skipped. Defaults to the most common count.
+
+        Returns:
+            dict: Template with "info_fields", "mssv_bubbles", optional
+            "id_boxes" (write-in box above each SBD column, when the sheet
+            has them), "version_bubbles", "answer_bubbles" and "anchors".
+
+        Raises:
+            ValueError: If no bubbles or no answer block are found.
+        """
+        page = self.warp_page(image)
+        bubbles = self.detect_bubbles(page)
+        if len(bubbles) < 2:
+            raise ValueError("No bubbles found on the sheet.")
+
+        grids = [self._make_grid(b) for b in self._group_blocks(bubbles, page.shape)]
+        grids = [g for g in grids if g["occupied"].sum() >= 2]
+        radius = float(np.median(bubbles[:, 2]))
+        band = 2 * radius
+
+        # Vùng trả lời bắt đầu ở khối không phải khối chữ số cao nhất; nếu mọi khối
+        # đều có 10 hàng (vd. 2 cột x 10 câu) thì là dãy khối thấp nhất
+        others = [g["top"] for g in grids if not self._is_digit_block(g)]
+        answer_top = min(others) if others else max(g["top"] for g in grids)
+        digit_grids = [g for g in grids if self._is_digit_block(g) and g["top"] < answer_top - band]
+        answer_grids = [g for g in grids if not any(g is d for d in digit_grids)]
+
+        if num_choices is None:
+            counts = [len(g["xs"]) for g in answer_grids]
+            num_choices = max(set(counts), key=counts.count) if counts else 0
+        skipped = [g for g in answer_grids if len(g["xs"]) != num_choices]
+        for g in skipped:
+            print(f"Warning: skipped a block of {len(g['xs'])} column(s) at ({g['left']:.0f}, {g['top']:.0f}).")
+        answer_grids = [g for g in answer_grids if len(g["xs"]) == num_choices]
+        if not answer_grids:
+            raise ValueError("No answer block found on the sheet.")
+
+        # Thứ tự câu: theo dãy khối (trên xuống), trong dãy trái sang phải, mỗi khối từ trên xuống
+        answer_grids.sort(key=lambda g: (round(g["top"] / band), g["left"]))
+        answer_bubbles = [row for g in answer_grids for row in self._answer_rows(g)]
+
+        template: Dict[str, Any] = {
+            "info_fields": self._info_fields(page, radius, min(g["top"] for g in grids) - band),
+            "mssv_bubbles": [],
+            "answer_bubbles": answer_bubbles,
+            "anchors": [answer_bubbles[0][0], answer_bubbles[-1][-1]],
+        }
+
+        # Khối chữ số nhiều cột nhất là SBD, khối còn lại (trái nhất) là mã đề
+        digit_grids.sort(key=lambda g: g["left"])
+        if digit_grids:
+            mssv = max(digit_grids, key=lambda g: len(g["xs"]))
+            template["mssv_bubbles"] = self._digit_columns(mssv)
+            id_boxes = self._id_boxes(page, template["mssv_bubbles"], mssv["radius"])
+            if id_boxes:
+                template["id_boxes"] = id_boxes
+            rest = [g for g in digit_grids if g is not mssv]
+            if rest:
+                template["version_bubbles"] = self._digit_columns(rest[0])
+            if len(rest) > 1:
+                print(f"Warning: {len(rest) - 1} extra digit block(s) ignored.")
+        return template
@@ -0,0 +1,178 @@
+import json
+import os
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+INDEX_FILE_NAME = "index.jsonl"
+PART_FILE_PATTERN = "part_{:05d}.bin"
+
+
+class ArtifactBundle:
+    """
+    Packs the per-sheet outputs (rendered result, score card, info crops, JSON
+    record) into a few large container files instead of 6+ small files and a
+    directory per sheet.
+
+    Layout of the bundle directory:
+        part_00000.bin - encoded artifacts back to back; a new part is started
+                         every `sheets_per_part` sheets
+        index.jsonl    - one line per sheet: {"sheet_id", "part",
+                         "items": {name: [offset, length]}} (last entry wins)
+
+    The whole index is loaded on open, so any artifact is read with one seek
+    by sheet ID, without listing directories. Blobs are written and flushed
+    before their index line, so a crash leaves at most unindexed bytes.
+
+    A read-only bundle (listing, reports) never creates, appends to or
+    truncates anything, so it is safe to open while a batch is still
+    appending to the same bundle.
+    """
+
+    def __init__(self, directory: str, sheets_per_part: int = 1000, read_only: bool = False):
+        """
+        Opens an existing bundle (new sheets are appended) or creates a new one.
+
+        Args:
+            directory (str): The bundle directory.
+            sheets_per_part (int): Sheets per container file.
+            read_only (bool): Only read the sheets indexed so far; the bundle
+                must exist (FileNotFoundError otherwise) and add() is refused.
+        """
+        self.directory = directory
+        self.sheets_per_part = sheets_per_part
+        self.read_only = read_only
+        self._index_path = os.path.join(directory, INDEX_FILE_NAME)
+        if read_only:
+            if not os.path.exists(self._index_path):
+                raise FileNotFoundError(f"No bundle index at {self._index_path}")
+        else:
+            os.makedirs(directory, exist_ok=True)
+
+        self._entries: Dict[str, Dict] = {}
+        self._part = 0
+        self._part_sheets = 0
+        self._load_index()
+
+        self._index_file = None if read_only else open(self._index_path, 'a', encoding='utf-8')
+        self._part_file = None
+        self._readers: Dict[int, object] = {}
+
+    def _part_path(self, part: int) -> str:
+        return os.path.join(self.directory, PART_FILE_PATTERN.format(part))
+
+    def _load_index(self) -> None:
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, 'rb') as f:
+            data = f.read()
+        # Dòng cuối chưa có "\n": ghi dở (crash) hoặc đang được ghi (chế độ chỉ đọc).
+        # Chỉ bên ghi mới cắt bỏ như ProgressJournal; bên đọc chỉ bỏ qua dòng đó
+        valid_size = data.rfind(b"\n") + 1
+        if valid_size < len(data) and not self.read_only:
+            os.truncate(self._index_path, valid_size)
+
+        counts: Dict[int, int] = {}
+        for line in data[:valid_size].decode('utf-8').splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(entry, dict) and "sheet_id" in entry and "items" in entry:
+                self._entries[entry["sheet_id"]] = entry
+                counts[entry["part"]] = counts.get(entry["part"], 0) + 1
+        if counts:
+            self._part = max(counts)
+            self._part_sheets = counts[self._part]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, sheet_id: str) -> bool:
+        return sheet_id in self._entries
+
+    def ids(self) -> List[str]:
+        """Returns the sheet ids in the bundle."""
+        return list(self._entries)
+
+    def names(self, sheet_id: str) -> List[str]:
+        """Artifact names stored for one sheet (e.g. "score.png", "info/name.jpg")."""
+        return list(self._entries[sheet_id]["items"])
+
+    def add(self, sheet_id: str, items: Dict[str, bytes]) -> None:
+        """
+        Appends the artifacts of one sheet. A re-used sheet_id points at the new data.
+
+        Args:
+            sheet_id (str): Key used to find the artifacts later.
+            items (dict): {name: encoded bytes}, e.g. from cv2.imencode.
+        """
+        if self.read_only:
+            raise ValueError(f"Bundle {self.directory} is open read-only")
+        if self._part_sheets >= self.sheets_per_part:
+            if self._part_file is not None:
+                self._part_file.close()
+                self._part_file = None
+            self._part += 1
+            self._part_sheets = 0
+        if self._part_file is None:
+            self._part_file = open(self._part_path(self._part), 'ab')
+
+        offset = self._part_file.tell()
+        index = {}
+        for name, blob in items.items():
+            self._part_file.write(blob)
+            index[name] = [offset, len(blob)]
+            offset += len(blob)
+        self._part_file.flush()
+
+        entry = {"sheet_id": sheet_id, "part": self._part, "items": index}
+        self._index_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._index_file.flush()
+        self._entries[sheet_id] = entry
+        self._part_sheets += 1
+
+    def get(self, sheet_id: str, name: str) -> bytes:
+        """Returns the encoded bytes of one artifact (KeyError if absent)."""
+        entry = self._entries[sheet_id]
+        offset, length = entry["items"][name]
+        part = entry["part"]
+        if part == self._part and self._part_file is not None:
+            self._part_file.flush()
+        reader = self._readers.get(part)
+        if reader is None:
+            reader = open(self._part_path(part), 'rb')
+            self._readers[part] = reader
+        reader.seek(offset)
+        return reader.read(length)
+
+    def get_image(self, sheet_id: str, name: str) -> np.ndarray:
+        """Decodes an image artifact."""
+        import cv2
+
+        return cv2.imdecode(np.frombuffer(self.get(sheet_id, name), dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+    def get_json(self, sheet_id: str, name: str = "result.json"):
+        """Decodes a JSON artifact (the graded record by default)."""
+        return json.loads(self.get(sheet_id, name).decode('utf-8'))
+
+    def iter_items(self, sheet_id: str) -> Iterator[Tuple[str, bytes]]:
+        for name in self.names(sheet_id):
+            yield name, self.get(sheet_id, name)
+
+    def close(self) -> None:
+        if self._part_file is not None:
+            self._part_file.close()
+            self._part_file = None
+        for reader in self._readers.values():
+            reader.close()
+        self._readers.clear()
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,210 @@
+import difflib
+import json
+import os
+import types
+import typing
+from typing import Any, Dict, Iterable, List, Tuple
+
+from config import THRESHOLD_BACKENDS, Config, ConfigError
+
+# Không import NumPy / OpenCV ở đây: profile được nạp trước khi main.py đặt số luồng.
+
+PROFILE_EXTENSIONS = (".toml", ".json")
+
+
+def resolve_profile(name: str, profile_dir: str) -> str:
+    """
+    A profile file path from a path or a bare name ("phone-robust" ->
+    <profile_dir>/phone-robust.toml or .json).
+    """
+    if os.path.isfile(name):
+        return name
+    for ext in ("",) + PROFILE_EXTENSIONS:
+        path = os.path.join(profile_dir, name + ext)
+        if os.path.isfile(path):
+            return path
+    available = sorted({os.path.splitext(f)[0] for f in os.listdir(profile_dir)
+                        if f.endswith(PROFILE_EXTENSIONS)}) if os.path.isdir(profile_dir) else []
+    raise ConfigError(f"Profile not found: {name} (available: {', '.join(available) or 'none'})")
+
+
+def load_profile(path: str) -> Dict[str, Any]:
+    """
+    Reads a profile: one table per Config section, e.g.
+
+        description = "..."
+        [OMR]
+        THRESHOLD_BACKEND = "mean"
+
+    TOML needs Python 3.11+ (tomllib); JSON works everywhere.
+    """
+    try:
+        if path.endswith(".toml"):
+            try:
+                import tomllib
+            except ImportError:
+                raise ConfigError(f"{path}: TOML profiles need Python 3.11+, use a .json profile")
+            with open(path, 'rb') as f:
+                data = tomllib.load(f)
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+    except (OSError, ValueError) as e:
+        if isinstance(e, ConfigError):
+            raise
+        raise ConfigError(f"{path}: {e}")
+    if not isinstance(data, dict):
+        raise ConfigError(f"{path}: expected a table of sections")
+    data.pop("description", None)
+    return data
+
+
+def parse_override(text: str) -> Tuple[str, str, Any]:
+    """
+    "OMR.SCAN_RADIUS=15" -> ("OMR", "SCAN_RADIUS", 15). The value is read as
+    JSON (numbers, true/false, [lists], "strings"); anything else is a string.
+    """
+    target, sep, raw = text.partition("=")
+    section, dot, key = target.strip().partition(".")
+    if not sep or not dot or not section or not key:
+        raise ConfigError(f"Override '{text}' must look like Section.KEY=value")
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        value = raw.strip()
+    return section, key.strip(), value
+
+
+def _suggest(name: str, options: Iterable[str]) -> str:
+    close = difflib.get_close_matches(name, list(options), n=1)
+    return f" (did you mean {close[0]}?)" if close else ""
+
+
+def _keys(section) -> List[str]:
+    return [name for name in dir(section) if name.isupper() and not callable(getattr(section, name))]
+
+
+def _coerce(value: Any, expected: Any, where: str) -> Any:
+    """Checks a profile value against the annotation (or the type of the default) of its key."""
+    origin = typing.get_origin(expected)
+    args = typing.get_args(expected)
+    if origin in (typing.Union, types.UnionType):
+        if value is None and type(None) in args:
+            return None
+        return _coerce(value, next(a for a in args if a is not type(None)), where)
+    if origin in (tuple, list):
+        if not isinstance(value, (list, tuple)):
+            raise ConfigError(f"{where}: expected a list, got {value!r}")
+        if origin is tuple and args and args[-1] is not Ellipsis:
+            if len(value) != len(args):
+                raise ConfigError(f"{where}: expected {len(args)} values, got {len(value)}")
+            items = [_coerce(v, a, where) for v, a in zip(value, args)]
+        else:
+            items = [_coerce(v, args[0], where) for v in value] if args else list(value)
+        return tuple(items) if origin is tuple else items
+    if origin is dict:
+        if not isinstance(value, dict):
+            raise ConfigError(f"{where}: expected a table, got {value!r}")
+        key_type, value_type = args or (Any, Any)
+        return {_coerce(k, key_type, where): _coerce(v, value_type, where) for k, v in value.items()}
+    if expected is Any:
+        return value
+    if expected is float and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if expected is bool or isinstance(value, bool):
+        if type(value) is not expected:
+            raise ConfigError(f"{where}: expected {expected.__name__}, got {value!r}")
+        return value
+    if not isinstance(value, expected):
+        raise ConfigError(f"{where}: expected {expected.__name__}, got {value!r}")
+    return value
+
+
+def set_value(cfg: Config, section_name: str, key: str, value: Any) -> None:
+    """Validates the type of one value against the defaults and writes it."""
+    sections = dict(cfg.sections())
+    section = sections.get(section_name)
+    if section is None:
+        raise ConfigError(f"Unknown config section '{section_name}'{_suggest(section_name, sections)}")
+    keys = _keys(section)
+    if key not in keys:
+        raise ConfigError(f"Unknown key {section_name}.{key}{_suggest(key, keys)}")
+    where = f"{section_name}.{key}"
+    expected = typing.get_type_hints(type(section)).get(key, type(getattr(section, key)))
+    value = _coerce(value, expected, where)
+    if section_name == "Paths" and key.endswith(("_PATH", "_DIR")) and not os.path.isabs(value):
+        # Đường dẫn tương đối trong profile tính từ thư mục gốc của project
+        value = os.path.join(cfg.PROJECT_ROOT, value)
+    setattr(section, key, value)
+
+
+def apply_settings(cfg: Config, settings: Dict[str, Any], source: str = "profile") -> None:
+    """Applies {section: {key: value}} (a loaded profile) on top of the current values."""
+    for section_name, values in settings.items():
+        if not isinstance(values, dict):
+            raise ConfigError(f"{source}: '{section_name}' must be a table of keys")
+        for key, value in values.items():
+            try:
+                set_value(cfg, section_name, key, value)
+            except ConfigError as e:
+                raise ConfigError(f"{source}: {e}")
+
+
+# (section, key, check, message): quy tắc giá trị hợp lệ, kiểm tra sau khi nạp xong
+RULES = [
+    ("ImageProcessing", "STANDARD_SIZE", lambda v: min(v) > 0, "must be positive"),
+    ("ImageProcessing", "PROCESSING_RESIZE_HEIGHT", lambda v: v > 0, "must be positive"),
+    ("ImageProcessing", "CANNY_THRESHOLD_1", lambda v: v >= 0, "must be >= 0"),
+    ("Quality", "CHECK_SIZE", lambda v: min(v) > 0, "must be positive"),
+    ("Quality", "MIN_FRAME_CONFIDENCE", lambda v: 0 <= v <= 1, "must be in [0, 1]"),
+    ("Quality", "MIN_FRAME_AREA_RATIO", lambda v: 0 <= v <= 1, "must be in [0, 1]"),
+    ("MultiSheet", "MAX_SHEETS", lambda v: v >= 1, "must be >= 1"),
+    ("MultiSheet", "MIN_AREA_RATIO", lambda v: 0 < v <= 1, "must be in (0, 1]"),
+    ("OMR", "THRESHOLD_BACKEND", lambda v: v in THRESHOLD_BACKENDS, f"must be one of {THRESHOLD_BACKENDS}"),
+    ("OMR", "THRESHOLD_BLOCK_SIZE", lambda v: v >= 3 and v % 2 == 1, "must be odd and >= 3"),
+    ("OMR", "SCAN_RADIUS", lambda v: v > 0, "must be positive"),
+    ("OMR", "PIXEL_THRESHOLD", lambda v: v >= 0, "must be >= 0"),
+    ("OMR", "NUM_CHOICES_PER_QUESTION", lambda v: v >= 2, "must be >= 2"),
+    ("OMR", "COARSE_LEVELS", lambda v: v >= 1, "must be >= 1"),
+    ("Calibration", "RADIUS_CANDIDATES", lambda v: len(v) > 0 and min(v) > 0, "must be positive radii"),
+    ("Roster", "MIN_CONFIDENT_DIGITS", lambda v: v >= 1, "must be >= 1"),
+    ("Batch", "WORKERS", lambda v: v >= 0, "must be >= 0"),
+    ("Output", "THREADS", lambda v: v >= 0, "must be >= 0"),
+    ("Output", "MAX_PENDING", lambda v: v >= 1, "must be >= 1"),
+    ("IdDigits", "MIN_CONFIDENCE", lambda v: 0 <= v <= 1, "must be in [0, 1]"),
+    ("Analytics", "UPPER_LOWER_RATIO", lambda v: 0 < v <= 0.5, "must be in (0, 0.5]"),
+    ("Report", "JPEG_QUALITY", lambda v: 1 <= v <= 100, "must be in [1, 100]"),
+    ("Report", "PART_SHEETS", lambda v: v >= 0, "must be >= 0"),
+    ("OCR", "OCR_LANGUAGES", lambda v: len(v) > 0, "must not be empty"),
+]
+
+
+def validate(cfg: Config) -> None:
+    """Checks the value rules; raises ConfigError listing every violation."""
+    sections = dict(cfg.sections())
+    problems = [
+        f"{section}.{key} = {getattr(sections[section], key)!r} {message}"
+        for section, key, check, message in RULES
+        if not check(getattr(sections[section], key))
+    ]
+    if problems:
+        raise ConfigError("Invalid configuration:\n  " + "\n  ".join(problems))
+
+
+def configure(profile: str | None = None, overrides: Iterable[str] = ()) -> Config:
+    """
+    Builds the startup configuration: defaults, then the profile, then the
+    Section.KEY=value overrides, then validation. The result is not frozen
+    yet (command-line flags and calibration may still change it).
+
+    Raises:
+        ConfigError: Unknown profile / section / key, wrong type or invalid value.
+    """
+    cfg = Config()
+    if profile:
+        path = resolve_profile(profile, cfg.Paths.PROFILE_DIR)
+        apply_settings(cfg, load_profile(path), os.path.basename(path))
+    for text in overrides or ():
+        set_value(cfg, *parse_override(text))
+    validate(cfg)
+    return cfg
@@ -49,6 +49,76 @@ def save_json(data: Dict[str, Any], file_path: str) -> None:
     except IOError as e:
         print(f"Error saving JSON to {file_path}: {e}")
 
+def save_csv(rows: List[List[Any]], file_path: str, header: List[str] | None = None) -> None:
+    """
+    Saves rows to a CSV file.
+
+    Args:
+        rows (List[List]): The rows to write.
+        file_path (str): The path to the output CSV file.
+        header (List[str], optional): Column names written as the first row.
+    """
+    try:
+        with open(file_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            if header:
+                writer.writerow(header)
+            writer.writerows(rows)
+        print(f"--> Saved {len(rows)} rows to {file_path}")
+    except IOError as e:
+        print(f"Error saving CSV to {file_path}: {e}")
+
+def load_image(file_path: str):
+    """
+    Loads a template or sheet image as BGR. PDFs are rasterized (first page).
+
+    OpenCV and pdf2image are imported on first call, so importing file_io
+    stays cheap for tools that only read JSON/CSV.
+
+    Args:
+        file_path (str): Path to a PDF or image file.
+
+    Returns:
+        np.ndarray | None: BGR image, or None if it cannot be loaded.
+    """
+    if get_file_type(file_path) == 'pdf':
+        return load_image_from_pdf(file_path)
+
+    import cv2
+    image = cv2.imread(file_path)
+    if image is None:
+        print(f"Error loading image from {file_path}")
+    return image
+
+def load_image_from_pdf(file_path: str, page: int = 0, dpi: int = 200):
+    """
+    Rasterizes one page of a PDF to a BGR image (needs pdf2image + poppler).
+
+    Args:
+        file_path (str): Path to the PDF.
+        page (int): Zero-based page index.
+        dpi (int): Rasterization resolution.
+
+    Returns:
+        np.ndarray | None: BGR image, or None on failure.
+    """
+    try:
+        import cv2
+        import numpy as np
+        from pdf2image import convert_from_path
+    except ImportError as e:
+        print(f"Error loading PDF {file_path}: {e}")
+        return None
+
+    try:
+        pages = convert_from_path(file_path, dpi=dpi, first_page=page + 1, last_page=page + 1)
+    except Exception as e:
+        print(f"Error loading PDF {file_path}: {e}")
+        return None
+    if not pages:
+        return None
+    return cv2.cvtColor(np.array(pages[0].convert('RGB')), cv2.COLOR_RGB2BGR)
+
 def load_answer_key_from_csv(file_path: str, answer_map: Dict[str, int]) -> List[int] | None:
     """
     Reads an answer key from a CSV file and converts it to index format.
@@ -76,3 +146,103 @@ def load_answer_key_from_csv(file_path: str, answer_map: Dict[str, int]) -> List
     except Exception as e:
         print(f"Error reading the answer key file: {e}")
         return None
+
+def load_answer_keys(file_path: str, answer_map: Dict[str, int],
+                     default_version: str = "*") -> Dict[str, List[int]] | None:
+    """
+    Reads the answer keys of one or more exam versions.
+
+    Supported formats:
+        - Single-key CSV ("1,A" per row): returned under `default_version`.
+        - Multi-key CSV with a header row naming the version codes,
+          e.g. "question,101,102" followed by "1,A,C".
+        CSV answers are placed by their question number, which must run
+        1..N without gaps or repeats; a missing or empty cell gives -1.
+        - JSON object mapping version codes to a string ("ABCD...") or a
+          list of answer letters.
+
+    Args:
+        file_path (str): The path to the CSV or JSON file.
+        answer_map (Dict[str, int]): A map to convert char answers to indices.
+        default_version (str): Version code used for a single-key CSV.
+
+    Returns:
+        A dictionary {version_code: [answer indices]}, or None on failure.
+    """
+    if get_file_type(file_path) == 'json':
+        data = load_json(file_path)
+        if not isinstance(data, dict):
+            return None
+        keys = {
+            str(code): [answer_map.get(str(ch).strip().upper(), -1) for ch in answers]
+            for code, answers in data.items()
+        }
+        print(f"--> Loaded {len(keys)} answer key(s) from {file_path}.")
+        return keys
+
+    try:
+        with open(file_path, mode='r', encoding='utf-8') as file:
+            rows = [row for row in csv.reader(file) if row]
+    except FileNotFoundError:
+        print(f"Error: The answer key file was not found at {file_path}")
+        return None
+    except Exception as e:
+        print(f"Error reading the answer key file: {e}")
+        return None
+
+    if not rows:
+        return {}
+
+    # Dòng đầu không bắt đầu bằng số câu -> là header chứa mã đề
+    if rows[0][0].strip().isdigit():
+        codes = [default_version]
+    else:
+        codes = [code.strip() for code in rows[0][1:]]
+        rows = rows[1:]
+
+    # Đáp án đặt theo số câu (1..N, không thiếu, không trùng), không theo thứ tự dòng
+    numbers = [row[0].strip() for row in rows]
+    if not all(n.isdigit() for n in numbers) or sorted(map(int, numbers)) != list(range(1, len(rows) + 1)):
+        print(f"Error: The answer key {file_path} must number its questions 1..{len(rows)} without gaps "
+              f"or repeats.")
+        return None
+
+    keys = {code: [-1] * len(rows) for code in codes}
+    for number, row in zip(numbers, rows):
+        for col, code in enumerate(codes, start=1):
+            # Ô thiếu / trống = -1 như chữ cái không hợp lệ, các câu sau không bị dồn lên
+            cell = row[col].strip().upper() if col < len(row) else ""
+            keys[code][int(number) - 1] = answer_map.get(cell, -1)
+    print(f"--> Loaded {len(keys)} answer key(s) from {file_path}.")
+    return keys
+
+def load_roster(file_path: str) -> List[Dict[str, str]] | None:
+    """
+    Reads a student roster CSV with a header row (column names are lowercased).
+    An "sbd" column is required; other columns (name, class...) are kept as is.
+
+    Args:
+        file_path (str): The path to the roster CSV.
+
+    Returns:
+        A list of {column: value} dicts, one per student, or None on failure.
+    """
+    try:
+        with open(file_path, mode='r', encoding='utf-8-sig', newline='') as file:
+            reader = csv.DictReader(file)
+            reader.fieldnames = [name.strip().lower() for name in (reader.fieldnames or [])]
+            if "sbd" not in reader.fieldnames:
+                print(f"Error: The roster {file_path} has no 'sbd' column.")
+                return None
+            students = [
+                {key: (value or "").strip() for key, value in row.items() if key}
+                for row in reader if row.get("sbd")
+            ]
+    except FileNotFoundError:
+        print(f"Error: The roster file was not found at {file_path}")
+        return None
+    except Exception as e:
+        print(f"Error reading the roster file: {e}")
+        return None
+    print(f"--> Loaded {len(students)} student(s) from {file_path}.")
+    return students
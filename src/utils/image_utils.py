@@ -60,6 +60,69 @@ class ImageUtils:
 
         return warped
 
+    def find_quad_candidates(self, gray: np.ndarray, max_candidates: int, min_area_ratio: float) -> list:
+        """
+        Lists the 4-point contours of a (downscaled) grayscale image, largest first.
+        Unlike warp_document, nested contours are kept too, so both the paper
+        edge and the printed frame inside it are returned.
+
+        Args:
+            gray (np.ndarray): Grayscale image at processing resolution.
+            max_candidates (int): Maximum number of quads to return.
+            min_area_ratio (float): Minimum quad area as a fraction of the image.
+
+        Returns:
+            list: Quads as float32 arrays of shape (4, 2), in the image's coordinates.
+        """
+        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+        edged = cv2.Canny(
+            blurred,
+            self.cfg.ImageProcessing.CANNY_THRESHOLD_1,
+            self.cfg.ImageProcessing.CANNY_THRESHOLD_2
+        )
+
+        contours, _ = cv2.findContours(edged, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        contours = sorted(contours, key=cv2.contourArea, reverse=True)
+
+        min_area = min_area_ratio * gray.shape[0] * gray.shape[1]
+        quads = []
+        for c in contours:
+            if cv2.contourArea(c) < min_area or len(quads) >= max_candidates:
+                break
+            peri = cv2.arcLength(c, True)
+            approx = cv2.approxPolyDP(c, self.cfg.ImageProcessing.CONTOUR_APPROX_EPSILON * peri, True)
+            if len(approx) == 4:
+                quads.append(approx.reshape(4, 2).astype(np.float32))
+        return quads
+
+    def warp_quad(self, image: np.ndarray, quad: np.ndarray, size: Tuple[int, int] | None = None) -> np.ndarray:
+        """
+        Warps a quad whose points are already ordered [TL, TR, BR, BL] of the
+        document (not of the photo), so a rotated sheet comes out upright.
+
+        Args:
+            image (np.ndarray): The source image.
+            quad (np.ndarray): The 4 document corners, shape (4, 2).
+            size (tuple, optional): Output (width, height). Defaults to STANDARD_SIZE.
+
+        Returns:
+            np.ndarray: The warped document image.
+        """
+        if size is None:
+            size = self.cfg.ImageProcessing.STANDARD_SIZE
+        rect = quad.astype(np.float32)
+        (tl, tr, br, bl) = rect
+        max_width = max(int(np.linalg.norm(br - bl)), int(np.linalg.norm(tr - tl)))
+        max_height = max(int(np.linalg.norm(tr - br)), int(np.linalg.norm(tl - bl)))
+        destination_points = np.array([
+            [0, 0],
+            [max_width - 1, 0],
+            [max_width - 1, max_height - 1],
+            [0, max_height - 1]], dtype="float32")
+        transform_matrix = cv2.getPerspectiveTransform(rect, destination_points)
+        warped = cv2.warpPerspective(image, transform_matrix, (max_width, max_height))
+        return cv2.resize(warped, size)
+
     def order_points(self, points: np.ndarray) -> np.ndarray:
         """
         Sorts 4 coordinate points into a consistent order:
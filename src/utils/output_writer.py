@@ -0,0 +1,265 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+
+class OutputWriter:
+    """
+    Encodes and writes the result images of the graded sheets off the grading
+    thread.
+
+    write_image / write_bytes only queue the job; a small thread pool does the
+    encoding (cv2.imencode releases the GIL) and the file I/O, so a slow disk
+    or network share no longer stalls grading. At most `max_pending` jobs are
+    queued or running: a full queue blocks the caller until a slot frees up,
+    which bounds memory (every job holds an image) and is the only point where
+    grading waits for storage.
+
+    Every file is written to "<path>.tmp" and renamed into place, so a reader
+    (or a crash) never sees a half-written image. With `fsync`, finished temp
+    files are collected and committed `fsync_batch` at a time: fsync every
+    file, rename them all, then fsync each directory once, instead of two
+    fsyncs per file. Until their batch is committed (or flush()), those files
+    are not visible under their final name.
+
+    Jobs are numbered in submit order; done_through() tells how many of the
+    first jobs are finished, so a caller can hand a sheet on once its own
+    files are written without waiting for the whole queue (flush()).
+
+    Directories are created once per writer (cached), not on every file.
+    With `threads` = 0 everything runs synchronously in the caller, as before.
+
+    A write error is logged and counted in stats(); it does not fail the sheet.
+    Callers must not modify an image after queueing it.
+    """
+
+    def __init__(self, threads: int = 2, max_pending: int = 32, fsync: bool = False, fsync_batch: int = 32):
+        """
+        Args:
+            threads (int): Encoding / writing threads; 0 = synchronous.
+            max_pending (int): Maximum queued + running jobs (backpressure).
+            fsync (bool): Make files durable before they are renamed into place.
+            fsync_batch (int): Files committed per fsync batch.
+        """
+        self.fsync = fsync
+        self.fsync_batch = max(fsync_batch, 1)
+        self.max_pending = max(max_pending, 1)
+        self._pool = ThreadPoolExecutor(threads, thread_name_prefix="output-writer") if threads > 0 else None
+        self._slots = threading.Semaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._dirs = set()
+        # (temp path, final path, số thứ tự job) đã ghi xong, chờ fsync + đổi tên theo lô
+        self._unsynced: List[Tuple[str, str, int]] = []
+        # Số thứ tự các job chưa xong (đang chờ, đang ghi hoặc chưa commit)
+        self._open = set()
+
+        # Số liệu
+        self._pending = 0
+        self._max_depth = 0
+        self._depth_sum = 0
+        self._submitted = 0
+        self._latencies: List[float] = []
+        self._bytes = 0
+        self._errors = 0
+        self._wait = 0.0
+        self._waits = 0
+        self._batches = 0
+
+    @classmethod
+    def from_config(cls, config) -> "OutputWriter":
+        ocfg = config.Output
+        return cls(ocfg.THREADS, ocfg.MAX_PENDING, ocfg.FSYNC, ocfg.FSYNC_BATCH)
+
+    def write_image(self, path: str, image: np.ndarray, params: Sequence[int] = ()) -> None:
+        """Queues `image` to be encoded (format from the extension, like cv2.imwrite) and written."""
+        self._submit(path, image, list(params))
+
+    def write_bytes(self, path: str, data: bytes) -> None:
+        """Queues already encoded bytes."""
+        self._submit(path, data, None)
+
+    def _submit(self, path, payload, params) -> None:
+        if not self._slots.acquire(blocking=False):
+            # Hàng đợi đầy: luồng chấm chờ ở đây (backpressure)
+            start = time.perf_counter()
+            self._slots.acquire()
+            with self._lock:
+                self._wait += time.perf_counter() - start
+                self._waits += 1
+        with self._lock:
+            self._pending += 1
+            self._submitted += 1
+            job = self._submitted
+            self._open.add(job)
+            self._depth_sum += self._pending
+            self._max_depth = max(self._max_depth, self._pending)
+        if self._pool is None:
+            self._run(path, payload, params, job)
+        else:
+            self._pool.submit(self._run, path, payload, params, job)
+
+    def submitted(self) -> int:
+        """Number of jobs queued so far (the number of the last one)."""
+        with self._lock:
+            return self._submitted
+
+    def done_through(self) -> int:
+        """Highest N such that jobs 1..N are finished (written, or failed), committed with fsync."""
+        with self._lock:
+            return min(self._open) - 1 if self._open else self._submitted
+
+    def _run(self, path, payload, params, job) -> None:
+        start = time.perf_counter()
+        committed = True
+        try:
+            if params is not None:
+                ok, encoded = cv2.imencode(os.path.splitext(path)[1], payload, params)
+                if not ok:
+                    raise ValueError("image encoding failed")
+                payload = encoded.tobytes()
+            self._ensure_dir(os.path.dirname(path))
+            temp_path = path + ".tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(payload)
+            if self.fsync:
+                committed = False
+                self._commit_later(temp_path, path, job)
+            else:
+                os.replace(temp_path, path)
+            with self._lock:
+                self._latencies.append(time.perf_counter() - start)
+                self._bytes += len(payload)
+        except Exception as e:
+            print(f" !!! Could not write {path}: {e}")
+            with self._lock:
+                self._errors += 1
+        finally:
+            with self._lock:
+                if committed:
+                    self._open.discard(job)
+                self._pending -= 1
+                if self._pending == 0:
+                    self._idle.notify_all()
+            self._slots.release()
+
+    def _ensure_dir(self, directory: str) -> None:
+        if not directory or directory in self._dirs:
+            return
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self._dirs.add(directory)
+
+    def _commit_later(self, temp_path: str, path: str, job: int) -> None:
+        with self._lock:
+            self._unsynced.append((temp_path, path, job))
+            if len(self._unsynced) < self.fsync_batch:
+                return
+            batch, self._unsynced = self._unsynced, []
+        self._commit(batch)
+
+    def _commit(self, batch: List[Tuple[str, str, int]]) -> None:
+        """fsync the temp files, rename them into place, then fsync their directories once."""
+        if not batch:
+            return
+        try:
+            for temp_path, _, _ in batch:
+                fd = os.open(temp_path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            for temp_path, path, _ in batch:
+                os.replace(temp_path, path)
+            if hasattr(os, "O_DIRECTORY"):
+                for directory in {os.path.dirname(path) or "." for _, path, _ in batch}:
+                    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+            with self._lock:
+                self._batches += 1
+        finally:
+            with self._lock:
+                self._open.difference_update(job for _, _, job in batch)
+
+    def flush(self) -> None:
+        """Waits until every queued file is written (and committed, with fsync)."""
+        with self._idle:
+            while self._pending:
+                self._idle.wait()
+            batch, self._unsynced = self._unsynced, []
+        try:
+            self._commit(batch)
+        except OSError as e:
+            print(f" !!! Could not commit {len(batch)} output file(s): {e}")
+            with self._lock:
+                self._errors += len(batch)
+
+    def close(self) -> None:
+        self.flush()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def merge_stats(stats: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Combines the stats() of several writers (one per worker process):
+        counts and times are summed, means weighted by files, maxima kept.
+        "latency_p95_ms" is the highest p95 of the writers, not the p95 of
+        all files. "writers" is the number of writers merged.
+        """
+        files = sum(s["files"] for s in stats)
+        merged = {
+            "files": files,
+            "bytes": sum(s["bytes"] for s in stats),
+            "errors": sum(s["errors"] for s in stats),
+            "latency_mean_ms": sum(s["latency_mean_ms"] * s["files"] for s in stats) / files if files else 0.0,
+            "queue_mean": sum(s["queue_mean"] * s["files"] for s in stats) / files if files else 0.0,
+            "waits": sum(s["waits"] for s in stats),
+            "wait_s": sum(s["wait_s"] for s in stats),
+            "fsync_batches": sum(s["fsync_batches"] for s in stats),
+            "writers": len(stats),
+        }
+        for key in ("latency_p95_ms", "latency_max_ms", "queue_max", "queue_limit"):
+            merged[key] = max((s[key] for s in stats), default=0)
+        return merged
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: {"files", "bytes", "errors", "latency_mean_ms",
+            "latency_p95_ms", "latency_max_ms" (encode + write of one file),
+            "queue_mean", "queue_max", "queue_limit" (jobs queued or running,
+            sampled at every submit), "waits" and "wait_s" (times and total
+            seconds the caller was blocked by a full queue), "fsync_batches"}.
+        """
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+            return {
+                "files": len(self._latencies),
+                "bytes": self._bytes,
+                "errors": self._errors,
+                "latency_mean_ms": float(latencies.mean()) if len(latencies) else 0.0,
+                "latency_p95_ms": float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+                "latency_max_ms": float(latencies.max()) if len(latencies) else 0.0,
+                "queue_mean": self._depth_sum / self._submitted if self._submitted else 0.0,
+                "queue_max": self._max_depth,
+                "queue_limit": self.max_pending,
+                "waits": self._waits,
+                "wait_s": self._wait,
+                "fsync_batches": self._batches,
+            }
@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+# Biến môi trường quyết định số luồng của OpenMP / BLAS (NumPy) và torch (EasyOCR).
+# Chỉ có tác dụng khi được đặt TRƯỚC khi các thư viện này được import.
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+)
+
+
+def available_cores() -> List[int]:
+    """CPU cores this process may run on (respects taskset / cgroup affinity)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_threads(workers: int, threads_per_worker: int = 0, pin: bool = False) -> Dict[str, Any]:
+    """
+    Splits the available cores between the grading processes.
+
+    Args:
+        workers (int): Worker processes (0 = grading in the main process).
+        threads_per_worker (int): Library threads per process; 0 = cores / workers.
+        pin (bool): Give every worker its own slice of cores.
+
+    Returns:
+        dict: {"threads", "workers", "cores" (list of core slices, one per
+        worker slot, or None when not pinning)}.
+    """
+    cores = available_cores()
+    processes = max(workers, 1)
+    threads = threads_per_worker or max(len(cores) // processes, 1)
+    plan = {"threads": threads, "workers": workers, "cores": None}
+    if pin and workers > 0:
+        # Worker i chạy trên `threads` core liên tiếp; nhiều worker hơn số core thì quay vòng
+        plan["cores"] = [
+            [cores[(i * threads + j) % len(cores)] for j in range(threads)]
+            for i in range(workers)
+        ]
+    return plan
+
+
+def set_thread_env(threads: int) -> None:
+    """
+    Caps OpenMP / BLAS / torch threads through the environment. Call before
+    NumPy, OpenCV or torch are imported; child processes inherit it.
+    An explicit value already set by the user is kept.
+    """
+    for name in THREAD_ENV_VARS:
+        os.environ.setdefault(name, str(threads))
+
+
+def configure_process(threads: int, cores: List[int] | None = None) -> None:
+    """
+    Applies the thread budget inside the current process: OpenCV's pool,
+    torch intra-op threads (only if torch is already loaded, e.g. by EasyOCR)
+    and optionally the CPU affinity.
+    """
+    import cv2
+
+    cv2.setNumThreads(threads)
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+
+def describe(plan: Dict[str, Any]) -> str:
+    """One line summary of a thread plan for the log."""
+    cores = len(available_cores())
+    text = f"{cores} core(s), {max(plan['workers'], 1)} process(es) x {plan['threads']} thread(s)"
+    if plan["cores"]:
+        text += ", workers pinned"
+    return text
+
+
+class ParallelismMeter:
+    """
+    Measures how much of the batch actually ran in parallel.
+
+    Every graded sheet reports the wall and CPU time spent on it (inside its
+    worker). Effective parallelism = sum of per-sheet wall time / batch wall
+    time, i.e. how many sheets were in progress on average; CPU use = sum of
+    CPU time / batch wall time, i.e. how many cores were busy. CPU use well
+    above parallelism means library threads, far below it means the workers
+    are waiting (I/O, oversubscribed cores).
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.busy = 0.0
+        self.cpu = 0.0
+        self.sheets = 0
+
+    def add(self, timing: Dict[str, float] | None) -> None:
+        if timing:
+            self.busy += timing["wall"]
+            self.cpu += timing["cpu"]
+            self.sheets += 1
+
+    def report(self) -> Dict[str, float]:
+        elapsed = time.perf_counter() - self.start
+        return {
+            "sheets": self.sheets,
+            "elapsed_s": elapsed,
+            "sheets_per_s": self.sheets / elapsed if elapsed else 0.0,
+            "parallelism": self.busy / elapsed if elapsed else 0.0,
+            "cpu_cores_used": self.cpu / elapsed if elapsed else 0.0,
+        }
@@ -0,0 +1,158 @@
+import cv2
+import json
+import os
+import numpy as np
+from typing import Dict, Iterator, List, Tuple
+
+META_FILE_NAME = "meta.json"
+PAGES_FILE_NAME = "pages.bin"
+INDEX_FILE_NAME = "index.tsv"
+
+
+class WarpedSheetStore:
+    """
+    Stores warped sheets as fixed-stride records in a single memory-mapped file,
+    so re-scoring, rendering and review tools can slice pages without decoding
+    the camera JPEG or re-running the perspective warp.
+
+    Layout of the store directory:
+        meta.json  - page width/height, packed flag and record stride (bytes)
+        pages.bin  - records back to back, record i starts at i * stride
+        index.tsv  - append-only "slot<TAB>sheet_id" lines (last entry wins)
+
+    Grayscale stores keep one byte per pixel. Packed stores keep binary pages
+    (e.g. the adaptive-threshold output) at one bit per pixel, 8x smaller.
+    """
+
+    def __init__(self, directory: str, page_size: Tuple[int, int] = (1000, 1400), packed: bool = False):
+        """
+        Opens an existing store or creates a new one.
+
+        Args:
+            directory (str): The store directory.
+            page_size (tuple): (width, height) of the pages; ignored for an existing store.
+            packed (bool): Bit-pack binary pages; ignored for an existing store.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        meta_path = os.path.join(directory, META_FILE_NAME)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        else:
+            width, height = page_size
+            pixels = width * height
+            meta = {
+                "width": width,
+                "height": height,
+                "packed": packed,
+                "stride": (pixels + 7) // 8 if packed else pixels,
+            }
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, indent=4)
+
+        self.width: int = meta["width"]
+        self.height: int = meta["height"]
+        self.packed: bool = meta["packed"]
+        self.stride: int = meta["stride"]
+
+        self._pages_path = os.path.join(directory, PAGES_FILE_NAME)
+        self._index_path = os.path.join(directory, INDEX_FILE_NAME)
+        self._slots: Dict[str, int] = {}
+        self._count = 0
+        self._load_index()
+
+        # Bỏ bản ghi ghi dở (nếu có) để các slot mới vẫn thẳng hàng theo stride
+        if os.path.exists(self._pages_path) and os.path.getsize(self._pages_path) > self._count * self.stride:
+            os.truncate(self._pages_path, self._count * self.stride)
+
+        self._pages_file = open(self._pages_path, 'ab')
+        self._index_file = open(self._index_path, 'a', encoding='utf-8')
+        self._mmap = None
+
+    def _load_index(self) -> None:
+        # Chỉ tin các slot đã ghi đủ dữ liệu (an toàn khi lần chạy trước bị ngắt)
+        size = os.path.getsize(self._pages_path) if os.path.exists(self._pages_path) else 0
+        self._count = size // self.stride
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t', 1)
+                if len(parts) == 2 and parts[0].isdigit() and int(parts[0]) < self._count:
+                    self._slots[parts[1]] = int(parts[0])
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, sheet_id: str) -> bool:
+        return sheet_id in self._slots
+
+    def ids(self) -> List[str]:
+        """Returns the stored sheet ids in insertion order."""
+        return sorted(self._slots, key=self._slots.get)
+
+    def append(self, sheet_id: str, page: np.ndarray) -> None:
+        """
+        Appends one page. A re-used sheet_id points at the new record.
+
+        Args:
+            sheet_id (str): Key used to find the page later (e.g. the image base name).
+            page (np.ndarray): Grayscale (or BGR, converted) page, or a binary
+                page (non-zero = ink) for a packed store.
+        """
+        if page.ndim == 3:
+            page = cv2.cvtColor(page, cv2.COLOR_BGR2GRAY)
+        if page.shape != (self.height, self.width):
+            raise ValueError(
+                f"Page shape {page.shape} does not match the store ({self.height}, {self.width})"
+            )
+
+        if self.packed:
+            record = np.packbits(page.ravel() != 0)
+        else:
+            record = np.ascontiguousarray(page, dtype=np.uint8).ravel()
+
+        self._pages_file.write(record.tobytes())
+        self._pages_file.flush()
+        self._index_file.write(f"{self._count}\t{sheet_id}\n")
+        self._index_file.flush()
+        self._slots[sheet_id] = self._count
+        self._count += 1
+
+    def _pages(self) -> np.ndarray:
+        # Map lại khi file đã dài thêm kể từ lần đọc trước
+        if self._mmap is None or self._mmap.shape[0] < self._count:
+            self._mmap = np.memmap(self._pages_path, dtype=np.uint8, mode='r',
+                                   shape=(self._count, self.stride))
+        return self._mmap
+
+    def get(self, sheet_id: str) -> np.ndarray:
+        """
+        Returns a stored page.
+
+        Grayscale stores return a read-only, zero-copy view into the mapped file.
+        Packed stores return an unpacked binary page (0 / 255).
+        """
+        record = self._pages()[self._slots[sheet_id]]
+        if not self.packed:
+            return record.reshape(self.height, self.width)
+        bits = np.unpackbits(record, count=self.width * self.height)
+        return (bits * np.uint8(255)).reshape(self.height, self.width)
+
+    def items(self) -> Iterator[Tuple[str, np.ndarray]]:
+        """Iterates (sheet_id, page) in insertion order."""
+        for sheet_id in self.ids():
+            yield sheet_id, self.get(sheet_id)
+
+    def close(self) -> None:
+        """Closes the append handles; pages already returned stay valid."""
+        self._pages_file.close()
+        self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
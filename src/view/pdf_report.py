@@ -0,0 +1,439 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+
+import cv2
+import numpy as np
+from reportlab import rl_config
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+
+from config import Config
+from src.view import renderer
+
+PAGE_W, PAGE_H = A4
+MARGIN = 36
+CHOICES = "ABCDEFGH"
+
+# Form XObject dùng chung: vẽ một lần, mỗi trang chỉ tham chiếu
+SHEET_FORM = "sheet_page"
+TABLE_HEADER_FORM = "table_header"
+
+# Bảng tổng hợp: (tiêu đề, toạ độ x của cột)
+TABLE_COLUMNS = [("#", MARGIN), ("SBD", MARGIN + 34), ("Name", MARGIN + 104), ("Version", MARGIN + 284),
+                 ("Correct", MARGIN + 334), ("Score", MARGIN + 394), ("Image", MARGIN + 444)]
+ROW_H = 14
+
+# Trang thí sinh: ảnh phiếu bên trái, thông tin + bảng đáp án bên phải
+THUMB_BOX = (MARGIN, PAGE_H - MARGIN - 30 - 504, 360, 504)
+INFO_X = MARGIN + 372
+INFO_TOP = PAGE_H - MARGIN - 50
+ANSWER_COL_W = 58
+ANSWER_ROW_H = 11
+
+
+def _fit(text: str, width: float, font: str, size: float) -> str:
+    """Cắt bớt chuỗi cho vừa độ rộng cột."""
+    text = str(text)
+    while text and stringWidth(text, font, size) > width:
+        text = text[:-1]
+    return text
+
+
+def prefetch(items: Iterable[Any], func: Callable[[Any], Any], threads: int) -> Iterator[Any]:
+    """
+    Yields func(item) in order, computing at most 2 x threads items ahead on
+    a thread pool (OpenCV releases the GIL), so only a few results are held.
+    """
+    if threads <= 1:
+        yield from map(func, items)
+        return
+    with ThreadPoolExecutor(threads) as pool:
+        window = deque()
+        for item in items:
+            window.append(pool.submit(func, item))
+            if len(window) > 2 * threads:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+
+class BatchReport:
+    """
+    Class-level PDF report of a graded batch, built while the batch is
+    graded: one compact page per student (annotated sheet thumbnail and
+    answer table) is added as soon as the sheet is graded, and the summary
+    (statistics, score histogram, one table row per student linking to the
+    student's page) is written last, when the batch is complete.
+
+    ReportLab keeps a canvas in memory until it is saved, so the student
+    pages go into part files of Report.PART_SHEETS students
+    (<report>_part001.pdf, ...): a full part is saved and released before
+    the next one starts, and the summary rows wait in a temp file. Memory
+    then stays bounded by one part whatever the batch size. A batch that
+    fits in one part gives a single file (summary after the student pages);
+    otherwise <report>.pdf holds the summary only and its rows link to the
+    pages of the part files. Report.PART_SHEETS = 0 keeps everything in one
+    canvas, which grows with the class (~3x the PDF size).
+
+    The static parts of the pages are drawn once per file as form XObjects
+    and only referenced on every page, like the personalised sheets of
+    tools/generate_sheet.py. Thumbnails are JPEG files embedded as they are
+    (no decoding / re-encoding by ReportLab), so no decoded image is kept.
+    """
+
+    def __init__(self, config: Config, path: str, title: str = "Batch report"):
+        self.cfg = config
+        self.path = path
+        self.title = title
+        self.pages = 0
+        self.sheets = 0
+        # Các file part đã ghi xong
+        self.parts: List[str] = []
+        self._tmp_dir = tempfile.mkdtemp(prefix="omr_report_")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Các dòng của bảng tổng hợp (kèm file / trang của thí sinh), đọc lại khi viết trang tổng hợp
+        self._rows_path = os.path.join(self._tmp_dir, "rows.jsonl")
+        self._rows_file = open(self._rows_path, 'w', encoding='utf-8')
+        self._new_canvas(self._part_path(1))
+
+    def _part_path(self, number: int) -> str:
+        stem, ext = os.path.splitext(self.path)
+        return f"{stem}_part{number:03d}{ext}"
+
+    def _new_canvas(self, path: str) -> None:
+        # Không nén trang: nội dung mỗi trang chỉ vài chục lệnh, ảnh đã là JPEG
+        self.c = canvas.Canvas(path, pagesize=A4, pageCompression=0)
+        self.c.setTitle(self.title)
+        self._canvas_path = path
+        self._canvas_pages = 0
+        self._canvas_sheets = 0
+        self._draw_forms()
+
+    def _save_part(self) -> None:
+        """Writes the current part file; ReportLab drops the pages it held."""
+        self.c.save()
+        self.parts.append(self._canvas_path)
+
+    # ------------------------------------------------------------------
+    # Phần dùng chung
+    # ------------------------------------------------------------------
+    def _draw_forms(self):
+        c = self.c
+        c.beginForm(TABLE_HEADER_FORM)
+        c.setFillColor(colors.HexColor("#e8e8e8"))
+        c.rect(MARGIN - 4, -4, PAGE_W - 2 * MARGIN + 8, ROW_H, stroke=0, fill=1)
+        c.setFillColor(colors.black)
+        c.setFont("Helvetica-Bold", 9)
+        for label, x in TABLE_COLUMNS:
+            c.drawString(x, 0, label)
+        c.endForm()
+
+        c.beginForm(SHEET_FORM)
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(MARGIN, PAGE_H - MARGIN - 14, self.title)
+        c.setLineWidth(0.5)
+        c.line(MARGIN, PAGE_H - MARGIN - 22, PAGE_W - MARGIN, PAGE_H - MARGIN - 22)
+        x, y, w, h = THUMB_BOX
+        c.setStrokeColor(colors.grey)
+        c.rect(x, y, w, h, stroke=1, fill=0)
+        c.setFont("Helvetica", 9)
+        c.setFillColor(colors.grey)
+        for i, label in enumerate(("SBD", "Name", "Version", "Correct", "Score", "Image")):
+            c.drawString(INFO_X, INFO_TOP - i * 16, label)
+        c.drawString(INFO_X, INFO_TOP - 6 * 16 - 6, "Answers (answer / key)")
+        c.endForm()
+
+    def _footer(self):
+        c = self.c
+        c.setFont("Helvetica", 8)
+        c.setFillColor(colors.grey)
+        c.drawRightString(PAGE_W - MARGIN, MARGIN - 16, f"Page {self.pages + 1}")
+        c.setFillColor(colors.black)
+
+    def _show_page(self):
+        self._footer()
+        self.c.showPage()
+        self.pages += 1
+        self._canvas_pages += 1
+
+    # ------------------------------------------------------------------
+    # Trang tổng hợp
+    # ------------------------------------------------------------------
+    def add_summary(self, notes: List[str] | None = None) -> None:
+        """
+        Summary pages: statistics, score histogram and the table of every
+        sheet added so far (rows link to the sheet pages). Called once, after
+        the last add_sheet.
+
+        Args:
+            notes: Extra lines printed under the statistics (rejected images...).
+        """
+        if self.parts:
+            # Đã có part đầy: trang tổng hợp thành file riêng (self.path), part cuối ghi ra luôn
+            self._save_part()
+            self._new_canvas(self.path)
+        self._rows_file.close()
+        with open(self._rows_path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        c = self.c
+        scores = np.array([r["score"] for r in records], dtype=float)
+
+        y = PAGE_H - MARGIN - 14
+        c.setFont("Helvetica-Bold", 16)
+        c.drawString(MARGIN, y, self.title)
+        c.setFont("Helvetica", 9)
+        c.drawRightString(PAGE_W - MARGIN, y, time.strftime("%Y-%m-%d %H:%M"))
+        c.bookmarkPage("summary")
+        c.addOutlineEntry("Summary", "summary", level=0)
+
+        y -= 26
+        c.setFont("Helvetica", 10)
+        lines = [f"Sheets graded: {len(records)}"]
+        if len(scores):
+            lines.append(f"Mean {scores.mean():.2f} | median {np.median(scores):.2f} | std {scores.std():.2f} | "
+                         f"min {scores.min():.2f} | max {scores.max():.2f}")
+        lines.extend(notes or [])
+        for line in lines:
+            c.drawString(MARGIN, y, line)
+            y -= 14
+
+        if len(scores):
+            y = self._histogram(scores, y - 10)
+        self._student_table(records, y - 24)
+
+    def _histogram(self, scores: np.ndarray, top: float) -> float:
+        """Biểu đồ số bài theo khoảng điểm; trả về toạ độ y ngay dưới biểu đồ."""
+        c = self.c
+        step = self.cfg.Report.HISTOGRAM_BIN
+        edges = np.arange(0, 10 + step, step)
+        counts, _ = np.histogram(np.clip(scores, 0, 10), bins=edges)
+        chart_h, label_h = 120, 14
+        bottom = top - chart_h - label_h
+        width = PAGE_W - 2 * MARGIN
+        bar_w = width / len(counts)
+        peak = max(int(counts.max()), 1)
+
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(MARGIN, top, "Score distribution")
+        c.setFont("Helvetica", 7)
+        c.setStrokeColor(colors.black)
+        c.line(MARGIN, bottom + label_h, MARGIN + width, bottom + label_h)
+        for i, count in enumerate(counts):
+            x = MARGIN + i * bar_w
+            h = (chart_h - 24) * count / peak
+            c.setFillColor(colors.HexColor("#4a7ab5"))
+            c.rect(x + 2, bottom + label_h, bar_w - 4, h, stroke=0, fill=1)
+            c.setFillColor(colors.black)
+            if count:
+                c.drawCentredString(x + bar_w / 2, bottom + label_h + h + 2, str(int(count)))
+            c.drawCentredString(x + bar_w / 2, bottom + 4, f"{edges[i]:g}-{edges[i + 1]:g}")
+        return bottom
+
+    def _student_table(self, records: List[Dict[str, Any]], top: float) -> None:
+        c = self.c
+        y = top
+        for i, record in enumerate(records):
+            if i == 0 or y < MARGIN + ROW_H:
+                if i > 0:
+                    self._show_page()
+                    y = PAGE_H - MARGIN - ROW_H
+                c.saveState()
+                c.translate(0, y)
+                c.doForm(TABLE_HEADER_FORM)
+                c.restoreState()
+                y -= ROW_H + 2
+                c.setFont("Helvetica", 9)
+            values = [
+                str(i + 1), record.get("sbd", ""), record.get("name") or "", record.get("version") or "",
+                f"{record.get('score_raw', 0)}/{record.get('num_questions', 0)}", f"{record['score']:.2f}",
+                record["image"],
+            ]
+            for (_, x), value, (_, next_x) in zip(TABLE_COLUMNS, values, TABLE_COLUMNS[1:] + [("", PAGE_W - MARGIN)]):
+                c.drawString(x, y, _fit(value, next_x - x - 6, "Helvetica", 9))
+            # Bấm vào dòng để tới trang của thí sinh (trong file part tương ứng nếu có nhiều file)
+            rect = (MARGIN - 4, y - 3, PAGE_W - MARGIN, y + ROW_H - 3)
+            if self.parts:
+                c.linkURL(f"{os.path.basename(record['_file'])}#page={record['_page']}", rect, relative=0,
+                          thickness=0)
+            else:
+                c.linkRect("", f"sheet_{i}", rect, relative=0, thickness=0)
+            y -= ROW_H
+        self._show_page()
+
+    # ------------------------------------------------------------------
+    # Trang thí sinh
+    # ------------------------------------------------------------------
+    def thumbnail(self, image: np.ndarray | bytes | None, name: str) -> str | None:
+        """
+        Writes the thumbnail of an annotated sheet as a JPEG in the report's
+        temp folder. JPEG bytes (the Paths.THUMBNAIL_NAME saved while grading)
+        are written as they are; other images (BGR array or encoded bytes)
+        are downscaled to Report.THUMB_WIDTH first. Thread-safe; used through
+        prefetch.
+
+        Returns:
+            str: Path of the JPEG, or None when there is no image.
+        """
+        if image is None:
+            return None
+        path = os.path.join(self._tmp_dir, f"{name}.jpg")
+        if isinstance(image, (bytes, bytearray)):
+            if image[:2] == b"\xff\xd8":
+                with open(path, 'wb') as f:
+                    f.write(image)
+                return path
+            image = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                return None
+        with open(path, 'wb') as f:
+            f.write(renderer.encode_thumbnail(image, self.cfg.Report.THUMB_WIDTH, self.cfg.Report.JPEG_QUALITY))
+        return path
+
+    def add_sheet(self, record: Dict[str, Any], thumb_path: str | None = None) -> None:
+        """One page for a graded record, with the thumbnail made by thumbnail()."""
+        part_sheets = self.cfg.Report.PART_SHEETS
+        if part_sheets and self._canvas_sheets == part_sheets:
+            # Part đầy: ghi ra đĩa, bộ nhớ không tăng theo số thí sinh
+            self._save_part()
+            self._new_canvas(self._part_path(len(self.parts) + 1))
+        c = self.c
+        index = self.sheets
+        self.sheets += 1
+        self._canvas_sheets += 1
+        row = {k: record[k] for k in (
+            "sheet_id", "image", "sbd", "name", "version", "score_raw", "num_questions", "score") if k in record}
+        row.update(_file=self._canvas_path, _page=self._canvas_pages + 1)
+        self._rows_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        c.doForm(SHEET_FORM)
+        c.bookmarkPage(f"sheet_{index}")
+        if self._canvas_sheets == 1:
+            c.addOutlineEntry("Students", f"sheet_{index}", level=0)
+        c.addOutlineEntry(f"{record.get('sbd', '')} {record.get('name') or record['image']}", f"sheet_{index}",
+                          level=1)
+        c.setFont("Helvetica", 9)
+        c.drawRightString(PAGE_W - MARGIN, PAGE_H - MARGIN - 14, f"#{index + 1}")
+
+        x, y, w, h = THUMB_BOX
+        if thumb_path is not None:
+            # ReportLab mặc định mã hoá ảnh ASCII85 bằng Python thuần (~80ms/ảnh): nhúng nhị phân
+            use_a85, rl_config.useA85 = rl_config.useA85, 0
+            try:
+                c.drawImage(thumb_path, x, y, w, h, preserveAspectRatio=True, anchor="n")
+            finally:
+                rl_config.useA85 = use_a85
+            os.remove(thumb_path)
+        else:
+            c.setFont("Helvetica", 10)
+            c.setFillColor(colors.grey)
+            c.drawCentredString(x + w / 2, y + h / 2, "No image")
+            c.setFillColor(colors.black)
+
+        values = [record.get("sbd", ""), record.get("name") or "-", record.get("version") or "-",
+                  f"{record.get('score_raw', 0)} / {record.get('num_questions', 0)}",
+                  f"{record['score']:.2f} / 10", record["image"]]
+        for i, value in enumerate(values):
+            c.setFont("Helvetica-Bold" if i == 4 else "Helvetica", 11 if i == 4 else 10)
+            c.drawString(INFO_X + 48, INFO_TOP - i * 16, _fit(value, PAGE_W - MARGIN - INFO_X - 48, "Helvetica", 10))
+        self._answers(record.get("answers", []), record.get("answer_key", []), INFO_TOP - 6 * 16 - 22)
+        self._show_page()
+
+    def _answers(self, answers: List[int], keys: List[int], top: float) -> None:
+        """Bảng đáp án nhiều cột: xanh = đúng, đỏ = sai, xám = bỏ trống."""
+        c = self.c
+        rows = max(int((top - MARGIN) // ANSWER_ROW_H), 1)
+        c.setFont("Helvetica", 8)
+        for q, key in enumerate(keys):
+            answer = answers[q] if q < len(answers) else -1
+            x = INFO_X + (q // rows) * ANSWER_COL_W
+            y = top - (q % rows) * ANSWER_ROW_H
+            if answer == -1:
+                c.setFillColor(colors.grey)
+            elif answer == key:
+                c.setFillColor(colors.HexColor("#1b8a2f"))
+            else:
+                c.setFillColor(colors.HexColor("#c62828"))
+            mark = CHOICES[answer] if 0 <= answer < len(CHOICES) else "-"
+            key_mark = CHOICES[key] if 0 <= key < len(CHOICES) else "-"
+            c.drawString(x, y, f"{q + 1:>2}. {mark} / {key_mark}")
+        c.setFillColor(colors.black)
+
+    def close(self) -> None:
+        if self._canvas_path == self.path:
+            # Trang tổng hợp của báo cáo nhiều part
+            self.c.save()
+        elif self.parts:
+            self._save_part()
+        else:
+            # Một part: cả báo cáo trong một file
+            if self._canvas_pages == 0:
+                self._show_page()
+            self.c.save()
+            os.replace(self._canvas_path, self.path)
+        self._rows_file.close()
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_batch_report(config: Config, records: List[Dict[str, Any]], path: str,
+                       load_image: Callable[[Dict[str, Any]], np.ndarray | bytes | None],
+                       notes: List[str] | None = None) -> int:
+    """
+    Writes the PDF report of records graded earlier (e.g. rebuilding it from
+    the journal); main.py builds it with BatchReport while grading instead.
+
+    Sheet images are read in order (load_image(record): the annotated sheet
+    as a BGR image, its encoded bytes or None) and decoded / downscaled on
+    Report.THREADS threads just ahead of the page being drawn.
+
+    Returns:
+        int: Number of pages.
+    """
+    with BatchReport(config, path) as report:
+        add_stored_sheets(report, records, load_image, config.Report.THREADS)
+        report.add_summary(notes)
+    return report.pages
+
+
+def add_stored_sheets(report: BatchReport, records: List[Dict[str, Any]],
+                      load_image: Callable[[Dict[str, Any]], np.ndarray | bytes | None], threads: int = 1) -> None:
+    """Adds the pages of already graded records, reading their stored images (see write_batch_report)."""
+    # Đọc ảnh tuần tự (bundle không an toàn đa luồng), giải mã + thu nhỏ trên thread pool
+    jobs = ((load_image(record), record["sheet_id"]) for record in records)
+    thumbs = prefetch(jobs, lambda job: report.thumbnail(*job), threads)
+    for record, thumb_path in zip(records, thumbs):
+        report.add_sheet(record, thumb_path)
+
+
+def stored_image_loader(output_dir: str, image_names: List[str], bundle=None) -> Callable[[Dict[str, Any]], bytes | None]:
+    """
+    load_image for write_batch_report: the first of image_names stored for a
+    record (e.g. the thumbnail, then the full result image), from the
+    ArtifactBundle when given (and holding the sheet), otherwise from
+    <output_dir>/<sheet_id>_<name>; None when none was saved.
+    """
+    def load_image(record: Dict[str, Any]) -> bytes | None:
+        sheet_id = record["sheet_id"]
+        for name in image_names:
+            if bundle is not None and sheet_id in bundle:
+                if name in bundle.names(sheet_id):
+                    return bundle.get(sheet_id, name)
+                continue
+            path = os.path.join(output_dir, f"{sheet_id}_{name}")
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    return f.read()
+        return None
+    return load_image
@@ -61,6 +61,16 @@ def create_score_display(final_score: float, num_correct: int, total_questions:
     cv2.putText(score_display, f"Correct: {num_correct} / {total_questions}", (50, 220), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
     return score_display
 
+def encode_thumbnail(image: np.ndarray, width: int, quality: int = 70) -> bytes:
+    """
+    Downscales a result image to `width` px (keeping its aspect ratio) and
+    encodes it as JPEG, e.g. for the PDF report.
+    """
+    h, w = image.shape[:2]
+    width = min(width, w)
+    thumb = cv2.resize(image, (width, max(int(round(h * width / w)), 1)), interpolation=cv2.INTER_AREA)
+    return cv2.imencode(".jpg", thumb, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
 def show_final_results(result_image: np.ndarray, score_image: np.ndarray, ocr_data: Dict, ui_cfg: Config.UIConfig):
     """
     Displays the final result images and prints OCR data.
@@ -0,0 +1,71 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Thêm đường dẫn để import config và src
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+# (tên, lệnh python -c / script). Mỗi mục chạy trong tiến trình mới để đo
+# đúng chi phí khởi động (import) như khi gọi theo từng lần upload / watch-folder.
+CASES = [
+    ("python (baseline)", ["-c", "pass"]),
+    ("main.py --help", ["main.py", "--help"]),
+    ("import config + file_io", ["-c", "import config, src.utils.file_io"]),
+    ("import processor (OMR)", ["-c", "import src.core.processor"]),
+    ("import batch (OMR + render)", ["-c", "import src.core.batch"]),
+    ("import renderer", ["-c", "import src.view.renderer"]),
+    ("import ocr_engine", ["-c", "import src.core.ocr_engine"]),
+    ("import generate_sheet", ["-c", "import tools.generate_sheet"]),
+]
+
+# Các module nặng không được phép bị kéo vào khi chỉ chấm OMR
+FORBIDDEN = ("easyocr", "torch", "pdf2image")
+
+
+def _time_command(args, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=project_root, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def _loaded_forbidden(module):
+    code = (f"import sys, {module}; "
+            f"print(','.join(m for m in {FORBIDDEN!r} if m in sys.modules))")
+    out = subprocess.run([sys.executable, "-c", code], cwd=project_root, check=True,
+                         capture_output=True, text=True).stdout
+    return out.strip()
+
+
+def benchmark_startup(repeat=5):
+    """
+    Đo thời gian khởi động (best of N, ms) của các điểm vào chính và kiểm tra
+    rằng đường OMR không import OCR / PDF backend.
+    """
+    rows = []
+    print(f"{'case':<30} {'ms':>8}")
+    for name, args in CASES:
+        ms = _time_command(args, repeat)
+        rows.append((name, ms))
+        print(f"{name:<30} {ms:>8.1f}")
+
+    for module in ("src.core.batch", "src.core.ocr_engine", "src.utils.file_io"):
+        loaded = _loaded_forbidden(module)
+        if loaded:
+            print(f" ! {module} imports {loaded} at load time")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark startup / import time of the entry points.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per case (best is reported)")
+    args = parser.parse_args()
+
+    benchmark_startup(args.repeat)
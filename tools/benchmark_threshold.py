@@ -0,0 +1,100 @@
+import argparse
+import copy
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# Thêm đường dẫn để import config và src
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from config import Config
+from src.core.omr_engine import OMREngine, THRESHOLD_BACKENDS
+from src.core.processor import Processor
+from src.utils import file_io
+
+# (backend, ROI only, coarse-to-fine) - cấu hình gốc trước đây là ("gaussian", False, False).
+# Backend "local" vốn chỉ tính quanh các ô tròn nên không cần biến thể ROI / hai mức.
+VARIANTS = [(backend, roi, False) for backend in THRESHOLD_BACKENDS if backend != "local" for roi in (False, True)]
+VARIANTS.append(("local", True, False))
+VARIANTS += [(backend, True, True) for backend in THRESHOLD_BACKENDS if backend != "local"]
+
+
+def _read_sheet(engine, warped, template_data, points, sections):
+    thresh = engine.binarize(warped, points, sections)
+    answers = engine.read_bubble_groups(thresh, template_data["answer_bubbles"])
+    sbd = engine.read_bubble_groups(thresh, template_data["mssv_bubbles"])
+    return np.concatenate([answers, sbd])
+
+
+def benchmark_threshold(input_dir, template_path, repeat=5):
+    """
+    Đo tốc độ & độ chính xác của từng backend phân ngưỡng trên một thư mục ảnh.
+    Độ chính xác = tỷ lệ câu trả lời + chữ số SBD trùng với Gaussian toàn ảnh.
+    Ảnh được warp một lần trước khi đo, nên chỉ tính phần phân ngưỡng + đọc ô.
+    """
+    cfg = Config()
+    processor = Processor(cfg)
+    template_data = file_io.load_json(template_path)
+    points = processor._bubble_points(template_data)
+    sections = processor._bubble_sections(template_data)
+
+    pages = []
+    for name in sorted(os.listdir(input_dir)):
+        if not name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            continue
+        image = cv2.imread(os.path.join(input_dir, name))
+        report = processor.quality.assess(image, template_data)
+        if report["ok"]:
+            pages.append(processor.img_utils.warp_quad(image, report["quad"]))
+    if not pages:
+        print(f"No usable images in {input_dir}")
+        return []
+
+    rows = []
+    reference = None
+    for backend, roi, coarse in VARIANTS:
+        variant_cfg = copy.deepcopy(cfg)
+        variant_cfg.OMR.THRESHOLD_BACKEND = backend
+        variant_cfg.OMR.THRESHOLD_ROI_ONLY = roi
+        variant_cfg.OMR.COARSE_TO_FINE = coarse
+        engine = OMREngine(variant_cfg)
+
+        reads, refined = [], 0
+        for page in pages:
+            reads.append(_read_sheet(engine, page, template_data, points, sections))
+            refined += engine.last_refined_groups if coarse else 0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for page in pages:
+                _read_sheet(engine, page, template_data, points, sections)
+        ms_per_sheet = (time.perf_counter() - start) * 1000 / (repeat * len(pages))
+
+        reads = np.stack(reads)
+        if reference is None:
+            reference = reads
+        agreement = float(np.mean(reads == reference)) * 100
+        # Tỷ lệ nhóm ô phải phân ngưỡng lại ở độ phân giải đầy đủ (chế độ hai mức)
+        refined_pct = 100 * refined / (len(pages) * sum(len(s) for s in sections)) if coarse else None
+        rows.append((backend, roi, coarse, ms_per_sheet, agreement, refined_pct))
+
+    print(f"{'backend':<10} {'roi_only':<9} {'coarse':<7} {'ms/sheet':>9} {'agree %':>8} {'refined %':>10}")
+    for backend, roi, coarse, ms, agree, refined_pct in rows:
+        refined_text = f"{refined_pct:.1f}" if refined_pct is not None else "-"
+        print(f"{backend:<10} {str(roi):<9} {str(coarse):<7} {ms:>9.2f} {agree:>8.1f} {refined_text:>10}")
+    return rows
+
+
+if __name__ == "__main__":
+    cfg = Config()
+    parser = argparse.ArgumentParser(description="Benchmark OMR thresholding backends.")
+    parser.add_argument("--input", default=cfg.Paths.BATCH_INPUT_DIR, help="Folder of sheet images")
+    parser.add_argument("--template", default=cfg.Paths.COORDINATES_PATH, help="coordinates.json")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing repetitions")
+    args = parser.parse_args()
+
+    benchmark_threshold(args.input, args.template, args.repeat)
@@ -0,0 +1,62 @@
+import argparse
+import os
+import sys
+
+# Thêm đường dẫn để import config và src
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from config import Config
+from src.utils.artifact_bundle import ArtifactBundle
+
+
+def list_bundle(bundle_dir):
+    """In danh sách phiếu trong bundle cùng điểm (từ result.json) và các ảnh kèm theo."""
+    with ArtifactBundle(bundle_dir, read_only=True) as bundle:
+        for sheet_id in bundle.ids():
+            names = bundle.names(sheet_id)
+            score = bundle.get_json(sheet_id).get("score") if "result.json" in names else None
+            score_text = f"{score:.2f}" if score is not None else "-"
+            print(f"{sheet_id:<30} {score_text:>6}  {', '.join(names)}")
+        print(f"--> {len(bundle)} sheet(s)")
+
+
+def extract_sheets(bundle_dir, sheet_ids, output_dir):
+    """
+    Ghi các file của từng phiếu ra thư mục, đúng tên như khi không dùng bundle:
+    <sheet>_scoring_result.png, <sheet>_score.png, <sheet>_info/<field>.jpg, <sheet>_result.json.
+    """
+    with ArtifactBundle(bundle_dir, read_only=True) as bundle:
+        for sheet_id in sheet_ids or bundle.ids():
+            if sheet_id not in bundle:
+                print(f"Warning: {sheet_id} is not in the bundle.")
+                continue
+            for name, data in bundle.iter_items(sheet_id):
+                folder, base = os.path.split(name)
+                if folder:
+                    path = os.path.join(output_dir, f"{sheet_id}_{folder}", base)
+                else:
+                    path = os.path.join(output_dir, f"{sheet_id}_{base}")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(data)
+            print(f"--> Extracted {sheet_id}")
+
+
+if __name__ == "__main__":
+    cfg = Config()
+    parser = argparse.ArgumentParser(description="List or extract the sheets of a result bundle.")
+    parser.add_argument("--bundle", default=cfg.Paths.BUNDLE_DIR, help="Bundle directory")
+    parser.add_argument("--extract", nargs="*", default=None, metavar="SHEET_ID",
+                        help="Extract these sheets (all if no ID is given)")
+    parser.add_argument("--output", default=cfg.Paths.BATCH_OUTPUT_DIR, help="Output folder for --extract")
+    args = parser.parse_args()
+
+    try:
+        if args.extract is None:
+            list_bundle(args.bundle)
+        else:
+            extract_sheets(args.bundle, args.extract, args.output)
+    except FileNotFoundError as e:
+        raise SystemExit(f"Error: {e}")
@@ -8,7 +8,6 @@ import sys
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root)
 
-from src.core import processor
 from src.utils import file_io
 import config
 
@@ -54,10 +53,8 @@ def get_coordinates_from_user_selection(file_path: str, coord_save_path: str, cf
     """
     # --- Step 1: Get the warped image and the outside area from the file ---
     file_type = file_io.get_file_type(file_path)
-    if file_type == 'pdf':
-        original_image = processor.get_image_from_pdf(file_path)
-    elif file_type in ['png', 'jpg', 'jpeg']:
-        original_image = processor.get_image_from_file(file_path)
+    if file_type in ['pdf', 'png', 'jpg', 'jpeg']:
+        original_image = file_io.load_image(file_path)
     else:
         print(f"Unsupported file type for coordinate selection: {file_type}")
         return [], {}, None, None
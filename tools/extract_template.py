@@ -0,0 +1,80 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+
+# Thêm đường dẫn để import config và src
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from config import Config
+from src.core.template_extractor import TemplateExtractor
+from src.utils import file_io
+
+
+def draw_template(page, template_data, radius):
+    """Vẽ các ô tròn và số câu của template lên ảnh để kiểm tra bằng mắt."""
+    preview = page.copy()
+    for key, color in (("mssv_bubbles", (255, 0, 0)), ("version_bubbles", (0, 160, 255))):
+        for column in template_data.get(key, []):
+            for x, y in column:
+                cv2.circle(preview, (x, y), radius, color, 2)
+    for q, row in enumerate(template_data["answer_bubbles"]):
+        for x, y in row:
+            cv2.circle(preview, (x, y), radius, (0, 200, 0), 2)
+        x, y = row[0]
+        cv2.putText(preview, str(q + 1), (x - 3 * radius, y + radius // 2),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+    for x, y, w, h in template_data["info_fields"].values():
+        cv2.rectangle(preview, (x, y), (x + w, y + h), (0, 0, 255), 2)
+    return preview
+
+
+def extract_template(input_path, output_json_path, num_choices=None, preview_path=None):
+    """
+    Tạo coordinates.json từ PDF / ảnh phiếu trắng, không cần chọn điểm bằng tay.
+    Các vùng info_fields được đặt tên field_1, field_2... (trên xuống, trái sang phải);
+    đổi tên lại (name, class...) nếu cần hậu xử lý OCR theo tên trường.
+    """
+    cfg = Config()
+    image = file_io.load_image(input_path)
+    if image is None:
+        print(f"Failed to load image from {input_path}.")
+        return None
+
+    start = time.perf_counter()
+    extractor = TemplateExtractor(cfg)
+    template_data = extractor.extract(image, num_choices)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    print(f"--> Answers: {len(template_data['answer_bubbles'])} question(s) x "
+          f"{len(template_data['answer_bubbles'][0])} choice(s)")
+    print(f"--> Student ID: {len(template_data['mssv_bubbles'])} digit(s)")
+    if "version_bubbles" in template_data:
+        print(f"--> Version: {len(template_data['version_bubbles'])} digit(s)")
+    print(f"--> Info fields: {len(template_data['info_fields'])}")
+    print(f"--> Extracted in {elapsed:.0f} ms")
+
+    file_io.save_json(template_data, output_json_path)
+
+    if preview_path:
+        page = extractor.warp_page(image)
+        radius = int(round(extractor.detect_bubbles(page)[:, 2].mean()))
+        cv2.imwrite(preview_path, draw_template(page, template_data, radius))
+        print(f"--> Preview saved to {preview_path}")
+    return template_data
+
+
+if __name__ == "__main__":
+    cfg = Config()
+    parser = argparse.ArgumentParser(description="Build coordinates.json from a blank answer sheet (PDF or image).")
+    parser.add_argument("--input", required=True, help="Blank sheet PDF or image")
+    parser.add_argument("--output", default=cfg.Paths.COORDINATES_PATH, help="Output coordinates.json")
+    parser.add_argument("--choices", type=int, default=None, help="Choices per question (default: detected)")
+    parser.add_argument("--preview", default=None, help="Save an image with the detected template drawn on it")
+    args = parser.parse_args()
+
+    extract_template(args.input, args.output, args.choices, args.preview)
@@ -0,0 +1,287 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+
+import numpy as np
+
+# Thêm đường dẫn để import config và src
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from config import Config
+from src.core.answer_keys import AnswerKeySet
+from src.core.calibration import OMRCalibrator
+from src.core.processor import Processor
+from src.core.quality_gate import ImageRejectedError
+from src.utils import config_profile, file_io
+
+# Các bước được đo thời gian trên từng phiếu (hook on_stage của Processor, theo thứ tự chạy)
+STAGES = ("decode", "quality", "warp", "identity", "threshold", "read")
+BUBBLE_KEYS = {"sbd": "mssv_bubbles", "version": "version_bubbles", "answers": "answer_bubbles"}
+DEFAULT_FILL_TOLERANCE = 0.1
+# Khác biệt về kết quả chấm (luôn là lỗi); lệch tỷ lệ tô chỉ là lỗi với --strict-fill
+DECISION_FIELDS = ("status", "sbd", "version", "score_raw", "answers")
+
+
+def build_config(profile=None, overrides=(), input_paths=(), template_data=None):
+    """
+    Candidate configuration like main.py builds it: defaults, profile,
+    overrides, then the batch calibration (if enabled), frozen.
+    """
+    cfg = config_profile.configure(profile, overrides)
+    if cfg.Calibration.ENABLED:
+        calibrator = OMRCalibrator(cfg)
+        with contextlib.redirect_stdout(io.StringIO()):
+            pages = calibrator.binarize_images(list(input_paths)[:cfg.Calibration.SAMPLE_SHEETS], template_data)
+        calibration = calibrator.fit(pages, template_data)
+        if calibration is not None:
+            OMRCalibrator.apply(cfg, calibration)
+    return cfg.freeze()
+
+
+def grade_sheet(processor, image_path, template_data, answer_keys):
+    """
+    Grades one image with Processor.process_exam_paper, timing its stages
+    through the processor's on_stage hook.
+
+    Returns:
+        tuple: (structured result, {stage: seconds}). The result holds
+        "status", and for graded sheets "sbd", "version", "answers" (one
+        choice index per question, -1 = blank), "score_raw" and "fill"
+        (fill ratio of every bubble per block: marked pixels / disk area).
+    """
+    cfg = processor.cfg
+    timing = {}
+    processor.on_stage = timing.__setitem__
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results, _ = processor.process_exam_paper(image_path, template_data, answer_keys)
+    except ImageRejectedError as e:
+        return {"status": "rejected", "reason": e.reason}, timing
+    except ValueError:
+        # Chỉ lỗi đọc ảnh (trước bước decode) là "unreadable"; lỗi khác vẫn được báo
+        if "decode" in timing:
+            raise
+        return {"status": "unreadable"}, timing
+    finally:
+        processor.on_stage = None
+
+    thresh = results["binary_img"]
+    key = results.get("answer_key")
+    num_questions = len(key) if key is not None else len(template_data.get("answer_bubbles", []))
+    answers = results.get("answers", {})
+    area = len(processor.omr._disk_offsets(cfg.OMR.SCAN_RADIUS)[0])
+    fill = {
+        name: np.round(processor.omr.bubble_fill_counts(thresh, template_data[key]) / area, 3).tolist()
+        for name, key in BUBBLE_KEYS.items() if template_data.get(key)
+    }
+    return {
+        "status": "ok",
+        "sbd": results.get("sbd"),
+        "version": results.get("version"),
+        "answers": [int(answers.get(i, -1)) for i in range(num_questions)],
+        "score_raw": int(results.get("score_raw", 0)),
+        "fill": fill,
+    }, timing
+
+
+def run_batch(cfg, image_paths, template_data, answer_keys, repeat=1):
+    """
+    Grades every image `repeat` times.
+
+    Returns:
+        tuple: ({image name: result}, {stage: median ms per sheet}).
+    """
+    processor = Processor(cfg)
+    results, samples = {}, {stage: [] for stage in STAGES}
+    for _ in range(max(repeat, 1)):
+        for path in image_paths:
+            result, timing = grade_sheet(processor, path, template_data, answer_keys)
+            results[os.path.basename(path)] = result
+            for stage in STAGES:
+                samples[stage].append(timing.get(stage, 0.0))
+    stage_ms = {stage: float(np.median(values)) * 1000 if values else 0.0 for stage, values in samples.items()}
+    return results, stage_ms
+
+
+def compare(expected, actual, fill_tolerance):
+    """
+    Differences of one sheet against its golden result.
+
+    Returns:
+        dict: {"status", "sbd", "version", "score_raw" (pairs when they differ),
+        "answers" (questions read differently), "fill_outside" (bubbles whose
+        fill ratio moved more than the tolerance), "fill_max_delta"}; empty
+        fields are left out, so an identical sheet gives {}.
+    """
+    diff = {}
+    if expected.get("status") != actual.get("status"):
+        diff["status"] = [expected.get("status"), actual.get("status")]
+        return diff
+    if expected["status"] != "ok":
+        return diff
+    for field in ("sbd", "version", "score_raw"):
+        if expected.get(field) != actual.get(field):
+            diff[field] = [expected.get(field), actual.get(field)]
+    changed = [q + 1 for q, (a, b) in enumerate(zip(expected["answers"], actual["answers"])) if a != b]
+    changed += list(range(len(expected["answers"]) + 1, len(actual["answers"]) + 1))
+    if changed:
+        diff["answers"] = changed
+
+    outside, max_delta = 0, 0.0
+    for block, ratios in expected.get("fill", {}).items():
+        if block not in actual.get("fill", {}):
+            continue
+        delta = np.abs(np.asarray(ratios, dtype=float) - np.asarray(actual["fill"][block], dtype=float))
+        outside += int(np.count_nonzero(delta > fill_tolerance))
+        max_delta = max(max_delta, float(delta.max(initial=0.0)))
+    if outside:
+        diff["fill_outside"] = outside
+    if max_delta:
+        diff["fill_max_delta"] = round(max_delta, 3)
+    return diff
+
+
+def print_report(diffs, golden_sheets, candidate, baseline_ms, candidate_ms, fill_tolerance, strict_fill=False):
+    """Prints the per-sheet diff, the accuracy summary and the stage timings; returns True when it passes."""
+    graded = [name for name, g in golden_sheets.items() if g["status"] == "ok" and name in candidate]
+    questions = sum(len(golden_sheets[n]["answers"]) for n in graded)
+    answer_changes = sum(len(diffs[n].get("answers", [])) for n in graded)
+    sbd_changes = sum("sbd" in diffs[n] for n in graded)
+    changed = [name for name, d in diffs.items() if any(f in d for f in DECISION_FIELDS)]
+    drifted = [name for name, d in diffs.items() if "fill_outside" in d]
+
+    print(f"\n{'sheet':<16} result")
+    for name in sorted(golden_sheets):
+        if name not in candidate:
+            print(f"{name:<16} MISSING (image not found)")
+            continue
+        diff = diffs[name]
+        decisions = [f"{k}={diff[k]}" for k in DECISION_FIELDS if k in diff]
+        fill = f"fill max delta {diff.get('fill_max_delta', 0.0)}"
+        if "fill_outside" in diff:
+            fill += f", {diff['fill_outside']} bubble(s) beyond {fill_tolerance}"
+        print(f"{name:<16} {', '.join(decisions) or 'same'} ({fill})")
+
+    print(f"\n--> Accuracy: {len(diffs) - len(changed)}/{len(golden_sheets)} sheets graded identically | "
+          f"answers {questions - answer_changes}/{questions} | SBD {len(graded) - sbd_changes}/{len(graded)} | "
+          f"fill drift on {len(drifted)} sheet(s)")
+
+    print(f"\n{'stage':<10} {'golden cfg':>11} {'candidate':>10} {'speedup':>8}   (median ms / sheet)")
+    for stage in STAGES + ("total",):
+        base = sum(baseline_ms.values()) if stage == "total" else baseline_ms[stage]
+        cand = sum(candidate_ms.values()) if stage == "total" else candidate_ms[stage]
+        speedup = f"{base / cand:.2f}x" if cand > 0 else "-"
+        print(f"{stage:<10} {base:>11.2f} {cand:>10.2f} {speedup:>8}")
+    return not changed and len(diffs) == len(golden_sheets) and not (strict_fill and drifted)
+
+
+def check_regression(golden_path, input_dir, template_path, answer_key_path, profile=None, overrides=(),
+                     repeat=3, fill_tolerance=None, strict_fill=False, update=False, report_path=None):
+    """
+    Grades the batch with the candidate configuration (profile + overrides)
+    and compares it with the golden results: grades (status, SBD, version,
+    answers, score) must not change, fill ratios may move by fill_tolerance.
+    Speed is compared with the configuration the golden file was made with,
+    timed again here so both run on the same machine.
+
+    With update=True the candidate results become the new golden results.
+
+    Returns:
+        bool: True when the candidate passes (or the golden file was written).
+
+    Raises:
+        ConfigError: Invalid candidate profile / overrides.
+        ValueError: Missing template, answer key or golden file.
+    """
+    overrides = list(overrides)
+    template_data = file_io.load_json(template_path)
+    if template_data is None:
+        raise ValueError(f"Could not load the template {template_path}")
+    image_paths = [os.path.join(input_dir, f) for f in sorted(os.listdir(input_dir))
+                   if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+
+    candidate_cfg = build_config(profile, overrides, image_paths, template_data)
+    keys = file_io.load_answer_keys(answer_key_path, candidate_cfg.OMR.ANSWER_MAP, candidate_cfg.OMR.DEFAULT_VERSION)
+    if not keys:
+        raise ValueError(f"Could not load the answer key {answer_key_path}")
+    answer_keys = AnswerKeySet(keys)
+    candidate, candidate_ms = run_batch(candidate_cfg, image_paths, template_data, answer_keys, repeat)
+
+    if update:
+        # Ghi chú kiểm tra bằng mắt của từng phiếu được giữ lại khi tạo lại golden
+        previous = file_io.load_json(golden_path) if os.path.exists(golden_path) else None
+        golden = {
+            "config": {"profile": profile, "overrides": overrides},
+            "fill_tolerance": fill_tolerance if fill_tolerance is not None else DEFAULT_FILL_TOLERANCE,
+            "notes": (previous or {}).get("notes", {}),
+            "sheets": candidate,
+        }
+        os.makedirs(os.path.dirname(golden_path), exist_ok=True)
+        file_io.save_json(golden, golden_path)
+        print(f"--> {len(candidate)} golden result(s) written; stage times (ms/sheet): "
+              + ", ".join(f"{stage} {ms:.1f}" for stage, ms in candidate_ms.items()))
+        return True
+
+    golden = file_io.load_json(golden_path)
+    if golden is None:
+        raise ValueError(f"No golden results at {golden_path} (create them with --update)")
+    if fill_tolerance is None:
+        fill_tolerance = golden["fill_tolerance"]
+
+    # Tốc độ được so với cấu hình đã tạo golden, đo lại ngay trên máy này
+    if [golden["config"]["profile"], golden["config"]["overrides"]] == [profile, overrides]:
+        baseline_ms = candidate_ms
+    else:
+        base_cfg = build_config(golden["config"]["profile"], golden["config"]["overrides"], image_paths, template_data)
+        _, baseline_ms = run_batch(base_cfg, image_paths, template_data, answer_keys, repeat)
+
+    diffs = {name: compare(expected, candidate[name], fill_tolerance)
+             for name, expected in golden["sheets"].items() if name in candidate}
+    print(f"--> Candidate: profile {profile or '-'}, overrides {' '.join(overrides) or '-'} | "
+          f"fill tolerance {fill_tolerance}")
+    ok = print_report(diffs, golden["sheets"], candidate, baseline_ms, candidate_ms, fill_tolerance,
+                      strict_fill)
+    if report_path:
+        file_io.save_json({"candidate": {"profile": profile, "overrides": overrides}, "passed": ok,
+                           "diffs": diffs, "baseline_ms": baseline_ms, "candidate_ms": candidate_ms}, report_path)
+    print("--> PASS" if ok else "--> FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    cfg = Config()
+    parser = argparse.ArgumentParser(
+        description="Compare a candidate engine configuration against the golden results of a batch "
+                    "(accuracy diff and per-stage speedup)."
+    )
+    parser.add_argument("--golden", default=cfg.Paths.GOLDEN_RESULTS_PATH, help="Golden results JSON")
+    parser.add_argument("--input", default=cfg.Paths.BATCH_INPUT_DIR, help="Folder of sheet images")
+    parser.add_argument("--template", default=cfg.Paths.COORDINATES_PATH, help="coordinates.json")
+    parser.add_argument("--answers", default=cfg.Paths.ANSWER_KEY_PATH, help="Answer key file")
+    parser.add_argument("--profile", default=None, help="Candidate config profile (see main.py --profile)")
+    parser.add_argument("--set", action="append", default=[], metavar="SECTION.KEY=VALUE",
+                        help="Candidate config override (repeatable)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing repetitions per image")
+    parser.add_argument("--fill-tolerance", type=float, default=None,
+                        help=f"Allowed fill ratio change per bubble (default: golden file or "
+                             f"{DEFAULT_FILL_TOLERANCE})")
+    parser.add_argument("--strict-fill", action="store_true",
+                        help="Also fail when a fill ratio moves beyond the tolerance (not only on changed grades)")
+    parser.add_argument("--update", action="store_true",
+                        help="Write the candidate results as the new golden results")
+    parser.add_argument("--report", default=None, help="Also save the per-sheet diff as JSON")
+    args = parser.parse_args()
+
+    try:
+        passed = check_regression(
+            args.golden, args.input, args.template, args.answers, args.profile, args.set, args.repeat,
+            args.fill_tolerance, args.strict_fill, args.update, args.report
+        )
+    except ValueError as e:
+        # ConfigError cũng là ValueError
+        sys.exit(f"Error: {e}")
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,65 @@
+import argparse
+import os
+import sys
+import time
+
+# Thêm đường dẫn để import config và src
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from config import Config
+from src.core.answer_keys import AnswerKeySet
+from src.core.processor import Processor
+from src.utils import file_io
+from src.utils.sheet_store import WarpedSheetStore
+
+
+def rescore_store(store_dir, template_path, answer_key_path, cfg=None):
+    """
+    Chấm lại toàn bộ trang trong kho memmap, không đọc lại JPEG, không warp lại.
+    Dùng khi đổi ngưỡng, bán kính quét hoặc template.
+
+    Returns:
+        dict: {sheet_id: results}
+    """
+    cfg = cfg or Config()
+    processor = Processor(cfg)
+    template_data = file_io.load_json(template_path)
+    keys = file_io.load_answer_keys(answer_key_path, cfg.OMR.ANSWER_MAP, cfg.OMR.DEFAULT_VERSION)
+    if template_data is None or not keys:
+        return {}
+    answer_keys = AnswerKeySet(keys)
+
+    store = WarpedSheetStore(store_dir)
+    print(f"--> Store: {len(store)} pages ({'packed binary' if store.packed else 'grayscale'})")
+
+    all_results = {}
+    start = time.perf_counter()
+    for sheet_id, page in store.items():
+        # Kho packed chứa sẵn ảnh nhị phân -> bỏ qua bước phân ngưỡng
+        thresh = page if store.packed else None
+        results = processor.process_warped(page, template_data, answer_keys, thresh)
+        all_results[sheet_id] = results
+        key = results.get("answer_key")
+        total = len(key) if key is not None else 0
+        print(f" {sheet_id}: SBD={results['sbd']} | Version={results['version']} "
+              f"| Score={results.get('score_raw', 0)}/{total}")
+    elapsed = time.perf_counter() - start
+    store.close()
+
+    if all_results:
+        print(f"--> Rescored {len(all_results)} pages in {elapsed:.2f}s "
+              f"({elapsed / len(all_results) * 1000:.1f} ms/page)")
+    return all_results
+
+
+if __name__ == "__main__":
+    cfg = Config()
+    parser = argparse.ArgumentParser(description="Re-score warped sheets from a memory-mapped store.")
+    parser.add_argument("--store", default=cfg.Paths.SHEET_STORE_DIR, help="Store directory")
+    parser.add_argument("--template", default=cfg.Paths.COORDINATES_PATH, help="coordinates.json")
+    parser.add_argument("--answers", default=cfg.Paths.ANSWER_KEY_PATH, help="Answer key (CSV/JSON)")
+    args = parser.parse_args()
+
+    rescore_store(args.store, args.template, args.answers, cfg)
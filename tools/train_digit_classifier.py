@@ -0,0 +1,197 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# Thêm đường dẫn để import config và src
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from config import Config
+from src.core.digit_reader import DigitClassifier, IdDigitReader, normalize_box
+from src.utils import file_io
+
+# Ô viết tay trên ảnh chuẩn: cạnh ~29px (16pt), cắt thêm lề như IdDigits.BOX_MARGIN
+BOX_PX = 29
+SUPERSAMPLE = 4
+HERSHEY_FONTS = [
+    cv2.FONT_HERSHEY_SIMPLEX, cv2.FONT_HERSHEY_PLAIN, cv2.FONT_HERSHEY_DUPLEX, cv2.FONT_HERSHEY_COMPLEX,
+    cv2.FONT_HERSHEY_TRIPLEX, cv2.FONT_HERSHEY_SCRIPT_SIMPLEX, cv2.FONT_HERSHEY_SCRIPT_COMPLEX,
+]
+
+
+def _arc(cx, cy, rx, ry, a0, a1, n=24):
+    t = np.radians(np.linspace(a0, a1, n))
+    return np.stack([cx + rx * np.cos(t), cy + ry * np.sin(t)], axis=1)
+
+
+def _line(*points):
+    return np.array(points, dtype=float)
+
+
+def _strokes(digit, rng):
+    """Nét bút của một chữ số viết tay trong ô đơn vị (y hướng xuống), có vài kiểu viết."""
+    style = rng.integers(3)
+    if digit == 0:
+        return [_arc(.5, .5, .32, .46, rng.uniform(-150, -60), rng.uniform(220, 300))]
+    if digit == 1:
+        strokes = [_line((.55, .03), (.5, .97))]
+        if style > 0:
+            # Số 1 có mỏ (kiểu viết tay châu Âu: mỏ dài gần nửa chiều cao)
+            strokes.append(_line((rng.uniform(.05, .3), rng.uniform(.25, .55)), (.55, .03)))
+        if style == 2 and rng.random() < .5:
+            strokes.append(_line((.3, .97), (.75, .97)))
+        return strokes
+    if digit == 2:
+        top = _arc(.5, .3, .32, .27, rng.uniform(170, 200), rng.uniform(370, 400))
+        if style == 2:
+            # Số 2 có vòng ở chân
+            return [np.vstack([top, _line((.2, .88)), _arc(.3, .86, .1, .08, 180, -170), _line((.9, .93))])]
+        return [np.vstack([top, _line((.15, .95), (.88, .95))])]
+    if digit == 3:
+        return [np.vstack([_arc(.48, .27, .3, .23, 200, 450), _arc(.48, .73, .33, .23, 270, 520)])]
+    if digit == 4:
+        if style == 0:
+            return [_line((.68, .95), (.68, .03), (.1, .66), (.9, .66))]
+        return [_line((.25, .03), (.15, .62), (.88, .62)), _line((.68, .25), (.68, .97))]
+    if digit == 5:
+        return [_line((.82, .04), (.3, .04), (.24, .46)), _arc(.48, .68, .33, .28, 215, 500)]
+    if digit == 6:
+        return [np.vstack([_arc(.62, .55, .42, .52, 265, 180), _arc(.5, .72, .3, .25, 180, 540)])]
+    if digit == 7:
+        strokes = [_line((.12, .05), (.88, .05), (.4, .97))]
+        if style == 2:
+            strokes.append(_line((.35, .52), (.78, .52)))
+        return strokes
+    if digit == 8:
+        return [np.vstack([_arc(.5, .27, .26, .23, 90, 450), _arc(.5, .72, .31, .24, -90, 270)])]
+    tail = _line((.8, .3), (.72, .97)) if style < 2 else _arc(.2, .3, .6, .66, 0, 80)
+    return [_arc(.5, .3, .3, .26, 0, 360), tail]
+
+
+def _draw_handwritten(digit, rng, side):
+    """Chữ số 'viết tay': nét bút bị rung, nghiêng, méo ngẫu nhiên (ảnh phóng SUPERSAMPLE lần)."""
+    img = np.zeros((side, side), dtype=np.uint8)
+    height = rng.uniform(0.5, 0.8) * side
+    width = height * rng.uniform(0.55, 0.85)
+    slant = rng.uniform(-0.35, 0.15)
+    distort = rng.normal(0, 0.04, (2, 2)) + np.eye(2)
+    cx, cy = side / 2 + rng.normal(0, 1.2 * SUPERSAMPLE, 2)
+    thickness = max(1, int(rng.uniform(0.6, 2.4) * SUPERSAMPLE))
+    for stroke in _strokes(digit, rng):
+        p = (stroke + rng.normal(0, 0.025, stroke.shape) - 0.5) @ distort.T
+        x = p[:, 0] * width - slant * p[:, 1] * height + cx
+        y = p[:, 1] * height + cy
+        x += rng.normal(0, 0.6 * SUPERSAMPLE) * np.sin(np.linspace(0, np.pi, len(x)) * rng.uniform(1, 3))
+        cv2.polylines(img, [np.round(np.stack([x, y], axis=1)).astype(np.int32)], False, 255, thickness, cv2.LINE_AA)
+    return img
+
+
+def _draw_font(digit, rng, side):
+    """Chữ số in bằng một font Hershey ngẫu nhiên (có thể nghiêng)."""
+    img = np.zeros((side, side), dtype=np.uint8)
+    font = HERSHEY_FONTS[rng.integers(len(HERSHEY_FONTS))] | (cv2.FONT_ITALIC if rng.random() < 0.3 else 0)
+    thickness = max(1, int(rng.uniform(0.6, 2.6) * SUPERSAMPLE))
+    _, text_h = cv2.getTextSize(str(digit), font, 1.0, thickness)[0]
+    scale = rng.uniform(0.45, 0.8) * BOX_PX * SUPERSAMPLE / text_h
+    (text_w, text_h), _ = cv2.getTextSize(str(digit), font, scale, thickness)
+    cx, cy = side / 2 + rng.normal(0, 1.5 * SUPERSAMPLE, 2)
+    cv2.putText(img, str(digit), (int(cx - text_w / 2), int(cy + text_h / 2)), font, scale, 255, thickness,
+                cv2.LINE_AA)
+    return img
+
+
+def render_box(digit, rng, margin):
+    """
+    Ảnh xám một ô viết tay như trên phiếu đã warp: chữ số (viết tay tổng hợp
+    hoặc font), khung in lệch vài px, mờ, nhiễu, độ sáng giấy / mực ngẫu nhiên.
+    """
+    side = (BOX_PX + 2 * margin) * SUPERSAMPLE
+    draw = _draw_handwritten if rng.random() < 0.6 else _draw_font
+    img = draw(digit, rng, side).astype(np.float32) / 255
+
+    matrix = cv2.getRotationMatrix2D((side / 2, side / 2), rng.uniform(-12, 12), rng.uniform(0.85, 1.1))
+    shear = rng.uniform(-0.3, 0.3)
+    matrix[0, 1] += shear
+    matrix[0, 2] -= shear * side / 2
+    img = cv2.warpAffine(img, matrix, (side, side))
+
+    frame = np.zeros_like(img)
+    x0, y0 = margin * SUPERSAMPLE + rng.normal(0, 1.5 * SUPERSAMPLE, 2)
+    cv2.rectangle(frame, (int(x0), int(y0)), (int(x0 + BOX_PX * SUPERSAMPLE), int(y0 + BOX_PX * SUPERSAMPLE)),
+                  1.0, int(rng.uniform(1, 3.5) * SUPERSAMPLE))
+    img = np.maximum(img, frame)
+
+    img = cv2.resize(img, (side // SUPERSAMPLE, side // SUPERSAMPLE), interpolation=cv2.INTER_AREA)
+    img = cv2.GaussianBlur(img, (0, 0), rng.uniform(0.3, 1.2))
+    paper = rng.uniform(120, 250)
+    pen = rng.uniform(0, paper - 60)
+    gray = paper - (paper - pen) * np.clip(img, 0, 1) + rng.normal(0, rng.uniform(1, 8), img.shape)
+    return np.clip(gray, 0, 255).astype(np.uint8)
+
+
+def synthetic_set(count, margin, seed):
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(0, 10, count)
+    features = np.stack([normalize_box(render_box(int(d), rng, margin)) for d in labels])
+    return features, labels
+
+
+def check_sheets(cfg, classifier, input_dir, template_path):
+    """In chữ số viết tay đọc được cạnh SBD tô của từng ảnh trong thư mục."""
+    from src.core.processor import Processor
+
+    processor = Processor(cfg)
+    reader = IdDigitReader(cfg, classifier)
+    template_data = file_io.load_json(template_path)
+    names, pages, bubbled = [], [], []
+    for name in sorted(os.listdir(input_dir)):
+        image = cv2.imread(os.path.join(input_dir, name))
+        if image is None:
+            continue
+        report = processor.quality.assess(image, template_data)
+        if not report["ok"]:
+            continue
+        warped = processor.img_utils.warp_quad(image, report["quad"])
+        names.append(name)
+        pages.append(warped)
+        bubbled.append(processor.omr.process_sbd(warped, template_data["mssv_bubbles"]))
+    # Mọi ô viết tay của cả thư mục được phân loại trong một lần gọi
+    for name, sbd, written in zip(names, bubbled, reader.read_many(pages, template_data)):
+        print(f"{name:<20} bubbled {sbd}  written {written['digits']}  "
+              f"min confidence {min(written['confidence'], default=0):.2f}")
+
+
+if __name__ == "__main__":
+    cfg = Config()
+    parser = argparse.ArgumentParser(description="Train the handwritten SBD digit classifier on synthetic boxes.")
+    parser.add_argument("--samples", type=int, default=60000, help="Synthetic training boxes")
+    parser.add_argument("--hidden", type=int, default=128, help="Hidden units")
+    parser.add_argument("--epochs", type=int, default=25, help="Training epochs")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (data and weights)")
+    parser.add_argument("--output", default=cfg.Paths.DIGIT_MODEL_PATH, help="Model file (.npz)")
+    parser.add_argument("--check", default=None, metavar="DIR",
+                        help="After training, compare written and bubbled SBDs of the sheets in DIR")
+    parser.add_argument("--template", default=cfg.Paths.COORDINATES_PATH, help="coordinates.json for --check")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    margin = cfg.IdDigits.BOX_MARGIN
+    train_x, train_y = synthetic_set(args.samples, margin, args.seed)
+    test_x, test_y = synthetic_set(max(args.samples // 10, 1000), margin, args.seed + 1)
+    print(f"--> {args.samples} synthetic boxes in {time.perf_counter() - start:.1f}s")
+
+    def log(epoch, model):
+        accuracy = float(np.mean(model.predict(test_x)[0] == test_y))
+        print(f" epoch {epoch + 1:>2}/{args.epochs}: held-out accuracy {accuracy:.3f}")
+
+    classifier = DigitClassifier.train(train_x, train_y, args.hidden, args.epochs, seed=args.seed, log=log)
+    classifier.save(args.output)
+    print(f"--> Saved {args.output} ({time.perf_counter() - start:.1f}s)")
+
+    if args.check:
+        check_sheets(cfg, classifier, args.check, args.template)